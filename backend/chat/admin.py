@@ -1,31 +1,228 @@
 """
 Admin configuration for chat models.
+
+The change lists are built to stay fast on very large tables: message
+counts come from a correlated subquery evaluated only for the rows on the
+page (or from the archive, for archived conversations), unfiltered lists are paginated with an estimated row count, the date
+hierarchy probes timestamp index ranges instead of scanning for distinct
+dates, and message search uses a full-text index on PostgreSQL.
 """
+from datetime import datetime, timedelta
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, IntegerField, Max, Min, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import caching
+from .history_cache import history_cache
 from .models import Conversation, Message
 
+# Django's own full-text expression; the GIN index in migration 0010 is built on exactly this
+FULL_TEXT_CONFIG = 'english'
+
+
+def estimated_row_count(model, using: str):
+    """
+    Cheap estimate of a table's row count from database statistics, or None
+    if the backend has none.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [table]
+            )
+        else:
+            # Highest primary key: one index lookup, exact unless rows were deleted
+            cursor.execute(f'SELECT MAX({model._meta.pk.column}) FROM {table}')
+        row = cursor.fetchone()
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids COUNT(*) over huge tables: unfiltered lists use the
+    table estimate once it exceeds ADMIN_EXACT_COUNT_LIMIT, and filtered
+    counts stop at ADMIN_EXACT_COUNT_LIMIT.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+            return super().count
+        return queryset.order_by()[:limit].count()
+
+
+class IndexedDateQuerySet(QuerySet):
+    """
+    QuerySet whose datetimes() (used by the admin date hierarchy) probes one
+    index range per year, month or day between the first and last value
+    instead of computing DISTINCT truncated dates over every row.
+    """
+    MAX_PROBES = 400
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None, **kwargs):
+        if kind not in ('year', 'month', 'day') or order != 'ASC':
+            return super().datetimes(field_name, kind, order, tzinfo, **kwargs)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+
+        tz = tzinfo or timezone.get_current_timezone()
+        periods = list(_periods(timezone.localtime(bounds['first'], tz), timezone.localtime(bounds['last'], tz), kind))
+        if len(periods) > self.MAX_PROBES:
+            return super().datetimes(field_name, kind, order, tzinfo, **kwargs)
+
+        found = []
+        for start, end in periods:
+            start, end = timezone.make_aware(start, tz), timezone.make_aware(end, tz)
+            if self.filter(**{f'{field_name}__gte': start, f'{field_name}__lt': end}).exists():
+                found.append(start)
+        return found
+
+
+def _periods(first: datetime, last: datetime, kind: str):
+    """(start, end) naive datetimes of each year, month or day from first to last."""
+    if kind == 'year':
+        for year in range(first.year, last.year + 1):
+            yield datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    elif kind == 'month':
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+            yield datetime(year, month, 1), datetime(next_year, next_month, 1)
+            year, month = next_year, next_month
+    else:
+        day = datetime(first.year, first.month, first.day)
+        while day.date() <= last.date():
+            yield day, day + timedelta(days=1)
+            day += timedelta(days=1)
+
+
+def indexed_dates(queryset: QuerySet) -> IndexedDateQuerySet:
+    return IndexedDateQuerySet(queryset.model, query=queryset.query.chain(), using=queryset._db)
+
+
+def _conversation_id(obj) -> int:
+    return obj.conversation_id if isinstance(obj, Message) else obj.id
+
+
+def record_admin_write(conversation_ids):
+    """
+    Invalidate what an admin edit or deletion made stale, as the API write
+    path does: each conversation's validators and cached payloads, its
+    prompt history, and cached lists and search results.
+    """
+    for conversation_id in set(conversation_ids):
+        caching.touch_conversation(conversation_id)
+        history_cache.invalidate(conversation_id)
+
+
+class ConversationWriteMixin:
+    """Admin edits and deletions invalidate caches like writes through the API."""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        conversation_ids = [_conversation_id(obj)]
+        if change and isinstance(obj, Message) and 'conversation' in form.changed_data:
+            # Moved to another conversation: the old one lost a message
+            conversation_ids.append(form.initial['conversation'])
+        record_admin_write(conversation_ids)
+
+    def delete_model(self, request, obj):
+        conversation_id = _conversation_id(obj)
+        super().delete_model(request, obj)
+        record_admin_write([conversation_id])
+
+    def delete_queryset(self, request, queryset):
+        if queryset.model is Message:
+            conversation_ids = list(queryset.order_by().values_list('conversation_id', flat=True).distinct())
+        else:
+            conversation_ids = list(queryset.values_list('id', flat=True))
+        super().delete_queryset(request, queryset)
+        record_admin_write(conversation_ids)
+
 
 @admin.register(Conversation)
-class ConversationAdmin(admin.ModelAdmin):
+class ConversationAdmin(ConversationWriteMixin, admin.ModelAdmin):
     """Admin interface for Conversation model."""
     list_display = ['id', 'title', 'status', 'start_timestamp', 'end_timestamp', 'message_count']
     list_filter = ['status', 'start_timestamp']
-    search_fields = ['title', 'ai_summary']
+    search_fields = ['=id', 'title', 'ai_summary']
     readonly_fields = ['start_timestamp', 'end_timestamp']
-    
+    date_hierarchy = 'start_timestamp'
+    list_select_related = ['archive']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        live_count = Message.objects.filter(
+            conversation=OuterRef('pk')
+        ).order_by().values('conversation').annotate(count=Count('id')).values('count')
+        # Archived conversations have no live messages; their count is kept on the archive
+        queryset = super().get_queryset(request).annotate(
+            total_message_count=Coalesce(
+                'archive__message_count', Subquery(live_count, output_field=IntegerField()), 0
+            )
+        )
+        return indexed_dates(queryset)
+
     def message_count(self, obj):
-        return obj.get_message_count()
+        return obj.total_message_count
     message_count.short_description = 'Messages'
+    message_count.admin_order_field = 'total_message_count'
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(ConversationWriteMixin, admin.ModelAdmin):
     """Admin interface for Message model."""
     list_display = ['id', 'conversation', 'sender', 'timestamp', 'content_preview']
-    list_filter = ['sender', 'timestamp']
+    list_filter = ['sender', 'status', 'timestamp']
     search_fields = ['content']
+    search_help_text = 'Words in the message, or a conversation id as #123'
     readonly_fields = ['timestamp']
-    
+    raw_id_fields = ['conversation']
+    date_hierarchy = 'timestamp'
+    list_select_related = ['conversation']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return indexed_dates(super().get_queryset(request))
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        "#123" filters by conversation (indexed). On PostgreSQL, other terms
+        use the full-text GIN index instead of an unindexed LIKE scan.
+        """
+        term = search_term.strip()
+        if term.startswith('#') and term[1:].isdigit():
+            return queryset.filter(conversation_id=int(term[1:])), False
+        if term and connections[queryset.db].vendor == 'postgresql':
+            from django.contrib.postgres.search import SearchQuery, SearchVector
+            queryset = queryset.annotate(
+                search=SearchVector('content', config=FULL_TEXT_CONFIG)
+            ).filter(search=SearchQuery(term, config=FULL_TEXT_CONFIG, search_type='websearch'))
+            return queryset, False
+        return super().get_search_results(request, queryset, search_term)
+
     def content_preview(self, obj):
         return obj.content[:100] + '...' if len(obj.content) > 100 else obj.content
     content_preview.short_description = 'Content'
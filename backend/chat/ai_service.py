@@ -1,10 +1,16 @@
 """
 AI Service for handling LLM interactions and conversation intelligence.
 """
-import os
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from django.conf import settings
 
+from . import routing, summarization, topics
+from .deadlines import Deadline, DeadlineExceeded, RequestCancelled
+from .profiling import timed
+from .providers import get_client
+from .settings_store import ai_settings
+
 
 class AIService:
     """
@@ -13,50 +19,142 @@ class AIService:
     """
     
     def __init__(self, provider: str = None):
-        self.provider = provider or settings.AI_PROVIDER
-        self.model = settings.AI_MODEL
+        self.config = ai_settings.snapshot()
+        self.provider = provider or self.config.AI_PROVIDER
+        self.model = self.config.AI_MODEL
+        self.max_tokens = 2000
+        # Provider and model a routed turn starts from
+        self._default_route = (self.provider, self.model)
+        # Routing decision of the current chat turn, see route()
+        self.routing: Dict[str, Any] = {}
+        # Token usage of each call made through this service, see _record_usage
+        self.usage: List[Dict[str, Any]] = []
+        # Deadline of the request this service works for (see chat.deadlines), if any
+        self.deadline: Optional[Deadline] = None
+        # Shared limiter every provider call waits for (see chat.backfill.RateLimiter), if any
+        self.rate_limiter = None
+        # Parallel chunk summaries of one conversation, if not SUMMARY_MAP_WORKERS
+        self.map_workers: Optional[int] = None
         self._initialize_client()
     
     def _initialize_client(self):
-        """Initialize the appropriate AI client based on provider."""
-        if self.provider == 'openai':
-            import openai
-            self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+        """
+        Get the pooled client for the provider. The provider SDK is imported
+        on first use only.
+        """
+        self.client = get_client(self.provider, self.model, self.config)
+    
+    def use_model(self, model: str):
+        """Switch this service to another model of the same provider."""
+        self.model = model
+        self._initialize_client()
+    
+    def route(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Pick the provider, model and max_tokens for a chat turn (see
+        chat.routing) and switch this service to them.
+        
+        Returns:
+            The routing decision, also recorded with the turn's token usage
+        """
+        if not settings.AI_ROUTING_ENABLED:
+            return {}
+        decision = routing.route(messages, *self._default_route)
+        if (decision['provider'], decision['model']) != (self.provider, self.model):
+            self.provider = decision['provider']
+            self.model = decision['model']
+            self._initialize_client()
+        self.max_tokens = decision['max_tokens']
+        self.routing = decision
+        return decision
+    
+    def _usage_from_response(self, response) -> Dict[str, int]:
+        """Extract prompt, completion and cached token counts from a provider response."""
+        if self.provider in ['openai', 'lmstudio']:
+            usage = getattr(response, 'usage', None)
+            details = getattr(usage, 'prompt_tokens_details', None)
+            return {
+                'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+                'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+                'cached_tokens': getattr(details, 'cached_tokens', 0) or 0,
+            }
         elif self.provider == 'anthropic':
-            import anthropic
-            self.client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
+            usage = getattr(response, 'usage', None)
+            return {
+                'prompt_tokens': getattr(usage, 'input_tokens', 0) or 0,
+                'completion_tokens': getattr(usage, 'output_tokens', 0) or 0,
+                'cached_tokens': getattr(usage, 'cache_read_input_tokens', 0) or 0,
+            }
         elif self.provider == 'google':
-            import google.generativeai as genai
-            genai.configure(api_key=settings.GOOGLE_API_KEY)
-            self.client = genai.GenerativeModel(self.model)
-        elif self.provider == 'lmstudio':
-            import openai
-            self.client = openai.OpenAI(
-                base_url=settings.LM_STUDIO_BASE_URL,
-                api_key=settings.LM_STUDIO_API_KEY
-            )
-        else:
-            raise ValueError(f"Unsupported AI provider: {self.provider}")
+            usage = getattr(response, 'usage_metadata', None)
+            return {
+                'prompt_tokens': getattr(usage, 'prompt_token_count', 0) or 0,
+                'completion_tokens': getattr(usage, 'candidates_token_count', 0) or 0,
+                'cached_tokens': getattr(usage, 'cached_content_token_count', 0) or 0,
+            }
+        return {}
+    
+    def _record_usage(self, response, started: float, purpose: str):
+        """Remember the token usage and latency of one provider call."""
+        self.usage.append({
+            'purpose': purpose,
+            'provider': self.provider,
+            'model': self.model,
+            'latency_ms': int((time.monotonic() - started) * 1000),
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'cached_tokens': 0,
+            'routing': self.routing if purpose == 'chat' else {},
+            **self._usage_from_response(response),
+        })
+    
+    def _timeout(self) -> Dict[str, float]:
+        """
+        Provider call options for the time left until the deadline.
+        
+        Raises:
+            DeadlineExceeded: If no time is left or the client has gone
+        """
+        if self.deadline is None:
+            return {}
+        self.deadline.check()
+        remaining = self.deadline.remaining()
+        return {} if remaining is None else {'timeout': remaining}
+    
+    def _wait_for_rate_limit(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+    
+    def _check_deadline(self):
+        if self.deadline is not None:
+            self.deadline.check()
     
-    def generate_response(self, messages: List[Dict[str, str]]) -> str:
+    @timed('ai')
+    def generate_response(self, messages: List[Dict[str, str]], purpose: str = 'chat') -> str:
         """
         Generate AI response for a conversation.
         
         Args:
             messages: List of message dicts with 'role' and 'content'
+            purpose: What the call is for, recorded with its token usage
         
         Returns:
             AI response text
         """
+        self._wait_for_rate_limit()
+        started = time.monotonic()
         try:
+            timeout = self._timeout()
             if self.provider in ['openai', 'lmstudio']:
                 response = self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     temperature=0.7,
-                    max_tokens=2000
+                    max_tokens=self.max_tokens,
+                    **timeout
                 )
-                return response.choices[0].message.content
+                self._record_usage(response, started, purpose)
+                text = response.choices[0].message.content
             
             elif self.provider == 'anthropic':
                 # Convert messages format for Claude
@@ -65,50 +163,121 @@ class AIService:
                 
                 response = self.client.messages.create(
                     model=self.model,
-                    max_tokens=2000,
+                    max_tokens=self.max_tokens,
                     system=system_msg if system_msg else "",
-                    messages=user_messages
+                    messages=user_messages,
+                    **timeout
                 )
-                return response.content[0].text
+                self._record_usage(response, started, purpose)
+                text = response.content[0].text
             
             elif self.provider == 'google':
                 # Convert messages to Gemini format
                 prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
-                response = self.client.generate_content(prompt)
-                return response.text
+                options = {'request_options': timeout} if timeout else {}
+                response = self.client.generate_content(prompt, **options)
+                self._record_usage(response, started, purpose)
+                text = response.text
             
+            else:
+                return None
+            
+        except DeadlineExceeded:
+            raise
         except Exception as e:
+            if self.deadline is not None and (self.deadline.expired or self.deadline.cancelled):
+                # The provider call was cut short by the deadline's timeout
+                self.deadline.check()
             return f"Error generating response: {str(e)}"
+        
+        if self.deadline is not None and self.deadline.cancelled:
+            raise RequestCancelled("The client disconnected")
+        return text
+    
+    @timed('ai')
+    def stream_response(self, messages: List[Dict[str, str]], purpose: str = 'chat') -> Iterator[str]:
+        """
+        Stream an AI response for a conversation as text chunks.
+        
+        Unlike generate_response, provider errors are raised to the caller,
+        and DeadlineExceeded once the deadline passes between chunks.
+        Token usage is recorded once the stream completes.
+        
+        Args:
+            messages: List of message dicts with 'role' and 'content'
+            purpose: What the call is for, recorded with its token usage
+        
+        Yields:
+            Response text chunks in order
+        """
+        self._wait_for_rate_limit()
+        started = time.monotonic()
+        timeout = self._timeout()
+        if self.provider in ['openai', 'lmstudio']:
+            extra = {'stream_options': {'include_usage': True}} if self.provider == 'openai' else {}
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=self.max_tokens,
+                stream=True,
+                **extra,
+                **timeout
+            )
+            last_chunk = None
+            for chunk in stream:
+                self._check_deadline()
+                last_chunk = chunk
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            self._record_usage(last_chunk, started, purpose)
+        
+        elif self.provider == 'anthropic':
+            system_msg = next((m['content'] for m in messages if m['role'] == 'system'), None)
+            user_messages = [m for m in messages if m['role'] != 'system']
+            
+            with self.client.messages.stream(
+                model=self.model,
+                max_tokens=self.max_tokens,
+                system=system_msg if system_msg else "",
+                messages=user_messages,
+                **timeout
+            ) as stream:
+                for text in stream.text_stream:
+                    self._check_deadline()
+                    yield text
+                self._record_usage(stream.get_final_message(), started, purpose)
+        
+        elif self.provider == 'google':
+            prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+            options = {'request_options': timeout} if timeout else {}
+            last_chunk = None
+            for chunk in self.client.generate_content(prompt, stream=True, **options):
+                self._check_deadline()
+                last_chunk = chunk
+                if chunk.text:
+                    yield chunk.text
+            self._record_usage(last_chunk, started, purpose)
     
-    def generate_summary(self, conversation_history: List[Dict[str, str]]) -> str:
+    def generate_summary(self, conversation_history: List[Dict[str, str]],
+                         conversation_id: Optional[int] = None) -> str:
         """
         Generate a summary of a conversation.
         
+        Long conversations are summarized chunk by chunk and the partial
+        summaries combined (see chat.summarization).
+        
         Args:
             conversation_history: List of messages in the conversation
+            conversation_id: Conversation the cached chunk summaries belong to
         
         Returns:
             Summary text
-        """
-        # Prepare conversation text
-        conversation_text = "\n".join([
-            f"{msg['sender']}: {msg['content']}" 
-            for msg in conversation_history
-        ])
         
-        summary_prompt = [
-            {
-                "role": "system",
-                "content": "You are a helpful assistant that summarizes conversations concisely."
-            },
-            {
-                "role": "user",
-                "content": f"Please provide a concise summary of the following conversation, "
-                          f"highlighting key topics, decisions, and action items:\n\n{conversation_text}"
-            }
-        ]
-        
-        return self.generate_response(summary_prompt)
+        Raises:
+            SummaryError: If a provider call failed
+        """
+        return summarization.summarize(self, conversation_history, conversation_id)
     
     def analyze_sentiment(self, text: str) -> Dict[str, Any]:
         """
@@ -134,23 +303,37 @@ class AIService:
         ]
         
         try:
-            response = self.generate_response(prompt)
+            response = self.generate_response(prompt, purpose='sentiment')
             # Simple parsing - in production, use proper JSON extraction
             import json
             return json.loads(response)
         except:
             return {"sentiment": "neutral", "tone": "unknown", "confidence": 0.5}
     
-    def extract_key_topics(self, conversation_history: List[Dict[str, str]]) -> List[str]:
+    def extract_key_topics(self, conversation_history: List[Dict[str, str]], refine: bool = None) -> List[str]:
         """
         Extract key topics from a conversation.
         
+        Topics are extracted locally (see chat.topics). With refine (default
+        settings.TOPIC_LLM_REFINEMENT) the local candidates are passed to the
+        LLM to be cleaned up; if that call fails the local topics are kept.
+        
         Args:
             conversation_history: List of messages
+            refine: Whether to refine the local topics with the LLM
         
         Returns:
             List of key topics
         """
+        if refine is None:
+            refine = settings.TOPIC_LLM_REFINEMENT
+        candidates = topics.extract_topics(
+            [msg['content'] for msg in conversation_history],
+            limit=settings.TOPIC_CANDIDATES if refine else 5
+        )
+        if not refine or not candidates:
+            return candidates
+        
         conversation_text = "\n".join([
             f"{msg['sender']}: {msg['content']}" 
             for msg in conversation_history
@@ -163,12 +346,14 @@ class AIService:
             },
             {
                 "role": "user",
-                "content": f"Extract 3-5 key topics from this conversation as a comma-separated list:\n\n{conversation_text}"
+                "content": f"Candidate topics: {', '.join(candidates)}\n\n"
+                          f"Pick and, if needed, rephrase 3-5 key topics of this conversation "
+                          f"as a comma-separated list:\n\n{conversation_text}"
             }
         ]
         
-        response = self.generate_response(prompt)
-        return [topic.strip() for topic in response.split(',')]
+        response = self.generate_response(prompt, purpose='topics')
+        return topics.parse_topic_list(response) or candidates[:5]
     
     def query_conversations(self, query: str, conversations_data: List[Dict]) -> str:
         """
@@ -205,7 +390,50 @@ class AIService:
             }
         ]
         
-        return self.generate_response(prompt)
+        return self.generate_response(prompt, purpose='intelligence')
+    
+    def query_periods(self, query: str, periods: List[Dict], topic_totals: List[Tuple[str, int]]) -> str:
+        """
+        Answer a question about a time range from summary index nodes.
+        
+        Args:
+            query: User's question
+            periods: Node data of the periods covering the range (see chat.summary_index)
+            topic_totals: (topic, conversations) pairs over the whole range, most frequent first
+        
+        Returns:
+            AI response with answer
+        """
+        total = sum(period['conversation_count'] for period in periods)
+        context = f"{total} conversations in total.\n"
+        if topic_totals:
+            context += "Topics by number of conversations: " + ", ".join(
+                f"{topic} ({count})" for topic, count in topic_totals
+            ) + "\n"
+        for period in periods:
+            context += f"\n{period['period']} ({period['conversation_count']} conversations)"
+            if period['top_topics']:
+                context += " - topics: " + ", ".join(
+                    f"{item['topic']} ({item['count']})" for item in period['top_topics']
+                )
+            context += "\n"
+            if period['summary']:
+                context += f"Summary: {period['summary']}\n"
+        
+        prompt = [
+            {
+                "role": "system",
+                "content": "You are a helpful assistant that answers questions about past conversations. "
+                          "Use the provided period summaries and topic counts to give accurate, specific answers."
+            },
+            {
+                "role": "user",
+                "content": f"Question: {query}\n\nConversation activity in the period asked about:\n{context}\n"
+                          f"Please answer the question based on the data provided."
+            }
+        ]
+        
+        return self.generate_response(prompt, purpose='intelligence')
     
     def semantic_search(self, query: str, conversations: List[Dict]) -> List[Dict]:
         """
@@ -0,0 +1,113 @@
+"""
+Incrementally maintained analytics rollups.
+
+Dashboards read the small DailyStats and TopicCount tables instead of
+scanning Conversation metadata and Message rows on every request.
+"""
+from collections import Counter, defaultdict
+from typing import Dict, Iterable
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Conversation, ConversationArchive, DailyStats, Message, TopicCount
+
+
+def normalize_topic(topic: str) -> str:
+    """Normalize a topic label so counts for the same topic are merged."""
+    return ' '.join(str(topic).split()).strip(' .').lower()[:255]
+
+
+def _increment_daily(date, **deltas):
+    """Atomically add `deltas` to the DailyStats row for `date`."""
+    DailyStats.objects.get_or_create(date=date)
+    DailyStats.objects.filter(date=date).update(
+        **{field: F(field) + value for field, value in deltas.items()}
+    )
+
+
+def record_conversation_started(conversation: Conversation):
+    """Count a newly created conversation."""
+    _increment_daily(timezone.localdate(conversation.start_timestamp), conversations_started=1)
+
+
+def record_message(message: Message):
+    """Count a newly created message by sender."""
+    field = 'user_messages' if message.sender == 'user' else 'ai_messages'
+    _increment_daily(timezone.localdate(message.timestamp), **{field: 1})
+
+
+def record_conversation_ended(conversation: Conversation):
+    """Count an ended conversation, its duration and its topics."""
+    with transaction.atomic():
+        _increment_daily(
+            timezone.localdate(conversation.end_timestamp),
+            conversations_ended=1,
+            total_duration_seconds=conversation.get_duration()
+        )
+        for topic in {normalize_topic(t) for t in conversation.metadata.get('topics', [])}:
+            if not topic:
+                continue
+            TopicCount.objects.get_or_create(topic=topic)
+            TopicCount.objects.filter(topic=topic).update(
+                count=F('count') + 1,
+                last_seen=conversation.end_timestamp
+            )
+
+
+def rebuild():
+    """
+    Recompute all rollups from scratch, including messages held in archives.
+
+    Returns:
+        Dict with the number of DailyStats and TopicCount rows written
+    """
+    daily: Dict = defaultdict(Counter)
+
+    for day, count in _started_by_day():
+        daily[day]['conversations_started'] += count
+
+    topics: Counter = Counter()
+    topics_last_seen = {}
+    for conv in Conversation.objects.filter(status='ended', end_timestamp__isnull=False).iterator():
+        day = timezone.localdate(conv.end_timestamp)
+        daily[day]['conversations_ended'] += 1
+        daily[day]['total_duration_seconds'] += conv.get_duration()
+        for topic in {normalize_topic(t) for t in conv.metadata.get('topics', [])}:
+            if topic:
+                topics[topic] += 1
+                if topic not in topics_last_seen or conv.end_timestamp > topics_last_seen[topic]:
+                    topics_last_seen[topic] = conv.end_timestamp
+
+    for sender, timestamp in Message.objects.values_list('sender', 'timestamp').iterator():
+        _count_message(daily, sender, timestamp)
+    for archive in ConversationArchive.objects.iterator():
+        for row in archive.load_messages():
+            _count_message(daily, row.sender, row.timestamp)
+
+    with transaction.atomic():
+        DailyStats.objects.all().delete()
+        TopicCount.objects.all().delete()
+        DailyStats.objects.bulk_create([
+            DailyStats(date=day, **counts) for day, counts in daily.items()
+        ])
+        TopicCount.objects.bulk_create([
+            TopicCount(topic=topic, count=count, last_seen=topics_last_seen[topic])
+            for topic, count in topics.items()
+        ])
+
+    return {'days': len(daily), 'topics': len(topics)}
+
+
+def _started_by_day() -> Iterable:
+    """Return (date, count) pairs of conversations started per day."""
+    counts: Counter = Counter()
+    for start in Conversation.objects.values_list('start_timestamp', flat=True).iterator():
+        counts[timezone.localdate(start)] += 1
+    return counts.items()
+
+
+def _count_message(daily, sender, timestamp):
+    field = 'user_messages' if sender == 'user' else 'ai_messages'
+    daily[timezone.localdate(timestamp)][field] += 1
@@ -0,0 +1,143 @@
+"""
+Cold-storage archival of old ended conversations.
+
+Archived conversations keep their Conversation row (title, summary, metadata)
+but their messages are compacted into a single compressed ConversationArchive
+blob and the Message rows are deleted. The distinct words of the messages are
+stored as ArchiveTerm rows, so keyword search only decompresses archives that
+contain every word of the query.
+"""
+import json
+import re
+from datetime import timedelta
+from typing import Dict, Iterable, List, Set
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching
+from .compression import compress, default_codec
+from .models import ArchiveTerm, Conversation, ConversationArchive, Message
+from .typeahead import typeahead_index
+
+WORD_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = ArchiveTerm._meta.get_field('term').max_length
+# Upper bound for a prefix range scan over the term index
+PREFIX_END = '\U0010ffff'
+
+
+def archive_terms(rows: Iterable[Dict]) -> Set[str]:
+    """Distinct lowercased words of archived message rows."""
+    return {
+        word[:MAX_TERM_LENGTH]
+        for row in rows
+        for word in WORD_RE.findall(row['content'].lower())
+    }
+
+
+def archive_conversation(conversation: Conversation, codec: str = None) -> ConversationArchive:
+    """
+    Compact all messages of an ended conversation into one compressed blob.
+
+    Args:
+        conversation: Ended conversation to archive
+        codec: Compression codec (defaults to settings.ARCHIVE_CODEC or the best available)
+
+    Returns:
+        The created ConversationArchive
+    """
+    if conversation.status != 'ended':
+        raise ValueError("Only ended conversations can be archived")
+    if conversation.archived:
+        return conversation.archive
+
+    codec = codec or settings.ARCHIVE_CODEC or default_codec()
+
+    with transaction.atomic():
+        rows = [
+            {
+                'id': row['id'],
+                'content': row['content'],
+                'sender': row['sender'],
+                'status': row['status'],
+                'timestamp': row['timestamp'].isoformat(),
+            }
+            for row in Message.objects.filter(conversation=conversation)
+            .order_by('timestamp')
+            .values('id', 'content', 'sender', 'status', 'timestamp')
+        ]
+        raw = json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+        archive = ConversationArchive.objects.create(
+            conversation=conversation,
+            codec=codec,
+            data=compress(raw, codec),
+            message_count=len(rows),
+            original_size=len(raw)
+        )
+        ArchiveTerm.objects.bulk_create([ArchiveTerm(archive=archive, term=term) for term in archive_terms(rows)])
+        Message.objects.filter(conversation=conversation).delete()
+        conversation.archived = True
+        conversation.save(update_fields=['archived'])
+    caching.bump_write_generation()
+
+    return archive
+
+
+def archivable_conversations(days: int):
+    """Ended, not yet archived conversations that ended more than `days` days ago."""
+    cutoff = timezone.now() - timedelta(days=days)
+    return Conversation.objects.filter(
+        status='ended',
+        archived=False,
+        end_timestamp__lt=cutoff
+    ).order_by('end_timestamp')
+
+
+def expire_archives(days: int) -> int:
+    """
+    Retention policy: delete archived conversations that ended more than
+    `days` days ago.
+
+    Returns:
+        Number of conversations deleted
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    expired = Conversation.objects.filter(archived=True, end_timestamp__lt=cutoff)
+    count = expired.count()
+    expired.delete()
+    if count:
+        typeahead_index.invalidate()
+        caching.bump_write_generation()
+    return count
+
+
+def search_archives(query: str, exclude_ids: Iterable[int] = ()) -> List[int]:
+    """
+    Find archived conversations whose messages contain `query`.
+
+    Candidates are the archives having, for every word of the query, a term
+    starting with it (one index range scan per word); only those are
+    decompressed to confirm the match. A query starting in the middle of a
+    word therefore does not match archived messages.
+    """
+    words = {word[:MAX_TERM_LENGTH] for word in WORD_RE.findall(query.lower())}
+    if not words:
+        return []
+    candidates = None
+    for word in sorted(words, key=len, reverse=True):
+        matches = ArchiveTerm.objects.filter(term__gte=word, term__lt=word + PREFIX_END)
+        if candidates is not None:
+            matches = matches.filter(archive_id__in=candidates)
+        candidates = set(matches.values_list('archive_id', flat=True))
+        if not candidates:
+            return []
+    archives = ConversationArchive.objects.filter(id__in=candidates).exclude(
+        conversation_id__in=list(exclude_ids)
+    ).only('conversation_id', 'codec', 'data')
+    return [
+        archive.conversation_id
+        for archive in archives.iterator(chunk_size=100)
+        if archive.contains(query)
+    ]
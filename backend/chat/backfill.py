@@ -0,0 +1,357 @@
+"""
+Parallel, resumable backfill of conversation summaries and metadata.
+
+Conversations are processed in id order, one chunk at a time. The provider
+calls of a chunk run either on a bounded thread pool behind a token-bucket
+rate limiter, or through a provider batch API; transcripts too long for one
+prompt are summarized map-reduce style in both cases. Database reads and
+writes happen on the calling thread (apart from the chunk summary cache used
+for long conversations, see chat.summarization), and after each chunk the
+highest processed id is written to a checkpoint file so an interrupted run
+resumes where it stopped (redoing at most one chunk).
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from django.db import connection
+from django.db.models import Q, QuerySet
+
+from . import caching, summary_index, topics
+from .ai_service import AIService
+from .models import Conversation
+from .summarization import SummaryError, needs_map_reduce, summary_prompt
+
+MODES = ['missing', 'stale', 'all']
+ERROR_PREFIX = 'Error generating response'
+
+
+class BackfillError(Exception):
+    """A provider call failed after all retries."""
+
+
+def select_conversations(mode: str, model: str) -> QuerySet:
+    """
+    Ended conversations to backfill, in id order.
+
+    Args:
+        mode: 'missing' (no or failed summary, or no topics), 'stale'
+            (not summarized by the current model) or 'all'
+        model: The current summary model, for 'stale'
+    """
+    conversations = Conversation.objects.filter(status='ended').select_related('archive').order_by('id')
+    if mode == 'missing':
+        conversations = conversations.filter(
+            Q(ai_summary__isnull=True) | Q(ai_summary='') | Q(ai_summary__startswith=ERROR_PREFIX)
+            | ~Q(metadata__has_key='topics')
+        )
+    elif mode == 'stale':
+        # A missing key compares as NULL, so it has to be matched explicitly
+        conversations = conversations.filter(
+            ~Q(metadata__has_key='summary_model') | ~Q(metadata__summary_model=model)
+        )
+    return conversations
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing `rate` calls per second (0 disables it)."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """Progress of a backfill run, persisted as JSON after every chunk."""
+
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self.last_id = 0
+        self.succeeded = 0
+        self.failed: List[int] = []
+
+    @classmethod
+    def load(cls, path: str, mode: str) -> 'Checkpoint':
+        """
+        Load the checkpoint at path, or start a new one.
+
+        Raises:
+            ValueError: If the checkpoint belongs to a run with another mode
+        """
+        checkpoint = cls(path, mode)
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('mode') != mode:
+                raise ValueError(
+                    f"Checkpoint {path} belongs to a '{state.get('mode')}' run; reset it to start over"
+                )
+            checkpoint.last_id = state.get('last_id', 0)
+            checkpoint.succeeded = state.get('succeeded', 0)
+            checkpoint.failed = state.get('failed', [])
+        return checkpoint
+
+    def save(self):
+        state = {
+            'mode': self.mode,
+            'last_id': self.last_id,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def finish(self):
+        """
+        Rewind after a complete run, so the next run starts from the beginning
+        again; failed ids are kept for --retry-failed.
+        """
+        if not self.failed:
+            self.reset()
+            return
+        self.last_id = 0
+        self.save()
+
+
+def _summary_or_raise(text: Optional[str]) -> str:
+    """AIService.generate_response reports failures as text; turn them back into errors."""
+    if not text or text.startswith(ERROR_PREFIX):
+        raise BackfillError(text or 'Empty response')
+    return text
+
+
+class ThreadPoolBackend:
+    """
+    Summarizes conversations on a bounded pool. Every provider call, including
+    the chunk and reduce calls of long conversations, takes a token from the
+    rate limiter, and long conversations summarize at most `map_workers`
+    chunks at once, so a run makes at most workers * map_workers calls in
+    parallel.
+    """
+
+    def __init__(self, workers: int, limiter: RateLimiter, retries: int = 3, backoff: float = 1.0,
+                 service_factory: Callable[[], AIService] = AIService, map_workers: int = 1):
+        self.workers = workers
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.service_factory = service_factory
+        self.map_workers = map_workers
+
+    def _summarize(self, service: AIService, conversation_id: int, history: List[Dict[str, str]]) -> Dict[str, Any]:
+        service.rate_limiter = self.limiter
+        service.map_workers = self.map_workers
+        for attempt in range(self.retries + 1):
+            try:
+                return {'summary': service.generate_summary(history, conversation_id), 'service': service}
+            except SummaryError as e:
+                if attempt == self.retries:
+                    return {'error': str(e), 'service': service}
+                time.sleep(self.backoff * 2 ** attempt)
+            finally:
+                # Long conversations query the chunk cache from this worker thread
+                connection.close()
+
+    def summarize(self, histories: Dict[int, List[Dict[str, str]]]) -> Dict[int, Dict[str, Any]]:
+        """
+        Returns:
+            Per conversation id, {'summary': str} or {'error': str}, plus the
+            'service' whose usage log holds the calls made
+        """
+        # Services are created here so settings are read on the calling thread
+        services = {conversation_id: self.service_factory() for conversation_id in histories}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                conversation_id: executor.submit(self._summarize, services[conversation_id], conversation_id, history)
+                for conversation_id, history in histories.items()
+            }
+            return {conversation_id: future.result() for conversation_id, future in futures.items()}
+
+
+class LocalBatchClient:
+    """Stand-in for a provider batch API that runs the requests one by one."""
+
+    def __init__(self, service: AIService):
+        self.service = service
+
+    def run(self, requests: Dict[str, List[Dict[str, str]]]) -> Dict[str, Any]:
+        results = {}
+        for custom_id, messages in requests.items():
+            try:
+                results[custom_id] = _summary_or_raise(self.service.generate_response(messages, purpose='summary'))
+            except BackfillError as e:
+                results[custom_id] = e
+        return results
+
+
+class OpenAIBatchClient:
+    """OpenAI Batch API: upload a JSONL file of requests, poll, download the results."""
+
+    def __init__(self, client, model: str, max_tokens: int, poll_interval: float):
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+        self.poll_interval = poll_interval
+
+    def run(self, requests: Dict[str, List[Dict[str, str]]]) -> Dict[str, Any]:
+        lines = [
+            json.dumps({
+                'custom_id': custom_id,
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {'model': self.model, 'messages': messages, 'max_tokens': self.max_tokens},
+            })
+            for custom_id, messages in requests.items()
+        ]
+        batch_file = self.client.files.create(
+            file=('backfill.jsonl', '\n'.join(lines).encode()), purpose='batch'
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id, endpoint='/v1/chat/completions', completion_window='24h'
+        )
+        while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+
+        results: Dict[str, Any] = {
+            custom_id: BackfillError(f'Batch {batch.status}') for custom_id in requests
+        }
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                row = json.loads(line)
+                response = row.get('response') or {}
+                if response.get('status_code') == 200:
+                    results[row['custom_id']] = response['body']['choices'][0]['message']['content']
+                else:
+                    results[row['custom_id']] = BackfillError(str(row.get('error') or response))
+        return results
+
+
+class AnthropicBatchClient:
+    """Anthropic Message Batches API."""
+
+    def __init__(self, client, model: str, max_tokens: int, poll_interval: float):
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+        self.poll_interval = poll_interval
+
+    def run(self, requests: Dict[str, List[Dict[str, str]]]) -> Dict[str, Any]:
+        batch_requests = []
+        for custom_id, messages in requests.items():
+            system_msg = next((m['content'] for m in messages if m['role'] == 'system'), "")
+            batch_requests.append({
+                'custom_id': custom_id,
+                'params': {
+                    'model': self.model,
+                    'max_tokens': self.max_tokens,
+                    'system': system_msg,
+                    'messages': [m for m in messages if m['role'] != 'system'],
+                },
+            })
+        batch = self.client.messages.batches.create(requests=batch_requests)
+        while batch.processing_status != 'ended':
+            time.sleep(self.poll_interval)
+            batch = self.client.messages.batches.retrieve(batch.id)
+
+        results: Dict[str, Any] = {custom_id: BackfillError('Missing batch result') for custom_id in requests}
+        for row in self.client.messages.batches.results(batch.id):
+            if row.result.type == 'succeeded':
+                results[row.custom_id] = row.result.message.content[0].text
+            else:
+                results[row.custom_id] = BackfillError(row.result.type)
+        return results
+
+
+def batch_client(service: AIService, poll_interval: float):
+    """The batch API client for the service's provider."""
+    if service.provider == 'openai':
+        return OpenAIBatchClient(service.client, service.model, service.max_tokens, poll_interval)
+    if service.provider == 'anthropic':
+        return AnthropicBatchClient(service.client, service.model, service.max_tokens, poll_interval)
+    raise ValueError(f"No batch API support for provider: {service.provider}")
+
+
+class BatchBackend:
+    """
+    Summarizes a whole chunk with one batch API job. Transcripts too long for
+    one prompt are summarized chunk by chunk with the map-reduce summarizer
+    instead, through rate-limited services from service_factory.
+    """
+
+    def __init__(self, client, limiter: Optional[RateLimiter] = None,
+                 service_factory: Callable[[], AIService] = AIService):
+        self.client = client
+        self.limiter = limiter
+        self.service_factory = service_factory
+
+    def _summarize_long(self, conversation_id: int, history: List[Dict[str, str]]) -> Dict[str, Any]:
+        service = self.service_factory()
+        service.rate_limiter = self.limiter
+        try:
+            return {'summary': service.generate_summary(history, conversation_id), 'service': service}
+        except SummaryError as e:
+            return {'error': str(e), 'service': service}
+
+    def summarize(self, histories: Dict[int, List[Dict[str, str]]]) -> Dict[int, Dict[str, Any]]:
+        long_ids = {conversation_id for conversation_id, history in histories.items() if needs_map_reduce(history)}
+        requests = {
+            str(conversation_id): summary_prompt(history)
+            for conversation_id, history in histories.items() if conversation_id not in long_ids
+        }
+        results = self.client.run(requests) if requests else {}
+        outcome = {}
+        for conversation_id, history in histories.items():
+            if conversation_id in long_ids:
+                outcome[conversation_id] = self._summarize_long(conversation_id, history)
+                continue
+            result = results.get(str(conversation_id), BackfillError('Missing batch result'))
+            if isinstance(result, Exception):
+                outcome[conversation_id] = {'error': str(result)}
+            else:
+                outcome[conversation_id] = {'summary': result}
+        return outcome
+
+
+def save_result(conversation: Conversation, history: List[Dict[str, str]], summary: str, model: str):
+    """
+    Store a backfilled summary with freshly extracted topics. The caller
+    invalidates the typeahead index once per chunk of saved results.
+    """
+    conversation.ai_summary = summary
+    conversation.metadata = {
+        **conversation.metadata,
+        'topics': topics.extract_topics(msg['content'] for msg in history),
+        'message_count': len(history),
+        'summary_model': model,
+    }
+    conversation.save(update_fields=['ai_summary', 'metadata'])
+    caching.touch_conversation(conversation.id)
+    summary_index.mark_stale(conversation)
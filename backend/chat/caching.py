@@ -0,0 +1,198 @@
+"""
+Conditional GET validators and server-side caching of serialized
+conversation payloads.
+
+Every write to a conversation (new message, conversation end) bumps its
+`version` and `updated_at`. Validators are derived from those columns with
+a single cheap query, and cached payloads are keyed by version so a write
+invalidates them exactly.
+
+Conversation lists and search results depend on every conversation, so they
+are keyed by a single global write generation instead, which every write
+advances. The generation is kept in the database, not the cache, so a write
+in one worker invalidates lists and search results in every worker even
+with the per-process cache; validating them costs one primary-key lookup.
+"""
+import hashlib
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Conversation, WriteGeneration
+
+CACHE_TIMEOUT = 60 * 60
+GENERATION_ROW_ID = 1
+SEARCH_HITS_KEY = 'chat:search-cache:hits'
+SEARCH_MISSES_KEY = 'chat:search-cache:misses'
+
+
+def touch_conversation(conversation_id: int):
+    """
+    Record a write to a conversation: bump its version so validators and
+    cached payloads for it become stale. Payloads cached under older
+    versions are never read again and simply expire.
+    """
+    Conversation.objects.filter(id=conversation_id).update(
+        version=F('version') + 1,
+        updated_at=timezone.now()
+    )
+    bump_write_generation()
+
+
+def _incr(key: str, initial: int = 0) -> int:
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, initial, None)
+        return cache.incr(key)
+
+
+def _initial_generation() -> int:
+    # Starts from the clock, so a recreated database never comes back to a
+    # generation that results in a surviving cache were stored under
+    return time.time_ns()
+
+
+def bump_write_generation():
+    """
+    Record a write that can change lists or search results (a conversation
+    created, written, ended or deleted), so every cached list and search
+    result becomes stale in every worker.
+    """
+    if not WriteGeneration.objects.filter(id=GENERATION_ROW_ID).update(value=F('value') + 1):
+        _, created = WriteGeneration.objects.get_or_create(
+            id=GENERATION_ROW_ID, defaults={'value': _initial_generation()}
+        )
+        if not created:
+            WriteGeneration.objects.filter(id=GENERATION_ROW_ID).update(value=F('value') + 1)
+
+
+def write_generation() -> int:
+    generation = WriteGeneration.objects.filter(id=GENERATION_ROW_ID).values_list('value', flat=True).first()
+    if generation is None:
+        generation = WriteGeneration.objects.get_or_create(
+            id=GENERATION_ROW_ID, defaults={'value': _initial_generation()}
+        )[0].value
+    return generation
+
+
+def conversation_state(conversation_id: int):
+    """Return (version, updated_at) for a conversation, or None if it does not exist."""
+    return Conversation.objects.filter(id=conversation_id).values_list('version', 'updated_at').first()
+
+
+def list_state(request):
+    """(write generation, digest of all query parameters) identifying a list response."""
+    if not hasattr(request, 'conversation_list_state'):
+        params = urlencode(sorted(request.GET.lists()), doseq=True)
+        request.conversation_list_state = (
+            write_generation(), hashlib.sha1(params.encode('utf-8')).hexdigest()[:16]
+        )
+    return request.conversation_list_state
+
+
+# Validators used with django.views.decorators.http.condition
+
+def request_conversation_state(request, pk):
+    if not hasattr(request, 'conversation_state'):
+        request.conversation_state = conversation_state(pk)
+    return request.conversation_state
+
+
+def detail_etag(request, pk):
+    state = request_conversation_state(request, pk)
+    return f'"c{pk}-v{state[0]}"' if state else None
+
+
+def detail_last_modified(request, pk):
+    state = request_conversation_state(request, pk)
+    return state[1] if state else None
+
+
+def list_etag(request):
+    generation, params = list_state(request)
+    return f'"l{generation}-{params}"'
+
+
+# Payload cache
+
+def _detail_key(conversation):
+    return f'chat:conversation:{conversation.id}:v{conversation.version}:{conversation.updated_at.timestamp()}'
+
+
+def _list_key(state):
+    return f'chat:conversation-list:g{state[0]}:{state[1]}'
+
+
+def get_detail_payload(conversation: Conversation):
+    return _refresh_durations(cache.get(_detail_key(conversation)))
+
+
+def set_detail_payload(conversation: Conversation, data):
+    cache.set(_detail_key(conversation), data, CACHE_TIMEOUT)
+
+
+def get_list_payload(state):
+    data = cache.get(_list_key(state))
+    if data is not None:
+        for item in data.get('results', []):
+            _refresh_durations(item)
+    return data
+
+
+def set_list_payload(state, data):
+    cache.set(_list_key(state), data, CACHE_TIMEOUT)
+
+
+def _search_key(generation, mode, query):
+    digest = hashlib.sha1(query.encode('utf-8')).hexdigest()
+    return f'chat:search:g{generation}:{mode}:{digest}'
+
+
+def normalize_query(query: str) -> str:
+    """Search query as cached: trimmed, with runs of whitespace collapsed."""
+    return ' '.join(query.split())
+
+
+def get_search_payload(generation, mode, query):
+    """Cached search response for the generation, or None; counts the hit or miss."""
+    data = cache.get(_search_key(generation, mode, query.casefold()))
+    _incr(SEARCH_HITS_KEY if data is not None else SEARCH_MISSES_KEY)
+    if data is not None:
+        for item in data.get('results', []):
+            _refresh_durations(item)
+    return data
+
+
+def set_search_payload(generation, mode, query, data):
+    # Bounded lifetime: with read replicas, a result computed from a lagging
+    # replica is not superseded until the next write
+    cache.set(_search_key(generation, mode, query.casefold()), data, settings.SEARCH_CACHE_TIMEOUT)
+
+
+def search_cache_stats():
+    """Hits and misses of the search result cache across all workers."""
+    counts = cache.get_many([SEARCH_HITS_KEY, SEARCH_MISSES_KEY])
+    hits, misses = counts.get(SEARCH_HITS_KEY, 0), counts.get(SEARCH_MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        'write_generation': write_generation(),
+    }
+
+
+def _refresh_durations(item):
+    """
+    The `duration` of an active conversation grows with wall-clock time, so it
+    is recomputed when a cached payload is served.
+    """
+    if item is not None and item.get('status') == 'active' and item.get('start_timestamp'):
+        start = datetime.fromisoformat(item['start_timestamp'].replace('Z', '+00:00'))
+        item['duration'] = (timezone.now() - start).total_seconds()
+    return item
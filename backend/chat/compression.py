@@ -0,0 +1,61 @@
+"""
+Compression codecs used for cold storage of archived conversations.
+"""
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+
+def available_codecs():
+    """Return the names of the codecs usable in this environment."""
+    codecs = ['zlib', 'lzma']
+    if zstandard is not None:
+        codecs.append('zstd')
+    return codecs
+
+
+def default_codec():
+    """Pick the best available codec: zstd if installed, otherwise lzma."""
+    return 'zstd' if zstandard is not None else 'lzma'
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    """
+    Compress raw bytes with the given codec.
+
+    Args:
+        data: Bytes to compress
+        codec: One of 'zlib', 'lzma' or 'zstd'
+
+    Returns:
+        Compressed bytes
+    """
+    if codec == 'zlib':
+        return zlib.compress(data, 9)
+    if codec == 'lzma':
+        return lzma.compress(data, preset=6)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd codec requested but 'zstandard' is not installed")
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    """
+    Decompress bytes produced by `compress` with the same codec.
+    """
+    data = bytes(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'lzma':
+        return lzma.decompress(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd codec requested but 'zstandard' is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported compression codec: {codec}")
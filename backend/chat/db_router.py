@@ -0,0 +1,94 @@
+"""
+Read-replica database routing.
+
+Writes always go to the primary ('default'). Reads go to a randomly chosen
+replica from settings.REPLICA_DATABASES unless the current request or task is
+pinned to the primary: write requests are pinned for their whole duration,
+and a client that has just written keeps reading from the primary for
+REPLICA_STICKY_SECONDS (tracked with a cookie) so it sees its own writes
+despite replication lag. Read-only views served over POST opt into replicas
+with @replica_reads.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'db_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_use_primary = contextvars.ContextVar('use_primary', default=False)
+
+
+def replica_reads(view):
+    """Mark a view as read-only so it may read from replicas whatever its HTTP method."""
+    view.replica_reads = True
+    return view
+
+
+@contextmanager
+def use_primary():
+    """Send all reads in this context (and tasks started from it) to the primary."""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+class ReplicaRouter:
+    """Routes reads to replicas and everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.REPLICA_DATABASES
+        if not replicas or _use_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pins write requests, and reads shortly after a client's own write, to
+    the primary database.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+
+        request.replica_reads = False
+        sticky = PIN_COOKIE in request.COOKIES
+        token = _use_primary.set(sticky or request.method not in SAFE_METHODS)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+
+        if request.method not in SAFE_METHODS and not request.replica_reads:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.REPLICA_DATABASES:
+            return None
+        if getattr(view_func, 'replica_reads', False) and PIN_COOKIE not in request.COOKIES:
+            request.replica_reads = True
+            _use_primary.set(False)
+        return None
@@ -0,0 +1,112 @@
+"""
+Per-request deadlines and cancellation for AI provider calls.
+
+Every HTTP request gets a Deadline (REQUEST_DEADLINE_SECONDS, shortened by an
+X-Request-Timeout header from a client or proxy). Views hand it to AIService,
+which passes the remaining time to the provider as its timeout and raises
+DeadlineExceeded instead of waiting past it. When an ASGI client disconnects
+the deadline is cancelled, so streams stop and results are not saved.
+
+What happens to text already generated when a response is cut short is
+decided by PARTIAL_OUTPUT_POLICY: 'discard' (default) drops it, 'save'
+persists it with PARTIAL_OUTPUT_MARKER appended.
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+TIMEOUT_HEADER = 'X-Request-Timeout'
+# Non-standard status (as used by nginx) for a request whose client went away
+CLIENT_CLOSED_REQUEST = 499
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before the provider responded."""
+
+
+class RequestCancelled(DeadlineExceeded):
+    """The client went away; nobody will read the result."""
+
+
+class Deadline:
+    """A point in time after which work for a request is abandoned."""
+
+    def __init__(self, seconds: Optional[float], cancel_event: Optional[threading.Event] = None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self.cancel_event = cancel_event or threading.Event()
+
+    @classmethod
+    def for_request(cls, request) -> 'Deadline':
+        """Deadline of an HTTP request: the server default, or sooner if the client asks."""
+        seconds = settings.REQUEST_DEADLINE_SECONDS or None
+        try:
+            requested = float(request.headers.get(TIMEOUT_HEADER, ''))
+        except ValueError:
+            requested = None
+        if requested and requested > 0:
+            seconds = min(seconds, requested) if seconds else requested
+        return cls(seconds)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a time limit."""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check(self):
+        """Raise if the work should stop now."""
+        if self.cancelled:
+            raise RequestCancelled("The client disconnected")
+        if self.expired:
+            raise DeadlineExceeded("The request deadline was exceeded")
+
+
+def partial_output(text: str) -> Optional[str]:
+    """The text to persist for a cut-short response under PARTIAL_OUTPUT_POLICY, if any."""
+    if settings.PARTIAL_OUTPUT_POLICY != 'save' or not text.strip():
+        return None
+    return text + settings.PARTIAL_OUTPUT_MARKER
+
+
+class DeadlineMiddleware:
+    """
+    Attach a Deadline to each request. On ASGI, a client disconnect cancels
+    the request task; the deadline is cancelled with it so work still running
+    in the view's thread stops at its next check.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.deadline = Deadline.for_request(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.deadline = Deadline.for_request(request)
+        try:
+            return await self.get_response(request)
+        except asyncio.CancelledError:
+            request.deadline.cancel()
+            raise
@@ -0,0 +1,261 @@
+"""
+Near-duplicate conversations with MinHash and locality-sensitive hashing.
+
+A conversation's user messages are split into 3-word shingles. Its MinHash
+signature holds, for each of DEDUP_NUM_PERM hash functions, the smallest
+hash of any shingle. The fraction of positions where two signatures agree
+estimates the Jaccard similarity of the two shingle sets.
+
+Signatures are split into DEDUP_BANDS bands and each band is hashed to a
+bucket stored in MinHashBand. Conversations that share a bucket in any band
+are candidates, found with an index lookup rather than a scan; only the
+candidates are compared, and those at DEDUP_THRESHOLD or above are
+near-duplicates. Signatures are computed when a conversation ends;
+`python manage.py find_duplicates --index` backfills them.
+
+Changing DEDUP_NUM_PERM or DEDUP_BANDS requires re-signing every
+conversation (`find_duplicates --index --all`).
+"""
+import hashlib
+import random
+import re
+import struct
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Conversation, ConversationSignature, MinHashBand
+
+WORD_RE = re.compile(r'\w+')
+SHINGLE_WORDS = 3
+# Hash functions are (a * x + b) mod PRIME on 32-bit shingle hashes
+PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SEED = 48
+# Bucket groups whose signatures are loaded (and released) together while clustering
+CLUSTER_BATCH = 1000
+
+
+@lru_cache(maxsize=4)
+def _permutations(count: int) -> Tuple[Tuple[int, int], ...]:
+    rng = random.Random(SEED)
+    return tuple((rng.randrange(1, 1 << 31), rng.randrange(0, 1 << 31)) for _ in range(count))
+
+
+def _hash32(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=4).digest(), 'little')
+
+
+def shingles(texts: Iterable[str]) -> set:
+    """Hashes of the 3-word shingles of each text (shorter texts are one shingle)."""
+    hashes = set()
+    for text in texts:
+        words = WORD_RE.findall(text.lower())
+        for start in range(max(len(words) - SHINGLE_WORDS + 1, 1 if words else 0)):
+            hashes.add(_hash32(' '.join(words[start:start + SHINGLE_WORDS])))
+    return hashes
+
+
+def minhash(shingle_hashes: set) -> Optional[List[int]]:
+    """MinHash signature of a shingle set, or None if it is empty."""
+    if not shingle_hashes:
+        return None
+    return [
+        min(((a * value + b) % PRIME) & MAX_HASH for value in shingle_hashes)
+        for a, b in _permutations(settings.DEDUP_NUM_PERM)
+    ]
+
+
+def user_shingles(history: List[Dict[str, str]]) -> set:
+    """Shingles of a conversation's user messages, which are what near-copies share."""
+    return shingles(msg['content'] for msg in history if msg['sender'] == 'user')
+
+
+def pack(signature: Sequence[int]) -> bytes:
+    return struct.pack(f'<{len(signature)}I', *signature)
+
+
+def unpack(data) -> Tuple[int, ...]:
+    data = bytes(data)
+    return struct.unpack(f'<{len(data) // 4}I', data)
+
+
+def bands(signature: Sequence[int]) -> List[Tuple[int, int]]:
+    """(band, bucket) pairs of a signature; the bucket is a signed 64-bit hash of the band."""
+    rows = len(signature) // settings.DEDUP_BANDS
+    return [
+        (band, int.from_bytes(
+            hashlib.blake2b(pack(signature[band * rows:(band + 1) * rows]), digest_size=8).digest(),
+            'little', signed=True
+        ))
+        for band in range(settings.DEDUP_BANDS)
+    ]
+
+
+def similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    if len(first) != len(second) or not first:
+        return 0.0
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+# Indexing
+
+def store_signatures(histories: Dict[int, List[Dict[str, str]]]):
+    """Replace the signatures and bands of the given conversations."""
+    shingle_sets = {conversation_id: user_shingles(history) for conversation_id, history in histories.items()}
+    signatures = {conversation_id: minhash(hashes) for conversation_id, hashes in shingle_sets.items()}
+    with transaction.atomic():
+        ConversationSignature.objects.filter(conversation_id__in=list(histories)).delete()
+        MinHashBand.objects.filter(conversation_id__in=list(histories)).delete()
+        ConversationSignature.objects.bulk_create([
+            ConversationSignature(
+                conversation_id=conversation_id, signature=pack(signature),
+                shingle_count=len(shingle_sets[conversation_id])
+            )
+            for conversation_id, signature in signatures.items() if signature is not None
+        ])
+        MinHashBand.objects.bulk_create([
+            MinHashBand(conversation_id=conversation_id, band=band, bucket=bucket)
+            for conversation_id, signature in signatures.items() if signature is not None
+            for band, bucket in bands(signature)
+        ])
+
+
+def index_conversation(conversation: Conversation):
+    """(Re)compute the signature of one conversation from its messages."""
+    store_signatures({conversation.id: [
+        {'sender': msg.sender, 'content': msg.content} for msg in conversation.get_messages()
+    ]})
+
+
+def _load(conversation_ids: Iterable[int]) -> Dict[int, Tuple[int, ...]]:
+    rows = ConversationSignature.objects.filter(conversation_id__in=list(conversation_ids)).values_list(
+        'conversation_id', 'signature'
+    )
+    return {conversation_id: unpack(data) for conversation_id, data in rows}
+
+
+# Lookups
+
+def find_similar(conversation_id: int, threshold: float = None) -> List[Tuple[int, float]]:
+    """
+    Near-duplicates of a conversation as (id, similarity), most similar first.
+    Only conversations sharing an LSH bucket are compared.
+    """
+    threshold = settings.DEDUP_THRESHOLD if threshold is None else threshold
+    signature = _load([conversation_id]).get(conversation_id)
+    if signature is None:
+        return []
+    lookup = Q()
+    for band, bucket in bands(signature):
+        lookup |= Q(band=band, bucket=bucket)
+    candidates = MinHashBand.objects.filter(lookup).exclude(conversation_id=conversation_id)
+    candidate_ids = set(candidates.values_list('conversation_id', flat=True))
+    matches = [
+        (candidate_id, similarity(signature, candidate))
+        for candidate_id, candidate in _load(candidate_ids).items()
+    ]
+    return sorted(
+        [(candidate_id, score) for candidate_id, score in matches if score >= threshold],
+        key=lambda match: (-match[1], match[0])
+    )
+
+
+def collapse(conversation_ids: Sequence[int]) -> Tuple[List[int], Dict[int, List[int]]]:
+    """
+    Drop near-duplicates from a ranked list of conversations (one query).
+
+    Returns:
+        The ids to keep, in their original order, and for each kept id that
+        had near-duplicates the ids dropped in its favour
+    """
+    signatures = _load(conversation_ids)
+    kept: List[int] = []
+    duplicates: Dict[int, List[int]] = defaultdict(list)
+    buckets: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    for conversation_id in conversation_ids:
+        signature = signatures.get(conversation_id)
+        if signature is None:
+            kept.append(conversation_id)
+            continue
+        keys = bands(signature)
+        original = next((
+            candidate
+            for key in keys for candidate in buckets[key]
+            if similarity(signature, signatures[candidate]) >= settings.DEDUP_THRESHOLD
+        ), None)
+        if original is not None:
+            duplicates[original].append(conversation_id)
+            continue
+        kept.append(conversation_id)
+        for key in keys:
+            buckets[key].append(conversation_id)
+    return kept, dict(duplicates)
+
+
+def clusters(min_size: int = 2) -> List[List[int]]:
+    """
+    Groups of near-duplicate conversations, largest first.
+
+    Reads the band table in (band, bucket) order, so only conversations
+    sharing a bucket are ever compared; each member of a bucket is compared
+    with the bucket's representatives, not with every other member. Only the
+    signatures of one batch of buckets are held in memory at a time.
+    """
+    parent: Dict[int, int] = {}
+
+    def find(item):
+        parent.setdefault(item, item)
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    groups: List[List[int]] = []
+
+    def process():
+        signatures = _load({member for group in groups for member in group})
+        for group in groups:
+            representatives: List[int] = []
+            for member in group:
+                signature = signatures.get(member)
+                if signature is None:
+                    continue
+                original = next((
+                    rep for rep in representatives
+                    if similarity(signature, signatures[rep]) >= settings.DEDUP_THRESHOLD
+                ), None)
+                if original is None:
+                    representatives.append(member)
+                else:
+                    parent[find(member)] = find(original)
+        groups.clear()
+
+    rows = MinHashBand.objects.order_by('band', 'bucket', 'conversation_id').values_list(
+        'band', 'bucket', 'conversation_id'
+    )
+    current_key, current = None, []
+    for band, bucket, conversation_id in rows.iterator(chunk_size=5000):
+        if (band, bucket) != current_key:
+            if len(current) > 1:
+                groups.append(current)
+                if len(groups) >= CLUSTER_BATCH:
+                    process()
+            current_key, current = (band, bucket), []
+        current.append(conversation_id)
+    if len(current) > 1:
+        groups.append(current)
+    process()
+
+    members: Dict[int, List[int]] = defaultdict(list)
+    for item in parent:
+        members[find(item)].append(item)
+    return sorted(
+        (sorted(group) for group in members.values() if len(group) >= min_size),
+        key=lambda group: (-len(group), group[0])
+    )
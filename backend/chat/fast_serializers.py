@@ -0,0 +1,141 @@
+"""
+Fast serialization path for hot read endpoints.
+
+Builds response payloads straight from `.values()` rows instead of going
+through DRF ModelSerializer instances, and encodes them with orjson when it
+is installed (stdlib json otherwise). The output shape is identical to
+MessageSerializer / ConversationListSerializer / ConversationDetailSerializer.
+"""
+import json
+from typing import Any, Dict, Iterable, List
+
+from django.db.models import Count
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .models import Conversation, Message
+from .profiling import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+MESSAGE_FIELDS = ('id', 'conversation_id', 'content', 'sender', 'status', 'timestamp')
+
+
+@timed('serializer')
+def dumps(data: Any) -> bytes:
+    """Encode data as compact UTF-8 JSON, like DRF's JSONRenderer."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(HttpResponse):
+    """HttpResponse carrying a payload encoded by `dumps`."""
+
+    def __init__(self, data, status=200, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), status=status, **kwargs)
+        self.data = data
+
+
+def format_datetime(value):
+    """Format a datetime exactly as DRF's DateTimeField does."""
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _duration(start, end):
+    """Same as Conversation.get_duration, from raw column values."""
+    return ((end or timezone.now()) - start).total_seconds()
+
+
+def message_dict(row: Dict) -> Dict:
+    """Shape a message values() row like MessageSerializer."""
+    return {
+        'id': row['id'],
+        'conversation': row['conversation_id'],
+        'content': row['content'],
+        'sender': row['sender'],
+        'status': row['status'],
+        'timestamp': format_datetime(row['timestamp']),
+    }
+
+
+def serialize_messages(conversation: Conversation) -> List[Dict]:
+    """Serialized, ordered messages of a conversation (archived or not)."""
+    if conversation.archived:
+        return [
+            message_dict({
+                'id': msg.id,
+                'conversation_id': msg.conversation_id,
+                'content': msg.content,
+                'sender': msg.sender,
+                'status': msg.status,
+                'timestamp': msg.timestamp,
+            })
+            for msg in conversation.get_messages()
+        ]
+    rows = Message.objects.filter(conversation=conversation).order_by('timestamp').values(*MESSAGE_FIELDS)
+    return [message_dict(row) for row in rows]
+
+
+@timed('serializer')
+def serialize_conversation_detail(conversation: Conversation) -> Dict:
+    """Equivalent of ConversationDetailSerializer(conversation).data."""
+    messages = serialize_messages(conversation)
+    return {
+        'id': conversation.id,
+        'title': conversation.title,
+        'start_timestamp': format_datetime(conversation.start_timestamp),
+        'end_timestamp': format_datetime(conversation.end_timestamp),
+        'status': conversation.status,
+        'ai_summary': conversation.ai_summary,
+        'metadata': conversation.metadata,
+        'messages': messages,
+        'message_count': len(messages),
+        'duration': _duration(conversation.start_timestamp, conversation.end_timestamp),
+    }
+
+
+def conversation_list_rows(queryset):
+    """
+    Annotate a Conversation queryset into values() rows carrying everything
+    ConversationListSerializer needs, with message counts in the same query.
+    The ordering is kept explicit because Meta.ordering is not applied to
+    aggregation queries.
+    """
+    ordering = queryset.query.order_by or Conversation._meta.ordering
+    return queryset.annotate(live_message_count=Count('messages')).order_by(*ordering).values(
+        'id', 'title', 'start_timestamp', 'end_timestamp', 'status', 'metadata',
+        'archived', 'archive__message_count', 'live_message_count'
+    )
+
+
+@timed('serializer')
+def serialize_conversation_list(rows: Iterable[Dict]) -> List[Dict]:
+    """Equivalent of ConversationListSerializer(conversations, many=True).data."""
+    return [
+        {
+            'id': row['id'],
+            'title': row['title'],
+            'start_timestamp': format_datetime(row['start_timestamp']),
+            'end_timestamp': format_datetime(row['end_timestamp']),
+            'status': row['status'],
+            'message_count': (
+                row['archive__message_count'] if row['archived'] else row['live_message_count']
+            ),
+            'duration': _duration(row['start_timestamp'], row['end_timestamp']),
+            'metadata': row['metadata'],
+        }
+        for row in rows
+    ]
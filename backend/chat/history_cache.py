@@ -0,0 +1,101 @@
+"""
+Hot cache of active conversations' prepared prompt histories.
+
+Entries are tagged with the conversation `version` they correspond to. Every
+message write bumps the version by one and appends the new message to the
+cached entry (write-through), so a chat turn costs one append instead of
+re-reading the whole history. A write made elsewhere (another worker) leaves
+the cached entry one version behind, which turns the next lookup into a miss
+and a rebuild from the database.
+
+The in-process cache is a bounded LRU. With HISTORY_CACHE_SHARED enabled,
+entries are mirrored to the shared Django cache so other workers can reuse them.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+SHARED_TIMEOUT = 60 * 60
+
+
+class HistoryCache:
+    """Bounded LRU cache of prompt histories keyed by conversation id."""
+
+    def __init__(self, max_conversations: int = None, shared: bool = None):
+        self.max_conversations = max_conversations or settings.HISTORY_CACHE_MAX_CONVERSATIONS
+        self.shared = settings.HISTORY_CACHE_SHARED if shared is None else shared
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _shared_key(self, conversation_id):
+        return f'chat:history:{conversation_id}'
+
+    def get(self, conversation_id: int, version: int) -> Optional[List[Dict[str, str]]]:
+        """Return a copy of the cached history if it matches `version`, else None."""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(conversation_id)
+                return list(entry[1])
+
+        if self.shared:
+            entry = cache.get(self._shared_key(conversation_id))
+            if entry is not None and entry[0] == version:
+                self._store(conversation_id, version, entry[1])
+                return list(entry[1])
+        return None
+
+    def put(self, conversation_id: int, version: int, history: List[Dict[str, str]]):
+        """Cache a freshly built history for `version`."""
+        self._store(conversation_id, version, list(history))
+        if self.shared:
+            cache.set(self._shared_key(conversation_id), (version, history), SHARED_TIMEOUT)
+
+    def append(self, conversation_id: int, version: int, message: Dict[str, str]):
+        """
+        Write-through append of a message whose write produced `version`.
+        Only applies if the entry is exactly one version behind.
+        """
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None or entry[0] != version - 1:
+                self._entries.pop(conversation_id, None)
+                history = None
+            else:
+                history = entry[1]
+                history.append(message)
+                self._entries[conversation_id] = (version, history)
+                self._entries.move_to_end(conversation_id)
+
+        if self.shared:
+            if history is None:
+                cache.delete(self._shared_key(conversation_id))
+            else:
+                cache.set(self._shared_key(conversation_id), (version, history), SHARED_TIMEOUT)
+
+    def invalidate(self, conversation_id: int):
+        """Drop a conversation's cached history (e.g. when it ends)."""
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+        if self.shared:
+            cache.delete(self._shared_key(conversation_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, conversation_id, version, history):
+        with self._lock:
+            self._entries[conversation_id] = (version, history)
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+
+history_cache = HistoryCache()
@@ -0,0 +1,163 @@
+"""
+Idempotency-Key support for non-idempotent POST endpoints.
+
+The first request with a given key (per endpoint path) claims an
+IdempotencyRecord and runs; its response is stored for IDEMPOTENCY_TTL
+seconds and replayed for retries with the same key. A duplicate arriving
+while the first request is still running waits up to IDEMPOTENCY_WAIT_SECONDS
+for it to finish. Reusing a key for a different request body is rejected.
+
+Server errors are not stored, so the client can retry. A view that failed
+after a write the retry must not repeat (e.g. a saved user message before an
+AI timeout) sets `response.idempotency_resume` to a JSON-serializable dict;
+the retry then runs with it as `request.idempotency_resume`.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .deadlines import CLIENT_CLOSED_REQUEST
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+POLL_INTERVAL = 0.1
+
+
+def request_fingerprint(request) -> str:
+    """Hash of the method, path and body of a request."""
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def claim(key: str, scope: str, fingerprint: str):
+    """
+    Claim a key for a new request.
+
+    Returns:
+        (record, created): the new in-progress record, or the existing one
+        if the key is already taken
+    """
+    now = timezone.now()
+    # An expired record (including the lock of a request that died) frees the key
+    IdempotencyRecord.objects.filter(key=key, scope=scope, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyRecord.objects.create(
+                key=key,
+                scope=scope,
+                fingerprint=fingerprint,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+            )
+        return record, True
+    except IntegrityError:
+        return IdempotencyRecord.objects.get(key=key, scope=scope), False
+
+
+def wait_for_completion(record: IdempotencyRecord) -> IdempotencyRecord:
+    """Poll an in-progress record until it completes, disappears or the wait times out."""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while record is not None and record.status == 'in_progress' and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyRecord.objects.filter(id=record.id).first()
+    return record
+
+
+def replay(record: IdempotencyRecord) -> Response:
+    response = Response(record.response_body, status=record.response_status)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Make a function-based API view honour the Idempotency-Key header.
+    Apply below @api_view. Requests without the header are unaffected.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {"error": f"{HEADER} must be at most 255 characters"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        record, created = claim(key, request.path, fingerprint)
+        if not created:
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {"error": f"{HEADER} was already used for a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            record = wait_for_completion(record)
+            if record is not None and record.status == 'completed':
+                return replay(record)
+            if record is not None and record.status == 'failed':
+                resumed = IdempotencyRecord.objects.filter(id=record.id, status='failed').update(
+                    status='in_progress',
+                    expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+                )
+                if resumed:
+                    request.idempotency_resume = record.response_body
+                    return run(record, request, *args, **kwargs)
+                # Another retry resumed it first
+                return wrapper(request, *args, **kwargs)
+            if record is not None:
+                response = Response(
+                    {"error": "A request with this Idempotency-Key is still in progress"},
+                    status=status.HTTP_409_CONFLICT
+                )
+                response['Retry-After'] = '1'
+                return response
+            # The first request failed and released the key: run this one instead
+            return wrapper(request, *args, **kwargs)
+
+        return run(record, request, *args, **kwargs)
+
+    def run(record, request, *args, **kwargs):
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500 or response.status_code == CLIENT_CLOSED_REQUEST:
+            resume = getattr(response, 'idempotency_resume', None)
+            if resume is None:
+                # Server errors and abandoned requests are not stored, so the client can retry
+                record.delete()
+            else:
+                IdempotencyRecord.objects.filter(id=record.id).update(
+                    status='failed',
+                    response_status=response.status_code,
+                    response_body=resume,
+                    expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL)
+                )
+        else:
+            IdempotencyRecord.objects.filter(id=record.id).update(
+                status='completed',
+                response_status=response.status_code,
+                response_body=response.data,
+                expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_TTL)
+            )
+        return response
+
+    return wrapper
+
+
+def purge_expired() -> int:
+    """Delete expired records. Returns the number deleted."""
+    deleted, _ = IdempotencyRecord.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
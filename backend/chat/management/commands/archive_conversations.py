@@ -0,0 +1,67 @@
+"""
+Management command to move old ended conversations into compressed cold storage.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.archive import archivable_conversations, archive_conversation, expire_archives
+from chat.compression import available_codecs
+
+
+class Command(BaseCommand):
+    help = 'Compacts ended conversations older than N days into compressed archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+            help='Archive conversations that ended more than this many days ago'
+        )
+        parser.add_argument(
+            '--codec', choices=['zlib', 'lzma', 'zstd'], default=None,
+            help='Compression codec (defaults to ARCHIVE_CODEC or the best available)'
+        )
+        parser.add_argument(
+            '--expire-days', type=int, default=settings.ARCHIVE_RETENTION_DAYS,
+            help='Delete archived conversations that ended more than this many days ago (0 disables)'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Maximum number of conversations to archive in this run'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report what would be archived'
+        )
+
+    def handle(self, *args, **options):
+        codec = options['codec']
+        if codec and codec not in available_codecs():
+            raise CommandError(f"Codec '{codec}' is not available in this environment")
+
+        conversations = archivable_conversations(options['days'])
+        if options['limit']:
+            conversations = conversations[:options['limit']]
+
+        if options['dry_run']:
+            self.stdout.write(f'{conversations.count()} conversation(s) would be archived')
+        else:
+            archived = 0
+            original_size = 0
+            compressed_size = 0
+            for conversation in conversations.iterator():
+                archive = archive_conversation(conversation, codec=codec)
+                archived += 1
+                original_size += archive.original_size
+                compressed_size += len(archive.data)
+
+            ratio = original_size / compressed_size if compressed_size else 0
+            self.stdout.write(self.style.SUCCESS(
+                f'Archived {archived} conversation(s): {original_size} -> {compressed_size} bytes '
+                f'({ratio:.1f}x)'
+            ))
+
+        if options['expire_days']:
+            if options['dry_run']:
+                return
+            expired = expire_archives(options['expire_days'])
+            self.stdout.write(self.style.SUCCESS(f'Expired {expired} archived conversation(s)'))
@@ -0,0 +1,178 @@
+"""
+Management command to (re)generate summaries and metadata of ended conversations.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import analytics
+from chat.ai_service import AIService
+from chat.backfill import (
+    MODES,
+    BatchBackend,
+    Checkpoint,
+    LocalBatchClient,
+    RateLimiter,
+    ThreadPoolBackend,
+    batch_client,
+    save_result,
+    select_conversations,
+)
+from chat.services import load_histories
+from chat.typeahead import typeahead_index
+from chat.usage import record_usage
+
+
+class Command(BaseCommand):
+    help = 'Backfills AI summaries and topics of ended conversations in parallel, resuming from a checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', choices=MODES, default='missing',
+            help="'missing': no/failed summary or no topics; 'stale': not summarized by the current model; "
+                 "'all': every ended conversation"
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.BACKFILL_WORKERS,
+            help='Concurrent provider calls'
+        )
+        parser.add_argument(
+            '--map-workers', type=int, default=1,
+            help='Concurrent chunk summaries within one long conversation'
+        )
+        parser.add_argument(
+            '--rate', type=float, default=settings.BACKFILL_RATE_LIMIT,
+            help='Maximum provider calls per second, counting every chunk call (0 for no limit)'
+        )
+        parser.add_argument(
+            '--retries', type=int, default=3,
+            help='Retries per conversation, with exponential backoff'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=100,
+            help='Conversations per chunk; progress is checkpointed after each chunk'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Maximum number of conversations to process in this run'
+        )
+        parser.add_argument(
+            '--batch', choices=['provider', 'local'], default=None,
+            help="Submit each chunk as one batch job ('provider' batch API, or the 'local' stand-in)"
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=30,
+            help='Seconds between batch status checks'
+        )
+        parser.add_argument(
+            '--checkpoint', default=settings.BACKFILL_CHECKPOINT_PATH,
+            help='Checkpoint file used to resume an interrupted run'
+        )
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Only process the conversations that failed in earlier runs with this checkpoint'
+        )
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Ignore and remove an existing checkpoint'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report how many conversations would be processed'
+        )
+
+    def handle(self, *args, **options):
+        service = AIService()
+        model = service.model
+        if options['reset']:
+            Checkpoint(options['checkpoint'], options['mode']).reset()
+        try:
+            checkpoint = Checkpoint.load(options['checkpoint'], options['mode'])
+        except ValueError as e:
+            raise CommandError(f'{e} (use --reset)')
+
+        if options['retry_failed']:
+            # The ids are retried whatever the mode selects now; failures are recorded again
+            conversations = select_conversations('all', model).filter(id__in=checkpoint.failed)
+        else:
+            conversations = select_conversations(options['mode'], model).filter(id__gt=checkpoint.last_id)
+        if options['limit']:
+            conversations = conversations[:options['limit']]
+        ids = list(conversations.values_list('id', flat=True))
+
+        if options['dry_run']:
+            if options['retry_failed']:
+                self.stdout.write(f'{len(ids)} failed conversation(s) would be retried')
+            else:
+                self.stdout.write(
+                    f'{len(ids)} conversation(s) would be processed (resuming after id {checkpoint.last_id})'
+                )
+            return
+
+        limiter = RateLimiter(options['rate'])
+        if options['batch'] == 'local':
+            backend = BatchBackend(LocalBatchClient(service), limiter)
+        elif options['batch'] == 'provider':
+            try:
+                backend = BatchBackend(batch_client(service, options['poll_interval']), limiter)
+            except ValueError as e:
+                raise CommandError(str(e))
+        else:
+            backend = ThreadPoolBackend(
+                options['workers'], limiter, options['retries'], map_workers=options['map_workers']
+            )
+
+        started = time.monotonic()
+        succeeded = failed = 0
+        for start in range(0, len(ids), options['chunk_size']):
+            chunk_ids = ids[start:start + options['chunk_size']]
+            chunk = list(select_conversations('all', model).filter(id__in=chunk_ids))
+            histories = load_histories(chunk)
+            results = backend.summarize({conv.id: histories[conv.id] for conv in chunk})
+
+            saved = 0
+            for conversation in chunk:
+                result = results[conversation.id]
+                if conversation.id in checkpoint.failed:
+                    checkpoint.failed.remove(conversation.id)
+                if 'summary' in result:
+                    save_result(conversation, histories[conversation.id], result['summary'], model)
+                    checkpoint.succeeded += 1
+                    succeeded += 1
+                    saved += 1
+                else:
+                    checkpoint.failed.append(conversation.id)
+                    failed += 1
+                    self.stderr.write(f"Conversation {conversation.id}: {result['error']}")
+                if 'service' in result:
+                    record_usage(result['service'], conversation)
+            record_usage(service)
+            if saved:
+                # Topics changed: the index is rebuilt once per chunk, not per conversation
+                typeahead_index.invalidate()
+
+            if not options['retry_failed']:
+                checkpoint.last_id = chunk_ids[-1]
+            checkpoint.save()
+
+            elapsed = time.monotonic() - started
+            done = succeeded + failed
+            self.stdout.write(
+                f'{done}/{len(ids)} processed, {failed} failed, '
+                f'{done / elapsed if elapsed else 0:.1f} conversations/s'
+            )
+
+        if succeeded:
+            # save_result replaced topics; the topic rollups are recounted once for the whole run
+            analytics.rebuild()
+
+        if not options['limit'] and not options['retry_failed']:
+            # Finished: the next run starts from the beginning again, failures stay recorded
+            checkpoint.finish()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled {succeeded} conversation(s), {failed} failed, in {elapsed:.1f}s '
+            f'({(succeeded + failed) / elapsed if elapsed else 0:.1f} conversations/s)'
+        ))
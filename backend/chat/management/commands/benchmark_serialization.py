@@ -0,0 +1,59 @@
+"""
+Management command to micro-benchmark the fast serialization path against DRF serializers.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from chat.fast_serializers import dumps, orjson, serialize_conversation_detail
+from chat.models import Conversation, Message
+from chat.serializers import ConversationDetailSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares DRF and fast-path serialization time for a conversation with N messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help='Messages in the benchmark conversation')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed iterations per path')
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        repeat = options['repeat']
+        renderer = JSONRenderer()
+
+        # All benchmark rows are rolled back at the end
+        with transaction.atomic():
+            conversation = Conversation.objects.create(title='Serialization benchmark')
+            Message.objects.bulk_create([
+                Message(
+                    conversation=conversation,
+                    content=f'Benchmark message number {i} with a little bit of text in it.',
+                    sender='user' if i % 2 == 0 else 'ai'
+                )
+                for i in range(count)
+            ])
+
+            drf_ms = self._time(repeat, lambda: renderer.render(
+                ConversationDetailSerializer(conversation).data
+            ))
+            fast_ms = self._time(repeat, lambda: dumps(serialize_conversation_detail(conversation)))
+
+            transaction.set_rollback(True)
+
+        per_k = 1000 / count if count else 0
+        encoder = 'orjson' if orjson is not None else 'json'
+        self.stdout.write(f'Messages: {count}, iterations: {repeat}, encoder: {encoder}')
+        self.stdout.write(f'DRF serializer: {drf_ms:.2f} ms ({drf_ms * per_k:.2f} ms per 1k messages)')
+        self.stdout.write(f'Fast path:      {fast_ms:.2f} ms ({fast_ms * per_k:.2f} ms per 1k messages)')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {drf_ms / fast_ms:.1f}x' if fast_ms else 'Speedup: n/a'))
+
+    def _time(self, repeat, func):
+        """Average wall time in milliseconds of `func` over `repeat` calls."""
+        func()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        return (time.perf_counter() - start) * 1000 / repeat
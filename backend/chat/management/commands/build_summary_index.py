@@ -0,0 +1,48 @@
+"""
+Management command to build the hierarchical summary index.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import summary_index
+from chat.ai_service import AIService
+from chat.summarization import SummaryError
+from chat.usage import record_usage
+
+
+class Command(BaseCommand):
+    help = 'Refreshes stale day, week and month summaries of the summary index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recreate all nodes from the ended conversations first'
+        )
+        parser.add_argument(
+            '--counts-only',
+            action='store_true',
+            help='Only update conversation counts and topics, without generating summaries'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        ai_service = None if options['counts_only'] else AIService()
+        try:
+            if options['rebuild']:
+                result = summary_index.rebuild(ai_service)
+                self.stdout.write(f"Rebuilt {result['nodes']} node(s)")
+                refreshed = result['summarized']
+            else:
+                refreshed = summary_index.refresh_stale(ai_service) if ai_service else 0
+        except SummaryError as e:
+            self.stderr.write(self.style.ERROR(f'Summary generation failed: {e}'))
+            refreshed = None
+        finally:
+            if ai_service is not None:
+                record_usage(ai_service)
+
+        if refreshed is not None:
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} node(s) in {elapsed:.2f}s'))
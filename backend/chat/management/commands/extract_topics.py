@@ -0,0 +1,96 @@
+"""
+Management command to (re)extract topics for ended conversations locally.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat import analytics, caching, summary_index, topics
+from chat.ai_service import AIService
+from chat.models import Conversation, TopicCorpus
+from chat.typeahead import typeahead_index
+from chat.usage import record_usage
+
+
+class Command(BaseCommand):
+    help = 'Backfills conversation topics with the local topic extractor'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Re-extract topics for conversations that already have them'
+        )
+        parser.add_argument(
+            '--rebuild-corpus', action='store_true',
+            help='Recompute the term statistics from all ended conversations first '
+                 '(done automatically while the corpus is empty)'
+        )
+        parser.add_argument(
+            '--refine', action='store_true',
+            help='Refine the local topics with the configured LLM'
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help='Maximum number of conversations to process in this run'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Print the extracted topics without saving anything (a corpus rebuild is rolled back)'
+        )
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            self.extract(options)
+            return
+        # The preview may need a corpus rebuild (and records usage with --refine);
+        # every database write is rolled back
+        with transaction.atomic():
+            self.extract(options)
+            transaction.set_rollback(True)
+
+    def extract(self, options):
+        ended = Conversation.objects.filter(status='ended').select_related('archive')
+
+        if options['rebuild_corpus'] or not TopicCorpus.objects.exists():
+            documents = topics.rebuild_corpus(
+                [msg.content for msg in conv.get_messages()] for conv in ended.iterator()
+            )
+            self.stdout.write(f'Rebuilt term statistics from {documents} conversation(s)')
+
+        conversations = ended.order_by('id')
+        if not options['all']:
+            conversations = conversations.exclude(metadata__has_key='topics')
+        if options['limit']:
+            conversations = conversations[:options['limit']]
+
+        ai_service = AIService() if options['refine'] else None
+        processed = 0
+        started = time.monotonic()
+        for conversation in conversations.iterator():
+            history = [
+                {'sender': msg.sender, 'content': msg.content}
+                for msg in conversation.get_messages()
+            ]
+            if ai_service is not None:
+                extracted = ai_service.extract_key_topics(history, refine=True)
+                record_usage(ai_service, conversation)
+            else:
+                extracted = topics.extract_topics(msg['content'] for msg in history)
+            processed += 1
+
+            if options['dry_run']:
+                self.stdout.write(f'{conversation.id}: {", ".join(extracted)}')
+                continue
+            conversation.metadata = {**conversation.metadata, 'topics': extracted}
+            conversation.save(update_fields=['metadata'])
+            caching.touch_conversation(conversation.id)
+            summary_index.mark_stale(conversation)
+
+        elapsed = time.monotonic() - started
+        if not options['dry_run'] and processed:
+            analytics.rebuild()
+            typeahead_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Extracted topics for {processed} conversation(s) in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,90 @@
+"""
+Management command to index conversations for near-duplicate detection and
+report clusters of near-duplicates.
+"""
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat import dedup
+from chat.models import Conversation
+from chat.services import load_histories
+
+
+class Command(BaseCommand):
+    help = 'Reports clusters of near-duplicate conversations (MinHash/LSH)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index',
+            action='store_true',
+            help='Compute signatures for ended conversations that have none first'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='With --index, recompute every signature (after changing DEDUP_NUM_PERM or DEDUP_BANDS)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Conversations signed per transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--min-size',
+            type=int,
+            default=2,
+            help='Smallest cluster to report (default: 2)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20,
+            help='Number of clusters to print (default: 20)'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print all clusters as JSON lists of conversation ids'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['index']:
+            self.index(options['all'], options['batch_size'])
+
+        clusters = dedup.clusters(min_size=options['min_size'])
+        if options['json']:
+            self.stdout.write(json.dumps(clusters))
+            return
+
+        titles = dict(
+            Conversation.objects.filter(id__in=[group[0] for group in clusters[:options['limit']]])
+            .values_list('id', 'title')
+        )
+        for group in clusters[:options['limit']]:
+            self.stdout.write(f'{len(group)} x "{titles.get(group[0], "")}": {", ".join(map(str, group))}')
+        duplicates = sum(len(group) - 1 for group in clusters)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Found {len(clusters)} cluster(s) with {duplicates} redundant conversation(s) in {elapsed:.2f}s'
+        ))
+
+    def index(self, everything: bool, batch_size: int):
+        conversations = Conversation.objects.filter(status='ended').select_related('archive').order_by('id')
+        if not everything:
+            conversations = conversations.filter(signature__isnull=True)
+        indexed = 0
+        last_id = 0
+        while True:
+            # Keyset pagination, so conversations that stay unsigned (no user messages) are not refetched
+            batch = list(conversations.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            histories = load_histories(batch)
+            dedup.store_signatures({conversation.id: histories[conversation.id] for conversation in batch})
+            indexed += len(batch)
+            last_id = batch[-1].id
+        self.stdout.write(f'Signed {indexed} conversation(s)')
@@ -0,0 +1,14 @@
+"""
+Management command to delete expired Idempotency-Key records.
+"""
+from django.core.management.base import BaseCommand
+
+from chat.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored Idempotency-Key responses whose TTL has passed'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency record(s)'))
@@ -0,0 +1,17 @@
+"""
+Management command to rebuild the analytics rollup tables from scratch.
+"""
+from django.core.management.base import BaseCommand
+
+from chat import analytics
+
+
+class Command(BaseCommand):
+    help = 'Recomputes daily stats and topic counts from all conversations and messages'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding analytics rollups...')
+        result = analytics.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {result['days']} day(s) of stats and {result['topics']} topic(s)"
+        ))
@@ -0,0 +1,47 @@
+"""
+Management command to profile cold start: import time and time to first request.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.startup import profile_startup, top_imports
+
+
+class Command(BaseCommand):
+    help = 'Boots the project in a fresh process and reports import time and time to first request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/settings/ai/providers/', help='URL of the first request')
+        parser.add_argument('--top', type=int, default=15, help='Number of packages to list')
+        parser.add_argument(
+            '--target-ms', type=int, default=settings.STARTUP_TARGET_MS,
+            help='Fail if the first request is served later than this after process start'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            report = profile_startup(options['path'], str(settings.BASE_DIR))
+        except RuntimeError as e:
+            raise CommandError(f'Startup profiling failed: {e}')
+
+        self.stdout.write('Phase timings (ms since process spawn):')
+        self.stdout.write(f"  interpreter ready   {report['interpreter_ms']:8.1f}")
+        self.stdout.write(f"  django.setup()      {report['django_setup_ms']:8.1f}")
+        self.stdout.write(f"  URLconf loaded      {report['urls_loaded_ms']:8.1f}")
+        self.stdout.write(
+            f"  first request       {report['first_request_ms']:8.1f}  (HTTP {report['status_code']})"
+        )
+
+        total_imports = sum(report['imports'].values())
+        self.stdout.write(f'\nImport time by package (total {total_imports:.1f} ms):')
+        for package, ms in top_imports(report['imports'], options['top']):
+            self.stdout.write(f'  {package:<28} {ms:8.1f}')
+
+        if report['first_request_ms'] > options['target_ms']:
+            raise CommandError(
+                f"First request served after {report['first_request_ms']:.0f} ms, "
+                f"target is {options['target_ms']} ms"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"\nFirst request within target ({report['first_request_ms']:.0f} ms <= {options['target_ms']} ms)"
+        ))
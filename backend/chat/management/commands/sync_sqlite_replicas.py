@@ -0,0 +1,31 @@
+"""
+Management command to copy the SQLite primary database into the local replica files.
+"""
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Copies the SQLite primary into the SQLite read replicas (local stand-in for replication)'
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Only SQLite databases can be synced; real replicas use database replication')
+        if not settings.REPLICA_DATABASES:
+            self.stdout.write('No replicas configured (set DATABASE_REPLICAS)')
+            return
+
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias in settings.REPLICA_DATABASES:
+                target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(f"Synced {alias} ({settings.DATABASES[alias]['NAME']})"))
+        finally:
+            source.close()
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.1 on 2026-10-19 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_conversation_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('conversations_started', models.PositiveIntegerField(default=0)),
+                ('conversations_ended', models.PositiveIntegerField(default=0)),
+                ('total_duration_seconds', models.FloatField(default=0)),
+                ('user_messages', models.PositiveIntegerField(default=0)),
+                ('ai_messages', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily stats',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TopicCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=255, unique=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-count', 'topic'],
+                'indexes': [models.Index(fields=['-count'], name='chat_topicc_count_201885_idx')],
+            },
+        ),
+    ]
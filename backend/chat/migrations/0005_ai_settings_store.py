@@ -0,0 +1,32 @@
+# Generated by Django 5.0.1 on 2026-10-19 07:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_conversation_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AISettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(blank=True, default='', max_length=20)),
+                ('model', models.CharField(blank=True, default='', max_length=255)),
+                ('openai_api_key', models.CharField(blank=True, default='', max_length=255)),
+                ('anthropic_api_key', models.CharField(blank=True, default='', max_length=255)),
+                ('google_api_key', models.CharField(blank=True, default='', max_length=255)),
+                ('lm_studio_base_url', models.CharField(blank=True, default='', max_length=255)),
+                ('lm_studio_api_key', models.CharField(blank=True, default='', max_length=255)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'AI settings',
+                'verbose_name_plural': 'AI settings',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_ai_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiusage',
+            name='routing',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
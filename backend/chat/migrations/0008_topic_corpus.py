@@ -0,0 +1,32 @@
+# Generated by Django 5.0.1 on 2026-10-19 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_ai_usage_routing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicCorpus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('documents', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'topic corpus',
+            },
+        ),
+        migrations.CreateModel(
+            name='TopicTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('documents', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
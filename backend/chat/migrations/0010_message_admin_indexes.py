@@ -0,0 +1,36 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:01
+
+from django.db import migrations, models
+
+# Matches the expression of SearchVector('content', config='english') used by MessageAdmin
+FULL_TEXT_INDEX = 'chat_message_content_fts_idx'
+
+
+def create_full_text_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {FULL_TEXT_INDEX} ON chat_message "
+        f"USING GIN (to_tsvector('english'::regconfig, COALESCE((content)::text, '')))"
+    )
+
+
+def drop_full_text_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {FULL_TEXT_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_idempotency_records'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['timestamp'], name='chat_messag_timesta_6494d7_idx'),
+        ),
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_summary_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SummaryNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('period_end', models.DateField()),
+                ('conversation_count', models.PositiveIntegerField(default=0)),
+                ('topics', models.JSONField(blank=True, default=dict)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('stale', models.BooleanField(default=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['level', 'period_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='summarynode',
+            constraint=models.UniqueConstraint(fields=('level', 'period_start'), name='unique_summary_node_period'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_request_profiles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationSignature',
+            fields=[
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='signature', serialize=False, to='chat.conversation')),
+                ('signature', models.BinaryField()),
+                ('shingle_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MinHashBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='minhash_bands', to='chat.conversation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['band', 'bucket'], name='chat_minhas_band_dc0ff9_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='minhashband',
+            constraint=models.UniqueConstraint(fields=('conversation', 'band'), name='unique_minhash_band'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:36
+
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from chat.compression import decompress
+
+
+def index_existing_archives(apps, schema_editor):
+    # Imported here: chat.archive loads the current models
+    from chat.archive import archive_terms
+    ConversationArchive = apps.get_model('chat', 'ConversationArchive')
+    ArchiveTerm = apps.get_model('chat', 'ArchiveTerm')
+    for archive in ConversationArchive.objects.only('id', 'codec', 'data').iterator(chunk_size=100):
+        rows = json.loads(decompress(archive.data, archive.codec))
+        ArchiveTerm.objects.bulk_create([ArchiveTerm(archive_id=archive.id, term=term) for term in archive_terms(rows)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_message_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='chat.conversationarchive')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term'], name='chat_archiv_term_38b9f2_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='archiveterm',
+            constraint=models.UniqueConstraint(fields=('archive', 'term'), name='unique_archive_term'),
+        ),
+        migrations.RunPython(index_existing_archives, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-19 08:51
+
+import time
+
+from django.db import migrations, models
+
+
+def create_generation_row(apps, schema_editor):
+    # Seeded from the clock, like caching.bump_write_generation, so reads never need to create it
+    WriteGeneration = apps.get_model('chat', 'WriteGeneration')
+    WriteGeneration.objects.get_or_create(id=1, defaults={'value': time.time_ns()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_idempotency_failed_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WriteGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_generation_row, migrations.RunPython.noop),
+    ]
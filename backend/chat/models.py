@@ -1,9 +1,15 @@
 """
 Database models for the chat application.
 """
+import json
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils import timezone
 
+from .compression import decompress
+
 
 class Conversation(models.Model):
     """
@@ -20,6 +26,9 @@ class Conversation(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
     ai_summary = models.TextField(blank=True, null=True)
     metadata = models.JSONField(default=dict, blank=True)
+    archived = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-start_timestamp']
@@ -39,7 +48,21 @@ class Conversation(models.Model):
     
     def get_message_count(self):
         """Get total number of messages in this conversation."""
+        if self.archived:
+            return self.archive.message_count
+        if hasattr(self, 'live_message_count'):
+            # Annotated by list querysets (see fast_serializers.conversation_list_rows)
+            return self.live_message_count
         return self.messages.count()
+    
+    def get_messages(self):
+        """
+        Get the ordered messages of this conversation, transparently
+        decompressing them from cold storage if the conversation is archived.
+        """
+        if self.archived:
+            return self.archive.load_messages()
+        return self.messages.order_by('timestamp')
 
 
 class Message(models.Model):
@@ -50,6 +73,13 @@ class Message(models.Model):
         ('user', 'User'),
         ('ai', 'AI'),
     ]
+    # An AI reply is written while it streams ('streaming') so a client that
+    # lost the stream can resume it; 'interrupted' replies were cut short
+    STATUS_CHOICES = [
+        ('complete', 'Complete'),
+        ('streaming', 'Streaming'),
+        ('interrupted', 'Interrupted'),
+    ]
     
     conversation = models.ForeignKey(
         Conversation,
@@ -58,6 +88,7 @@ class Message(models.Model):
     )
     content = models.TextField()
     sender = models.CharField(max_length=10, choices=SENDER_CHOICES)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='complete')
     timestamp = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -65,7 +96,390 @@ class Message(models.Model):
         indexes = [
             models.Index(fields=['conversation', 'timestamp']),
             models.Index(fields=['sender']),
+            models.Index(fields=['timestamp']),
         ]
     
     def __str__(self):
         return f"{self.sender}: {self.content[:50]}"
+
+
+class ConversationArchive(models.Model):
+    """
+    Compressed cold-storage copy of an ended conversation's messages.
+    Once a conversation is archived its Message rows are removed.
+    """
+    CODEC_CHOICES = [
+        ('zlib', 'zlib'),
+        ('lzma', 'lzma'),
+        ('zstd', 'zstd'),
+    ]
+    
+    conversation = models.OneToOneField(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='archive'
+    )
+    codec = models.CharField(max_length=10, choices=CODEC_CHOICES)
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField(default=0)
+    original_size = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['archived_at']),
+        ]
+    
+    def __str__(self):
+        return f"Archive of conversation {self.conversation_id} ({self.codec})"
+    
+    def load_rows(self):
+        """Decompress the archived message rows (cached on the instance)."""
+        if not hasattr(self, '_rows'):
+            self._rows = json.loads(decompress(self.data, self.codec))
+        return self._rows
+    
+    def load_messages(self):
+        """Return unsaved Message instances rebuilt from the archived rows."""
+        return [
+            Message(
+                id=row['id'],
+                conversation_id=self.conversation_id,
+                content=row['content'],
+                sender=row['sender'],
+                status=row.get('status', 'complete'),
+                timestamp=datetime.fromisoformat(row['timestamp'])
+            )
+            for row in self.load_rows()
+        ]
+    
+    def contains(self, text):
+        """Case-insensitive substring search over the archived message contents."""
+        text = text.lower()
+        return any(text in row['content'].lower() for row in self.load_rows())
+
+
+class ArchiveTerm(models.Model):
+    """
+    A word of an archived conversation's messages. Keyword search looks
+    archives up by their words instead of decompressing every blob.
+    """
+    archive = models.ForeignKey(ConversationArchive, on_delete=models.CASCADE, related_name='terms')
+    term = models.CharField(max_length=64)  # lowercased, truncated
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['archive', 'term'], name='unique_archive_term'),
+        ]
+        indexes = [
+            models.Index(fields=['term']),
+        ]
+    
+    def __str__(self):
+        return f"{self.term} in archive {self.archive_id}"
+
+
+class DailyStats(models.Model):
+    """
+    Per-day rollup of conversation and message activity, maintained
+    incrementally as conversations are created and ended and as messages are sent.
+    """
+    date = models.DateField(unique=True)
+    conversations_started = models.PositiveIntegerField(default=0)
+    conversations_ended = models.PositiveIntegerField(default=0)
+    total_duration_seconds = models.FloatField(default=0)
+    user_messages = models.PositiveIntegerField(default=0)
+    ai_messages = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-date']
+        verbose_name_plural = 'Daily stats'
+    
+    def __str__(self):
+        return f"Stats for {self.date}"
+    
+    def get_average_duration(self):
+        """Average duration in seconds of conversations ended on this day."""
+        if not self.conversations_ended:
+            return 0.0
+        return self.total_duration_seconds / self.conversations_ended
+
+
+class TopicCount(models.Model):
+    """
+    Rollup of how many ended conversations mentioned each topic.
+    """
+    topic = models.CharField(max_length=255, unique=True)
+    count = models.PositiveIntegerField(default=0)
+    last_seen = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['-count', 'topic']
+        indexes = [
+            models.Index(fields=['-count']),
+        ]
+    
+    def __str__(self):
+        return f"{self.topic} ({self.count})"
+
+
+class WriteGeneration(models.Model):
+    """
+    Global write counter (a single row) that conversation lists and search
+    results are validated and cached against; every write advances it.
+    """
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Write generation {self.value}"
+
+
+class TopicTerm(models.Model):
+    """
+    Corpus statistics for local topic extraction: the number of
+    conversations whose text contains each term (document frequency).
+    """
+    term = models.CharField(max_length=100, unique=True)
+    documents = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.term} ({self.documents})"
+
+
+class TopicCorpus(models.Model):
+    """
+    Number of conversations counted in the TopicTerm statistics (a single row).
+    """
+    documents = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'topic corpus'
+    
+    def __str__(self):
+        return f"Topic corpus ({self.documents} documents)"
+
+
+class SummaryChunk(models.Model):
+    """
+    Cached summary of one chunk of a long conversation, keyed by a hash of
+    the model and the chunk text (see chat.summarization).
+    """
+    key = models.CharField(max_length=64, unique=True)
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='summary_chunks',
+        blank=True,
+        null=True
+    )
+    model = models.CharField(max_length=100)
+    summary = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Chunk summary {self.key[:12]} ({self.model})"
+
+
+class SummaryNode(models.Model):
+    """
+    Pre-computed summary of the conversations that ended in one day, week
+    (from Monday) or month, for answering time-range questions (see
+    chat.summary_index). Counts and topics are kept current as conversations
+    end; the summary text is regenerated when the node is stale.
+    """
+    LEVEL_CHOICES = [
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+    ]
+    
+    level = models.CharField(max_length=5, choices=LEVEL_CHOICES)
+    period_start = models.DateField()
+    period_end = models.DateField()  # exclusive
+    conversation_count = models.PositiveIntegerField(default=0)
+    topics = models.JSONField(default=dict, blank=True)  # normalized topic -> conversations
+    summary = models.TextField(blank=True, default='')
+    stale = models.BooleanField(default=True)
+    # Advanced by every change, so a refresh never clears a newer change's stale flag
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['level', 'period_start']
+        constraints = [
+            models.UniqueConstraint(fields=['level', 'period_start'], name='unique_summary_node_period'),
+        ]
+    
+    def __str__(self):
+        return f"{self.level} of {self.period_start}"
+
+
+class AISettings(models.Model):
+    """
+    Persisted AI provider settings shared by all workers (a single row).
+    Blank fields fall back to the values from the environment.
+    """
+    provider = models.CharField(max_length=20, blank=True, default='')
+    model = models.CharField(max_length=255, blank=True, default='')
+    openai_api_key = models.CharField(max_length=255, blank=True, default='')
+    anthropic_api_key = models.CharField(max_length=255, blank=True, default='')
+    google_api_key = models.CharField(max_length=255, blank=True, default='')
+    lm_studio_base_url = models.CharField(max_length=255, blank=True, default='')
+    lm_studio_api_key = models.CharField(max_length=255, blank=True, default='')
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'AI settings'
+        verbose_name_plural = 'AI settings'
+    
+    def __str__(self):
+        return f"AI settings v{self.version}"
+
+
+class AIUsage(models.Model):
+    """
+    Token usage, cost and latency of a single AI provider call.
+    """
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='usage',
+        blank=True,
+        null=True
+    )
+    message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        related_name='usage',
+        blank=True,
+        null=True
+    )
+    purpose = models.CharField(max_length=20, default='chat')
+    provider = models.CharField(max_length=20)
+    model = models.CharField(max_length=255)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(default=0)
+    cost = models.FloatField(default=0)
+    latency_ms = models.PositiveIntegerField(default=0)
+    # Routing decision (tier, score, features) of a chat turn, for offline evaluation
+    routing = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['conversation', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.provider}/{self.model}: {self.prompt_tokens}+{self.completion_tokens} tokens"
+    
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+
+class IdempotencyRecord(models.Model):
+    """
+    A request made with an Idempotency-Key header, and its stored response
+    once it has completed. A request that failed after writing something
+    is 'failed', with what a retry needs to resume as response_body.
+    """
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'scope'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.key} {self.scope} ({self.status})"
+
+
+class RequestProfile(models.Model):
+    """
+    cProfile capture of one sampled request (see chat.profiling).
+    """
+    TRIGGER_CHOICES = [
+        ('sample', 'Sampled'),
+        ('header', 'Requested by header'),
+    ]
+    
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=200, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    # Section name -> {"calls": int, "ms": float}, e.g. "ai" and "serializer"
+    sections = models.JSONField(default=dict, blank=True)
+    trigger = models.CharField(max_length=10, choices=TRIGGER_CHOICES)
+    stats = models.BinaryField()  # marshalled cProfile stats, loadable with pstats
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+
+class ConversationSignature(models.Model):
+    """
+    MinHash signature of a conversation's user messages, for finding
+    near-duplicate conversations (see chat.dedup).
+    """
+    conversation = models.OneToOneField(
+        Conversation, on_delete=models.CASCADE, primary_key=True, related_name='signature'
+    )
+    signature = models.BinaryField()  # DEDUP_NUM_PERM little-endian uint32 minimums
+    shingle_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Signature of conversation {self.conversation_id}"
+
+
+class MinHashBand(models.Model):
+    """
+    One LSH band of a conversation's signature. Conversations sharing a
+    (band, bucket) row are near-duplicate candidates.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='minhash_bands')
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()  # 64-bit hash of the band's rows
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'band'], name='unique_minhash_band'),
+        ]
+        indexes = [
+            models.Index(fields=['band', 'bucket']),
+        ]
+    
+    def __str__(self):
+        return f"Band {self.band} of conversation {self.conversation_id}"
@@ -0,0 +1,224 @@
+"""
+Opt-in request profiling for production.
+
+With PROFILING_ENABLED, ProfilingMiddleware runs cProfile on a random
+PROFILING_SAMPLE_RATE fraction of requests, and on any request sent with an
+`X-Profile: 1` header by a staff user (or with the PROFILING_TOKEN as its
+value). Each profile is stored as a RequestProfile with the endpoint, status,
+duration, query count and time, and the time spent in named sections
+(`ai` for AIService provider calls, `serializer` for response serialization).
+Only the newest PROFILING_MAX_PROFILES profiles are kept.
+
+Only one request per process is profiled at a time; a request sampled while
+another is being profiled runs normally. Section times can overlap (queries
+run inside the serializer, for example), and work done on other threads is
+not in the cProfile stats.
+"""
+import contextvars
+import cProfile
+import inspect
+import io
+import marshal
+import pstats
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .models import RequestProfile
+
+HEADER = 'X-Profile'
+
+_profile_lock = threading.Lock()
+_active: contextvars.ContextVar[Optional['ProfileSession']] = contextvars.ContextVar(
+    'chat_profile_session', default=None
+)
+
+
+class ProfileSession:
+    """Section timings and query counts of the request being profiled."""
+
+    def __init__(self):
+        self.sections: Dict[str, Dict[str, float]] = {}
+        self._depth: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float, calls: int = 1):
+        section = self.sections.setdefault(name, {'calls': 0, 'ms': 0.0})
+        section['calls'] += calls
+        section['ms'] += seconds * 1000
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - started)
+
+
+@contextmanager
+def section(name: str, count: bool = True):
+    """
+    Time a block as the named section of the current profile (a no-op when
+    the request is not profiled). Nested blocks of the same name count once.
+    """
+    session = _active.get()
+    if session is None or session._depth.get(name):
+        yield
+        return
+    session._depth[name] = 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        session._depth[name] = 0
+        session.add(name, time.perf_counter() - started, calls=1 if count else 0)
+
+
+def timed(name: str):
+    """
+    Decorator timing a function as a profile section. For generator
+    functions only the time spent producing items is counted, not the time
+    the consumer spends between them.
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                iterator = func(*args, **kwargs)
+                first = True
+                try:
+                    while True:
+                        with section(name, count=first):
+                            try:
+                                item = next(iterator)
+                            except StopIteration:
+                                return
+                        first = False
+                        yield item
+                finally:
+                    # Closing the wrapper (e.g. a cancelled stream) closes the generator it wraps
+                    iterator.close()
+            return generator_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def should_profile(request) -> Optional[str]:
+    """'header' or 'sample' if the request is to be profiled, else None."""
+    if not settings.PROFILING_ENABLED:
+        return None
+    value = request.headers.get(HEADER)
+    if value:
+        user = getattr(request, 'user', None)
+        if (value == '1' and user is not None and user.is_staff) or (
+            settings.PROFILING_TOKEN and value == settings.PROFILING_TOKEN
+        ):
+            return 'header'
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+def enforce_retention():
+    """Delete all but the newest PROFILING_MAX_PROFILES profiles."""
+    old = RequestProfile.objects.order_by('-created_at', '-id').values_list('id', flat=True)[
+        settings.PROFILING_MAX_PROFILES:
+    ]
+    RequestProfile.objects.filter(id__in=list(old)).delete()
+
+
+class _LoadedStats:
+    """Marshalled cProfile stats in the shape pstats.Stats loads from."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def top_functions(profile: RequestProfile, limit: int = 30) -> List[Dict]:
+    """The functions of a stored profile with the highest cumulative time."""
+    stats = pstats.Stats(_LoadedStats(marshal.loads(bytes(profile.stats))), stream=io.StringIO())
+    stats.sort_stats('cumulative')
+    rows = []
+    for func in stats.fcn_list[:limit]:
+        primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[func]
+        filename, line, name = func
+        rows.append({
+            'function': f'{filename}:{line}({name})',
+            'calls': calls,
+            'primitive_calls': primitive_calls,
+            'tottime_ms': round(total_time * 1000, 3),
+            'cumtime_ms': round(cumulative_time * 1000, 3),
+        })
+    return rows
+
+
+class ProfilingMiddleware:
+    """Profile sampled requests and store the results (see module docstring)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        trigger = should_profile(request)
+        if trigger is None or not _profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self._profile(request, trigger)
+        finally:
+            _profile_lock.release()
+
+    def _profile(self, request, trigger: str):
+        session = ProfileSession()
+        token = _active.set(session)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(session.query_wrapper))
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+        finally:
+            _active.reset(token)
+        duration = time.perf_counter() - started
+
+        profiler.create_stats()
+        match = getattr(request, 'resolver_match', None)
+        db = session.sections.pop('db', {'calls': 0, 'ms': 0.0})
+        try:
+            RequestProfile.objects.create(
+                method=request.method,
+                path=request.path[:500],
+                view_name=(match.view_name if match else '')[:200],
+                status_code=response.status_code,
+                duration_ms=round(duration * 1000, 3),
+                query_count=int(db['calls']),
+                query_ms=round(db['ms'], 3),
+                sections={
+                    name: {'calls': int(timing['calls']), 'ms': round(timing['ms'], 3)}
+                    for name, timing in session.sections.items()
+                },
+                trigger=trigger,
+                stats=marshal.dumps(profiler.stats),
+            )
+            enforce_retention()
+        except DatabaseError:
+            # Losing a profile must not fail the request it profiled
+            pass
+        return response
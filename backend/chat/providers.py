@@ -0,0 +1,78 @@
+"""
+Shared, lazily created provider SDK clients.
+
+Provider SDKs are only imported when a provider is first used, and the
+resulting clients are pooled per process so every AIService instance for the
+same provider configuration reuses one client (and its HTTP connection pool).
+"""
+import threading
+from typing import Any, Dict, Tuple
+
+from django.conf import settings
+
+PROVIDERS = ['openai', 'anthropic', 'google', 'lmstudio']
+
+_clients: Dict[Tuple, Any] = {}
+_lock = threading.Lock()
+
+
+def _client_key(provider: str, model: str, config) -> Tuple:
+    """Everything a provider client depends on; a change yields a new client."""
+    if provider == 'openai':
+        return (provider, config.OPENAI_API_KEY)
+    if provider == 'anthropic':
+        return (provider, config.ANTHROPIC_API_KEY)
+    if provider == 'google':
+        return (provider, config.GOOGLE_API_KEY, model)
+    if provider == 'lmstudio':
+        return (provider, config.LM_STUDIO_BASE_URL, config.LM_STUDIO_API_KEY)
+    raise ValueError(f"Unsupported AI provider: {provider}")
+
+
+def _create_client(provider: str, model: str, config):
+    if provider == 'openai':
+        import openai
+        return openai.OpenAI(api_key=config.OPENAI_API_KEY)
+    if provider == 'anthropic':
+        import anthropic
+        return anthropic.Anthropic(api_key=config.ANTHROPIC_API_KEY)
+    if provider == 'google':
+        import google.generativeai as genai
+        genai.configure(api_key=config.GOOGLE_API_KEY)
+        return genai.GenerativeModel(model)
+    if provider == 'lmstudio':
+        import openai
+        return openai.OpenAI(
+            base_url=config.LM_STUDIO_BASE_URL,
+            api_key=config.LM_STUDIO_API_KEY
+        )
+    raise ValueError(f"Unsupported AI provider: {provider}")
+
+
+def get_client(provider: str, model: str, config=None):
+    """
+    Return the pooled client for a provider, creating it on first use.
+    
+    Args:
+        provider: Provider id
+        model: Model name
+        config: Object exposing the provider settings (defaults to django.conf.settings)
+    """
+    config = config or settings
+    key = _client_key(provider, model, config)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _create_client(provider, model, config)
+                _clients[key] = client
+    return client
+
+
+def invalidate(provider: str = None):
+    """Drop pooled clients for one provider, or all of them."""
+    with _lock:
+        for key in list(_clients):
+            if provider is None or key[0] == provider:
+                del _clients[key]
@@ -0,0 +1,99 @@
+"""
+Latency-aware model routing for chat turns.
+
+Each turn is classified from cheap features of the prompt (length of the
+latest user message, conversation length and a small keyword-based linear
+classifier) into a tier. Simple turns ("thanks", short follow-ups) go to the
+fast model with a small max_tokens; complex ones (analysis, code, long
+questions) keep the main model and the full answer budget.
+"""
+import math
+import re
+from typing import Any, Dict, List
+
+from django.conf import settings
+
+TIERS = ['simple', 'standard', 'complex']
+
+SMALLTALK = {
+    'hi', 'hello', 'hey', 'thanks', 'thank', 'thx', 'ok', 'okay', 'cool', 'great',
+    'nice', 'yes', 'no', 'bye', 'sure', 'awesome', 'perfect', 'got', 'it',
+}
+
+COMPLEX_MARKERS = re.compile(
+    r'\b(explain|analy[sz]e|analysis|compare|comparison|design|architecture|implement|'
+    r'write|code|debug|derive|prove|step[- ]by[- ]step|detailed|in depth|essay|plan|'
+    r'strategy|trade-?offs?|why|how does|pros and cons|optimi[sz]e|refactor)\b',
+    re.IGNORECASE
+)
+
+# Weights of the linear classifier: score = sigmoid(bias + sum(weight * feature))
+WEIGHTS = {
+    'log_prompt_words': 0.9,
+    'log_history_messages': 0.25,
+    'complex_markers': 1.2,
+    'has_code': 1.5,
+    'questions': 0.3,
+    'smalltalk_ratio': -3.0,
+}
+BIAS = -2.6
+
+
+def extract_features(messages: List[Dict[str, str]]) -> Dict[str, float]:
+    """Cheap features of the latest user turn and the conversation so far."""
+    last_user = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+    words = re.findall(r"[\w']+", last_user.lower())
+    history = [m for m in messages if m['role'] != 'system']
+    return {
+        'prompt_chars': len(last_user),
+        'prompt_words': len(words),
+        'history_messages': len(history),
+        'history_chars': sum(len(m['content']) for m in history),
+        'log_prompt_words': math.log1p(len(words)),
+        'log_history_messages': math.log1p(len(history)),
+        'complex_markers': min(len(COMPLEX_MARKERS.findall(last_user)), 3),
+        'has_code': 1.0 if '```' in last_user or re.search(r'[{};]\s*$', last_user, re.MULTILINE) else 0.0,
+        'questions': min(last_user.count('?'), 3),
+        'smalltalk_ratio': (sum(1 for w in words if w in SMALLTALK) / len(words)) if words else 1.0,
+    }
+
+
+def complexity_score(features: Dict[str, float]) -> float:
+    """Probability-like score in [0, 1] that the turn needs the main model."""
+    z = BIAS + sum(weight * features[name] for name, weight in WEIGHTS.items())
+    return 1 / (1 + math.exp(-z))
+
+
+def classify(features: Dict[str, float]) -> str:
+    score = complexity_score(features)
+    if score < settings.AI_ROUTING_SIMPLE_THRESHOLD:
+        return 'simple'
+    if score < settings.AI_ROUTING_COMPLEX_THRESHOLD:
+        return 'standard'
+    return 'complex'
+
+
+def route(messages: List[Dict[str, str]], provider: str, model: str) -> Dict[str, Any]:
+    """
+    Pick provider, model and max_tokens for a chat turn.
+
+    Returns:
+        Decision dict with 'tier', 'provider', 'model', 'max_tokens', 'score'
+        and the 'features' it was based on (recorded for offline evaluation)
+    """
+    features = extract_features(messages)
+    score = complexity_score(features)
+    tier = classify(features)
+
+    decision = {
+        'tier': tier,
+        'provider': provider,
+        'model': model,
+        'max_tokens': settings.AI_ROUTING_MAX_TOKENS[tier],
+        'score': round(score, 4),
+        'features': {name: round(value, 4) for name, value in features.items()},
+    }
+    if tier == 'simple' and settings.AI_FAST_MODEL:
+        decision['provider'] = settings.AI_FAST_PROVIDER or provider
+        decision['model'] = settings.AI_FAST_MODEL
+    return decision
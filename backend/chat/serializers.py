@@ -3,18 +3,27 @@ Serializers for chat models.
 """
 from rest_framework import serializers
 from .models import Conversation, Message
+from .profiling import section
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class ProfiledModelSerializer(serializers.ModelSerializer):
+    """ModelSerializer whose output is timed as the 'serializer' profiling section."""
+    
+    def to_representation(self, instance):
+        with section('serializer'):
+            return super().to_representation(instance)
+
+
+class MessageSerializer(ProfiledModelSerializer):
     """Serializer for Message model."""
     
     class Meta:
         model = Message
-        fields = ['id', 'conversation', 'content', 'sender', 'timestamp']
-        read_only_fields = ['id', 'timestamp']
+        fields = ['id', 'conversation', 'content', 'sender', 'status', 'timestamp']
+        read_only_fields = ['id', 'status', 'timestamp']
 
 
-class ConversationListSerializer(serializers.ModelSerializer):
+class ConversationListSerializer(ProfiledModelSerializer):
     """Serializer for listing conversations with basic metadata."""
     message_count = serializers.IntegerField(source='get_message_count', read_only=True)
     duration = serializers.FloatField(source='get_duration', read_only=True)
@@ -28,9 +37,9 @@ class ConversationListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'start_timestamp', 'end_timestamp']
 
 
-class ConversationDetailSerializer(serializers.ModelSerializer):
+class ConversationDetailSerializer(ProfiledModelSerializer):
     """Serializer for detailed conversation view including all messages."""
-    messages = MessageSerializer(many=True, read_only=True)
+    messages = MessageSerializer(source='get_messages', many=True, read_only=True)
     message_count = serializers.IntegerField(source='get_message_count', read_only=True)
     duration = serializers.FloatField(source='get_duration', read_only=True)
     
@@ -0,0 +1,200 @@
+"""
+Shared write paths for conversations and messages.
+
+Both the HTTP views and the WebSocket channel go through these helpers so
+that every write keeps the analytics rollups, the summary index, the
+typeahead index, duplicate signatures, cache validators and the prompt
+history cache in sync.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import analytics, caching, dedup, summary_index
+from .deadlines import partial_output
+from .history_cache import history_cache
+from .typeahead import typeahead_index
+from .models import Conversation, Message
+
+SYSTEM_PROMPT = "You are a helpful, friendly AI assistant. Provide clear and concise responses."
+# Beyond its generation's deadline, a reply still marked streaming is given up
+ABANDONED_STREAM_GRACE_SECONDS = 30
+
+
+def create_message(conversation: Conversation, sender: str, content: str) -> Message:
+    """
+    Create a message and record the write. The conversation instance's
+    version is advanced to match the bump made by the write.
+    """
+    message = Message.objects.create(
+        conversation=conversation,
+        content=content,
+        sender=sender
+    )
+    _record_message(conversation, message)
+    return message
+
+
+def _record_message(conversation: Conversation, message: Message):
+    analytics.record_message(message)
+    caching.touch_conversation(conversation.id)
+    conversation.version += 1
+    history_cache.append(conversation.id, conversation.version, prompt_message(message))
+
+
+# Streamed AI replies
+
+def start_ai_message(conversation: Conversation) -> Message:
+    """
+    Create the row an AI reply is written into while it streams. It is left
+    out of prompt histories and analytics until it is finished.
+    """
+    message = Message.objects.create(conversation=conversation, content='', sender='ai', status='streaming')
+    caching.touch_conversation(conversation.id)
+    conversation.version += 1
+    return message
+
+
+def save_stream_progress(message: Message, content: str):
+    """Persist the text streamed so far, for clients resuming the stream."""
+    Message.objects.filter(id=message.id, status='streaming').update(content=content)
+
+
+def finish_ai_message(conversation: Conversation, message: Message, content: str,
+                      status: str = 'complete') -> Message:
+    """Store the final text of a streamed reply and record it like any other message."""
+    message.content = content
+    message.status = status
+    message.save(update_fields=['content', 'status'])
+    _record_message(conversation, message)
+    return message
+
+
+def discard_ai_message(conversation: Conversation, message: Message):
+    """Drop the row of a streamed reply that is not kept (see PARTIAL_OUTPUT_POLICY)."""
+    message.delete()
+    caching.touch_conversation(conversation.id)
+    conversation.version += 1
+
+
+def stream_abandoned(message: Message) -> bool:
+    """A reply still marked streaming after its generation's deadline lost its worker."""
+    return timezone.now() - message.timestamp > timedelta(
+        seconds=settings.STREAM_DEADLINE_SECONDS + ABANDONED_STREAM_GRACE_SECONDS
+    )
+
+
+def settle_abandoned_stream(conversation: Conversation, message: Message) -> Optional[Message]:
+    """
+    Finish an abandoned reply under PARTIAL_OUTPUT_POLICY: keep its text as
+    'interrupted', or delete it. Only the first caller changes the row.
+    
+    Returns:
+        The settled message, or None if it was deleted
+    """
+    content = partial_output(message.content)
+    pending = Message.objects.filter(id=message.id, status='streaming')
+    if content is None:
+        if pending.delete()[0]:
+            caching.touch_conversation(conversation.id)
+            conversation.version += 1
+        return None
+    if pending.update(content=content, status='interrupted'):
+        message.content = content
+        message.status = 'interrupted'
+        _record_message(conversation, message)
+        return message
+    return Message.objects.filter(id=message.id).first()
+
+
+def stream_progress(message_id: int, offset: int) -> Tuple[Optional[Message], str, str]:
+    """
+    Poll a streamed AI reply for a resuming client.
+    
+    Returns:
+        The message (None if it was discarded), its text from `offset` on,
+        and its status: 'streaming' while more text may follow, otherwise
+        'complete', 'interrupted' or 'discarded'
+    """
+    message = Message.objects.filter(id=message_id, sender='ai').select_related('conversation').first()
+    if message is not None and message.status == 'streaming' and stream_abandoned(message):
+        message = settle_abandoned_stream(message.conversation, message)
+    if message is None:
+        return None, '', 'discarded'
+    return message, message.content[offset:], message.status
+
+
+def conversation_created(conversation: Conversation):
+    """Record that a conversation has just been created."""
+    analytics.record_conversation_started(conversation)
+    typeahead_index.conversation_created(conversation)
+    caching.bump_write_generation()
+
+
+def conversation_ended(conversation: Conversation):
+    """Record that a conversation has just been ended and saved."""
+    analytics.record_conversation_ended(conversation)
+    summary_index.record_conversation(conversation)
+    summary_index.schedule_refresh()
+    typeahead_index.conversation_ended(conversation)
+    dedup.index_conversation(conversation)
+    caching.touch_conversation(conversation.id)
+    history_cache.invalidate(conversation.id)
+
+
+def prompt_message(message: Message) -> Dict[str, str]:
+    """Convert a stored message to a chat-completion message dict."""
+    return {
+        "role": "user" if message.sender == "user" else "assistant",
+        "content": message.content
+    }
+
+
+def build_prompt_history(conversation: Conversation) -> List[Dict[str, str]]:
+    """
+    Build the full prompt (system message plus ordered history) for a
+    conversation. Replies still streaming are left out; abandoned ones are
+    settled first.
+    """
+    messages_for_ai = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for msg in conversation.get_messages():
+        if msg.status == 'streaming':
+            if not stream_abandoned(msg):
+                continue
+            msg = settle_abandoned_stream(conversation, msg)
+            if msg is None or msg.status == 'streaming':
+                continue
+        messages_for_ai.append(prompt_message(msg))
+    return messages_for_ai
+
+
+def get_prompt_history(conversation: Conversation) -> List[Dict[str, str]]:
+    """
+    Prompt history for a conversation, served from the history cache when it
+    is current for the conversation's version and rebuilt otherwise.
+    """
+    history = history_cache.get(conversation.id, conversation.version)
+    if history is None:
+        history = build_prompt_history(conversation)
+        history_cache.put(conversation.id, conversation.version, history)
+    return history
+
+
+def load_histories(conversations: List[Conversation]) -> Dict[int, List[Dict[str, str]]]:
+    """Message history of each conversation, with one query for all live ones."""
+    histories: Dict[int, List[Dict[str, str]]] = defaultdict(list)
+    live_ids = []
+    for conversation in conversations:
+        if conversation.archived:
+            histories[conversation.id] = [
+                {'sender': msg.sender, 'content': msg.content} for msg in conversation.get_messages()
+            ]
+        else:
+            live_ids.append(conversation.id)
+    rows = Message.objects.filter(conversation_id__in=live_ids).order_by('conversation_id', 'timestamp')
+    for conversation_id, sender, content in rows.values_list('conversation_id', 'sender', 'content'):
+        histories[conversation_id].append({'sender': sender, 'content': content})
+    return histories
@@ -0,0 +1,121 @@
+"""
+Shared, versioned AI provider settings.
+
+Settings changed through the API are persisted in the AISettings row and its
+version counter is bumped. Each worker keeps the overrides in memory and
+checks the version with one cheap query at most every
+AI_SETTINGS_CHECK_INTERVAL seconds. When the version changes, the overrides
+are reloaded and only the pooled clients of the providers whose settings
+changed are rebuilt.
+"""
+import threading
+import time
+from typing import Dict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import providers
+from .models import AISettings
+
+SETTINGS_ROW_ID = 1
+
+# Django setting name -> AISettings field
+FIELDS = {
+    'AI_PROVIDER': 'provider',
+    'AI_MODEL': 'model',
+    'OPENAI_API_KEY': 'openai_api_key',
+    'ANTHROPIC_API_KEY': 'anthropic_api_key',
+    'GOOGLE_API_KEY': 'google_api_key',
+    'LM_STUDIO_BASE_URL': 'lm_studio_base_url',
+    'LM_STUDIO_API_KEY': 'lm_studio_api_key',
+}
+
+# Settings each provider's client is built from
+PROVIDER_SETTINGS = {
+    'openai': ['OPENAI_API_KEY'],
+    'anthropic': ['ANTHROPIC_API_KEY'],
+    'google': ['GOOGLE_API_KEY', 'AI_MODEL'],
+    'lmstudio': ['LM_STUDIO_BASE_URL', 'LM_STUDIO_API_KEY'],
+}
+
+
+class AISettingsSnapshot:
+    """
+    Consistent view of the AI settings: stored overrides first, then the
+    Django settings loaded from the environment.
+    """
+
+    def __init__(self, overrides: Dict[str, str], version: int):
+        self._overrides = overrides
+        self.version = version
+
+    def __getattr__(self, name):
+        if name not in FIELDS:
+            raise AttributeError(name)
+        return self._overrides.get(name) or getattr(settings, name)
+
+
+class AISettingsStore:
+    """Per-process cache of the shared AI settings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the cached state; the next snapshot reloads it."""
+        self._version = None
+        self._overrides: Dict[str, str] = {}
+        self._checked_at = 0.0
+
+    def snapshot(self) -> AISettingsSnapshot:
+        """Current settings, refreshed if the shared version has changed."""
+        if time.monotonic() - self._checked_at >= settings.AI_SETTINGS_CHECK_INTERVAL:
+            self.refresh()
+        return AISettingsSnapshot(self._overrides, self._version or 0)
+
+    def refresh(self):
+        """Check the shared version and reload the overrides if it changed."""
+        version = AISettings.objects.filter(id=SETTINGS_ROW_ID).values_list('version', flat=True).first() or 0
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if version == self._version:
+                return
+            row = AISettings.objects.filter(id=SETTINGS_ROW_ID).first()
+            overrides = {
+                name: getattr(row, field)
+                for name, field in FIELDS.items()
+                if row is not None and getattr(row, field)
+            }
+            if self._version is not None:
+                self._rebuild_clients(self._overrides, overrides)
+            self._overrides = overrides
+            self._version = row.version if row is not None else 0
+
+    def update(self, **values) -> int:
+        """
+        Persist new overrides (keyed by Django setting name) and bump the
+        shared version.
+
+        Returns:
+            The new settings version
+        """
+        fields = {FIELDS[name]: value for name, value in values.items() if value is not None}
+        with transaction.atomic():
+            AISettings.objects.get_or_create(id=SETTINGS_ROW_ID)
+            AISettings.objects.filter(id=SETTINGS_ROW_ID).update(version=F('version') + 1, **fields)
+        self.refresh()
+        return self._version
+
+    @staticmethod
+    def _rebuild_clients(old: Dict[str, str], new: Dict[str, str]):
+        """Drop pooled clients of the providers whose settings changed."""
+        changed = {name for name in FIELDS if old.get(name) != new.get(name)}
+        for provider, names in PROVIDER_SETTINGS.items():
+            if changed.intersection(names):
+                providers.invalidate(provider)
+
+
+ai_settings = AISettingsStore()
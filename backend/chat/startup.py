@@ -0,0 +1,125 @@
+"""
+Cold-start helpers: a cheap migration-state check and import-time profiling.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+from django.apps import apps
+from django.db import DatabaseError, connection
+from django.db.migrations.recorder import MigrationRecorder
+
+MIGRATION_FILE_RE = re.compile(r'^\d{4}_\w+\.py$')
+
+
+def migration_files_on_disk() -> Set[Tuple[str, str]]:
+    """(app_label, migration_name) for every migration file of the installed apps, without importing them."""
+    found = set()
+    for app_config in apps.get_app_configs():
+        migrations_dir = Path(app_config.path) / 'migrations'
+        if not migrations_dir.is_dir():
+            continue
+        for path in migrations_dir.iterdir():
+            if MIGRATION_FILE_RE.match(path.name):
+                found.add((app_config.label, path.stem))
+    return found
+
+
+def migrations_pending() -> bool:
+    """
+    Whether any migration on disk is not recorded as applied.
+
+    Costs a directory listing per app and a single query on the
+    django_migrations table, instead of building the full migration graph.
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT app, name FROM {MigrationRecorder.Migration._meta.db_table}')
+            applied = set(cursor.fetchall())
+    except DatabaseError:
+        return True
+    return bool(migration_files_on_disk() - applied)
+
+
+# Script run in a fresh interpreter by `profile_startup`: boots Django, loads
+# the URLconf and serves one request, then reports timings as JSON.
+PROFILE_SCRIPT = '''
+import json, os, time
+t0 = time.time()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+import django
+django.setup()
+t_setup = time.time()
+from django.test import Client
+from django.urls import get_resolver
+get_resolver().url_patterns
+t_urls = time.time()
+response = Client(HTTP_HOST='localhost').get(os.environ['STARTUP_PROFILE_PATH'])
+t_request = time.time()
+print(json.dumps({
+    "script_start": t0, "setup_done": t_setup, "urls_loaded": t_urls,
+    "first_request_done": t_request, "status_code": response.status_code,
+}))
+'''
+
+
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    """
+    Aggregate `python -X importtime` output into self time (ms) per top-level package.
+    """
+    per_package: Dict[str, float] = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].strip())
+        except ValueError:
+            continue  # header line
+        package = parts[2].strip().split('.')[0]
+        per_package[package] += self_us / 1000
+    return dict(per_package)
+
+
+def profile_startup(path: str, base_dir: str) -> Dict:
+    """
+    Start a fresh interpreter that boots the project and serves one request.
+
+    Returns:
+        Dict with phase timings in ms (measured from process spawn), the
+        first response status and the import time per top-level package.
+    """
+    env = {**os.environ, 'STARTUP_PROFILE_PATH': path}
+    spawned = time.time()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT],
+        cwd=base_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else 'profiling failed')
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    def to_ms(timestamp):
+        return (timestamp - spawned) * 1000
+
+    return {
+        'interpreter_ms': to_ms(report['script_start']),
+        'django_setup_ms': to_ms(report['setup_done']),
+        'urls_loaded_ms': to_ms(report['urls_loaded']),
+        'first_request_ms': to_ms(report['first_request_done']),
+        'status_code': report['status_code'],
+        'imports': parse_importtime(result.stderr),
+    }
+
+
+def top_imports(imports: Dict[str, float], limit: int) -> List[Tuple[str, float]]:
+    return sorted(imports.items(), key=lambda item: item[1], reverse=True)[:limit]
@@ -0,0 +1,209 @@
+"""
+Map-reduce summarization of conversations too long for one prompt.
+
+A transcript that fits SUMMARY_CHUNK_TOKENS is summarized with a single call.
+A longer one is split into chunks of at most that many (estimated) tokens;
+the chunks are summarized in parallel on a pool of SUMMARY_MAP_WORKERS
+threads, and the partial summaries are then reduced into one, in several
+rounds if they do not fit one prompt together.
+
+Chunk boundaries depend only on the messages before them, so when messages
+are appended only the last chunk changes. Chunk summaries are cached in the
+SummaryChunk table by model and content hash, and re-summarizing a
+conversation only calls the provider for chunks it has not seen.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+
+from .models import SummaryChunk
+
+# Rough size of a token in English text; close enough to size prompts safely
+CHARS_PER_TOKEN = 4
+# Part of every cache key: bump it when the chunk prompt changes
+CHUNK_PROMPT_VERSION = 1
+ERROR_PREFIX = 'Error generating response'
+
+
+class SummaryError(Exception):
+    """A summary call failed; there is no summary to store."""
+
+
+def summary_prompt(conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Prompt messages asking for a summary of a conversation."""
+    conversation_text = "\n".join([
+        f"{msg['sender']}: {msg['content']}"
+        for msg in conversation_history
+    ])
+
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that summarizes conversations concisely."
+        },
+        {
+            "role": "user",
+            "content": f"Please provide a concise summary of the following conversation, "
+                      f"highlighting key topics, decisions, and action items:\n\n{conversation_text}"
+        }
+    ]
+
+
+def chunk_prompt(chunk: str) -> List[Dict[str, str]]:
+    """Prompt messages asking for a summary of one part of a long conversation."""
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that summarizes conversations concisely."
+        },
+        {
+            "role": "user",
+            "content": f"The following is one part of a longer conversation. Summarize this part, "
+                      f"keeping every topic, decision, and action item it mentions:\n\n{chunk}"
+        }
+    ]
+
+
+def reduce_prompt(summaries: List[str]) -> List[Dict[str, str]]:
+    """Prompt messages asking to combine summaries of consecutive parts into one."""
+    parts = "\n\n".join(f"Part {index}:\n{summary}" for index, summary in enumerate(summaries, start=1))
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that summarizes conversations concisely."
+        },
+        {
+            "role": "user",
+            "content": f"These are summaries of consecutive parts of one conversation. Combine them "
+                      f"into a single concise summary, highlighting key topics, decisions, and "
+                      f"action items:\n\n{parts}"
+        }
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def chunk_transcript(conversation_history: List[Dict[str, str]], max_tokens: int) -> List[str]:
+    """
+    Split a transcript into chunks of at most max_tokens estimated tokens.
+
+    Messages are packed in order and never reordered; a single message longer
+    than a chunk is split across several.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for msg in conversation_history:
+        line = f"{msg['sender']}: {msg['content']}"
+        pieces = [line[start:start + max_chars] for start in range(0, len(line), max_chars)] or ['']
+        for piece in pieces:
+            if current and size + len(piece) + 1 > max_chars:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def chunk_key(model: str, chunk: str) -> str:
+    return hashlib.sha256(f'{CHUNK_PROMPT_VERSION}\n{model}\n{chunk}'.encode()).hexdigest()
+
+
+def _call(ai_service, prompt: List[Dict[str, str]]) -> str:
+    """One summary call; AIService reports failures as text, turn them back into errors."""
+    text = ai_service.generate_response(prompt, purpose='summary')
+    if not text or text.startswith(ERROR_PREFIX):
+        raise SummaryError(text or 'Empty response')
+    return text
+
+
+def _call_all(ai_service, prompts: List[List[Dict[str, str]]]) -> List[object]:
+    """
+    Run the calls on the bounded pool.
+
+    Returns:
+        Per prompt, in order, the summary text or the exception it raised
+    """
+    workers = max(1, min(ai_service.map_workers or settings.SUMMARY_MAP_WORKERS, len(prompts)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_call, ai_service, prompt) for prompt in prompts]
+    results = []
+    for future in futures:
+        error = future.exception()
+        results.append(error if error is not None else future.result())
+    return results
+
+
+def _raise_first_error(results: List[object]):
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+def summarize_chunks(ai_service, chunks: List[str], conversation_id: Optional[int] = None) -> List[str]:
+    """
+    Summary of each chunk, from the cache or from the provider. New summaries
+    are cached even if other chunks fail, so a retry only redoes the failures.
+    """
+    keys = [chunk_key(ai_service.model, chunk) for chunk in chunks]
+    summaries = dict(SummaryChunk.objects.filter(key__in=keys).values_list('key', 'summary'))
+    missing = {key: chunk for key, chunk in zip(keys, chunks) if key not in summaries}
+    if missing:
+        results = dict(zip(missing, _call_all(ai_service, [chunk_prompt(chunk) for chunk in missing.values()])))
+        SummaryChunk.objects.bulk_create([
+            SummaryChunk(key=key, conversation_id=conversation_id, model=ai_service.model, summary=result)
+            for key, result in results.items() if not isinstance(result, Exception)
+        ], ignore_conflicts=True)
+        _raise_first_error(results.values())
+        summaries.update(results)
+    return [summaries[key] for key in keys]
+
+
+def reduce_summaries(ai_service, summaries: List[str], max_tokens: int,
+                     prompt: Callable[[List[str]], List[Dict[str, str]]] = reduce_prompt) -> str:
+    """
+    Combine partial summaries into one. Summaries that do not fit one prompt
+    are combined in groups first, in parallel, until they do.
+    """
+    while len(summaries) > 1 and sum(estimate_tokens(summary) for summary in summaries) > max_tokens:
+        groups: List[List[str]] = [[]]
+        size = 0
+        for summary in summaries:
+            # Every group takes at least two summaries so each round shrinks the list
+            if len(groups[-1]) >= 2 and size + estimate_tokens(summary) > max_tokens:
+                groups.append([])
+                size = 0
+            groups[-1].append(summary)
+            size += estimate_tokens(summary)
+        reduced = iter(_call_all(ai_service, [prompt(group) for group in groups if len(group) > 1]))
+        # A trailing single summary is carried into the next round as it is
+        summaries = [next(reduced) if len(group) > 1 else group[0] for group in groups]
+        _raise_first_error(summaries)
+    return _call(ai_service, prompt(summaries))
+
+
+def needs_map_reduce(conversation_history: List[Dict[str, str]]) -> bool:
+    """Whether a transcript is too long to summarize with a single call."""
+    return len(chunk_transcript(conversation_history, settings.SUMMARY_CHUNK_TOKENS)) > 1
+
+
+def summarize(ai_service, conversation_history: List[Dict[str, str]],
+              conversation_id: Optional[int] = None) -> str:
+    """
+    Summarize a conversation with as many calls as its length needs.
+
+    Raises:
+        SummaryError: If a provider call failed
+    """
+    max_tokens = settings.SUMMARY_CHUNK_TOKENS
+    chunks = chunk_transcript(conversation_history, max_tokens)
+    if len(chunks) <= 1:
+        return _call(ai_service, summary_prompt(conversation_history))
+    return reduce_summaries(ai_service, summarize_chunks(ai_service, chunks, conversation_id), max_tokens)
@@ -0,0 +1,440 @@
+"""
+Hierarchical summary index over ended conversations.
+
+Conversations roll up into day nodes, and day nodes into week (Monday to
+Sunday) and month nodes. When a conversation ends, the counts and topics of
+its three nodes are updated in place and the nodes are marked stale; their
+summary text is regenerated from the level below on a background thread
+once the transaction commits (or by `manage.py build_summary_index`). The
+background refresh runs at most once per SUMMARY_INDEX_REFRESH_INTERVAL,
+so every end in between shares one pass, and its provider calls go through
+a rate limiter.
+Questions never wait for provider calls: they read the stored summaries,
+which may lag behind, together with the counts and topics, which are always
+current.
+
+Questions about a time range ("what came up most last quarter?") are then
+answered from the fewest nodes covering the range, using whole months and
+weeks where possible, instead of from raw transcripts.
+"""
+import logging
+import re
+import threading
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from time import sleep
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from . import summarization
+from .ai_service import AIService
+from .analytics import normalize_topic
+from .models import Conversation, SummaryNode
+from .usage import record_usage
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ['day', 'week', 'month']
+# Topics listed per node in prompts
+TOP_TOPICS = 10
+# One background refresh at a time (per cache); ends during it are picked up by a second pass
+REFRESH_LOCK_KEY = 'chat:summary-index:refreshing'
+REFRESH_PENDING_KEY = 'chat:summary-index:refresh-pending'
+REFRESH_LAST_KEY = 'chat:summary-index:last-refresh'
+# Longest a pass may run, on top of the wait for the refresh interval
+REFRESH_LOCK_TIMEOUT = 3600
+
+_rate_limiter = None
+
+MONTH_NAMES = [
+    'january', 'february', 'march', 'april', 'may', 'june', 'july',
+    'august', 'september', 'october', 'november', 'december',
+]
+MONTH_PATTERN = '|'.join(MONTH_NAMES + [name[:3] for name in MONTH_NAMES if name != 'may'])
+
+
+def _month_number(name: str) -> int:
+    return next(index for index, month in enumerate(MONTH_NAMES, start=1) if month.startswith(name.lower()))
+
+
+def _add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def period_of(level: str, day: date) -> Tuple[date, date]:
+    """(start, exclusive end) of the day, week or month containing day."""
+    if level == 'day':
+        return day, day + timedelta(days=1)
+    if level == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    return start, _add_months(start, 1)
+
+
+def day_bounds(start: date, end: date) -> Tuple[datetime, datetime]:
+    """Aware datetimes of the local midnights starting the two dates."""
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(start, time.min), tz),
+        timezone.make_aware(datetime.combine(end, time.min), tz),
+    )
+
+
+def record_conversation(conversation: Conversation):
+    """Count a just-ended conversation in its day, week and month nodes and mark them stale."""
+    day = timezone.localdate(conversation.end_timestamp)
+    topics = {normalize_topic(t) for t in conversation.metadata.get('topics', [])} - {''}
+    with transaction.atomic():
+        for level in LEVELS:
+            start, end = period_of(level, day)
+            SummaryNode.objects.get_or_create(level=level, period_start=start, defaults={'period_end': end})
+            node = SummaryNode.objects.select_for_update().get(level=level, period_start=start)
+            counts = Counter(node.topics)
+            counts.update(topics)
+            node.topics = dict(counts)
+            node.conversation_count += 1
+            node.stale = True
+            node.version += 1
+            node.save(update_fields=['topics', 'conversation_count', 'stale', 'version', 'updated_at'])
+
+
+def mark_stale(conversation: Conversation):
+    """Mark the nodes of a conversation whose summary or topics changed for a full refresh."""
+    if conversation.end_timestamp is None:
+        return
+    day = timezone.localdate(conversation.end_timestamp)
+    for level in LEVELS:
+        SummaryNode.objects.filter(level=level, period_start=period_of(level, day)[0]).update(
+            stale=True, version=F('version') + 1
+        )
+
+
+def period_label(node: SummaryNode) -> str:
+    if node.level == 'day':
+        return node.period_start.strftime('%A %Y-%m-%d')
+    if node.level == 'week':
+        return f"Week of {node.period_start.isoformat()}"
+    return node.period_start.strftime('%B %Y')
+
+
+def period_prompt(summaries: List[str]) -> List[Dict[str, str]]:
+    """Prompt messages asking to merge summaries of conversations or shorter periods."""
+    parts = "\n\n".join(summaries)
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that summarizes conversations concisely."
+        },
+        {
+            "role": "user",
+            "content": f"These are summaries of conversations from one period of time. Write a concise "
+                      f"overview of the period: the main topics, recurring themes, decisions, and "
+                      f"open questions:\n\n{parts}"
+        }
+    ]
+
+
+def _children(node: SummaryNode) -> Tuple[int, Counter, List[str]]:
+    """Conversation count, topic counts and labelled summaries of the level below a node."""
+    if node.level == 'day':
+        start, end = day_bounds(node.period_start, node.period_end)
+        conversations = Conversation.objects.filter(
+            status='ended', end_timestamp__gte=start, end_timestamp__lt=end
+        ).order_by('end_timestamp').only('title', 'ai_summary', 'metadata')
+        topics: Counter = Counter()
+        summaries = []
+        count = 0
+        for conversation in conversations:
+            count += 1
+            topics.update({normalize_topic(t) for t in conversation.metadata.get('topics', [])} - {''})
+            if conversation.ai_summary:
+                summaries.append(f"{conversation.title or 'Untitled'}: {conversation.ai_summary}")
+        return count, topics, summaries
+
+    days = SummaryNode.objects.filter(
+        level='day', period_start__gte=node.period_start, period_start__lt=node.period_end
+    ).order_by('period_start')
+    topics = Counter()
+    summaries = []
+    count = 0
+    for day in days:
+        count += day.conversation_count
+        topics.update(day.topics)
+        if day.summary:
+            summaries.append(f"{period_label(day)}: {day.summary}")
+    return count, topics, summaries
+
+
+def refresh_node(node: SummaryNode, ai_service) -> SummaryNode:
+    """
+    Recompute a stale node from the level below, refreshing stale day nodes
+    first. If a newer conversation changed the node meanwhile, it stays stale.
+
+    Raises:
+        SummaryError: If a provider call failed
+    """
+    if node.level != 'day':
+        stale_days = SummaryNode.objects.filter(
+            level='day', stale=True, period_start__gte=node.period_start, period_start__lt=node.period_end
+        )
+        for day in stale_days:
+            refresh_node(day, ai_service)
+
+    version = node.version
+    count, topics, summaries = _children(node)
+    summary = summarization.reduce_summaries(
+        ai_service, summaries, settings.SUMMARY_CHUNK_TOKENS, prompt=period_prompt
+    ) if summaries else ''
+    SummaryNode.objects.filter(id=node.id, version=version).update(
+        conversation_count=count,
+        topics=dict(topics),
+        summary=summary,
+        stale=False,
+        updated_at=timezone.now()
+    )
+    node.refresh_from_db()
+    return node
+
+
+def _weeks_and_days(start: date, end: date) -> List[Tuple[str, date]]:
+    periods = []
+    day = start
+    while day < end:
+        if day.weekday() == 0 and day + timedelta(days=7) <= end:
+            periods.append(('week', day))
+            day += timedelta(days=7)
+        else:
+            periods.append(('day', day))
+            day += timedelta(days=1)
+    return periods
+
+
+def cover(start: date, end: date) -> List[Tuple[str, date]]:
+    """
+    Few (level, period start) pairs exactly covering [start, end): the whole
+    months inside it, and weeks and days for the parts before and after.
+    """
+    first_month = start if start.day == 1 else _add_months(start, 1)
+    last_month = end.replace(day=1)
+    if first_month >= last_month:
+        return _weeks_and_days(start, end)
+    months = []
+    month = first_month
+    while month < last_month:
+        months.append(('month', month))
+        month = _add_months(month, 1)
+    return _weeks_and_days(start, first_month) + months + _weeks_and_days(last_month, end)
+
+
+def first_day() -> Optional[date]:
+    """Day of the earliest indexed conversation, if any."""
+    return SummaryNode.objects.filter(level='day').aggregate(first=Min('period_start'))['first']
+
+
+def nodes_for_range(start: date, end: date) -> List[SummaryNode]:
+    """
+    Nodes covering [start, end) that have conversations, in time order, as
+    stored: a stale node has current counts and topics but an older summary.
+    """
+    periods = cover(start, end)
+    by_period = {
+        (node.level, node.period_start): node
+        for node in SummaryNode.objects.filter(
+            period_start__gte=start, period_start__lt=end, level__in={level for level, _ in periods}
+        )
+    }
+    nodes = [by_period[period] for period in periods if period in by_period]
+    return [node for node in nodes if node.conversation_count]
+
+
+def node_data(node: SummaryNode) -> Dict:
+    top = Counter(node.topics).most_common(TOP_TOPICS)
+    return {
+        'level': node.level,
+        'period': period_label(node),
+        'period_start': node.period_start.isoformat(),
+        'period_end': node.period_end.isoformat(),
+        'conversation_count': node.conversation_count,
+        'top_topics': [{'topic': topic, 'count': count} for topic, count in top],
+        'summary': node.summary,
+    }
+
+
+def topic_totals(nodes: List[SummaryNode]) -> List[Tuple[str, int]]:
+    """Topics of the nodes by number of conversations, most frequent first."""
+    totals: Counter = Counter()
+    for node in nodes:
+        totals.update(node.topics)
+    return totals.most_common()
+
+
+def parse_time_range(text: str, today: Optional[date] = None) -> Optional[Tuple[date, date]]:
+    """
+    The (start, exclusive end) dates a question refers to, or None. Understands
+    today/yesterday, this/last week/month/quarter/year, past/last N days/weeks/
+    months, Q1-Q4 with an optional year, and month names with "in" or a year.
+    """
+    today = today or timezone.localdate()
+    text = text.lower()
+    tomorrow = today + timedelta(days=1)
+
+    if re.search(r'\btoday\b', text):
+        return today, tomorrow
+    if re.search(r'\byesterday\b', text):
+        return today - timedelta(days=1), today
+
+    match = re.search(r'\b(?:last|past|previous)\s+(\d+)\s+(day|week|month)s?\b', text)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        if unit == 'month':
+            month_start = _add_months(today.replace(day=1), -amount)
+            last_day = (_add_months(month_start, 1) - timedelta(days=1)).day
+            return month_start.replace(day=min(today.day, last_day)) + timedelta(days=1), tomorrow
+        return today - timedelta(days=amount * (7 if unit == 'week' else 1)) + timedelta(days=1), tomorrow
+
+    match = re.search(r'\b(this|current|last|previous|past)\s+(week|month|quarter|year)\b', text)
+    if match:
+        which, unit = match.groups()
+        if which == 'past':
+            days = {'week': 7, 'month': 30, 'quarter': 91, 'year': 365}[unit]
+            return today - timedelta(days=days - 1), tomorrow
+        if unit == 'week':
+            start = today - timedelta(days=today.weekday())
+            span = (start, start + timedelta(days=7))
+        elif unit == 'month':
+            span = period_of('month', today)
+        elif unit == 'quarter':
+            start = date(today.year, (today.month - 1) // 3 * 3 + 1, 1)
+            span = (start, _add_months(start, 3))
+        else:
+            span = (date(today.year, 1, 1), date(today.year + 1, 1, 1))
+        if which in ('this', 'current'):
+            return span[0], min(span[1], tomorrow)
+        length = {'week': None, 'month': 1, 'quarter': 3, 'year': 12}[unit]
+        if length is None:
+            return span[0] - timedelta(days=7), span[0]
+        return _add_months(span[0], -length), span[0]
+
+    match = re.search(r'\bq([1-4])(?:\s+(\d{4}))?\b', text)
+    if match:
+        year = int(match.group(2) or today.year)
+        start = date(year, (int(match.group(1)) - 1) * 3 + 1, 1)
+        if not match.group(2) and start > today:
+            start = start.replace(year=year - 1)
+        return start, _add_months(start, 3)
+
+    match = (
+        re.search(rf'\b(?:in|during|since|for)\s+({MONTH_PATTERN})\b(?:\s+(\d{{4}}))?', text)
+        or re.search(rf'\b({MONTH_PATTERN})\s+(\d{{4}})\b', text)
+    )
+    if match:
+        year = int(match.group(2) or today.year)
+        start = date(year, _month_number(match.group(1)), 1)
+        if not match.group(2) and start > today:
+            start = start.replace(year=year - 1)
+        return start, _add_months(start, 1)
+
+    match = re.search(r'\b(?:in|during)\s+(\d{4})\b', text)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    return None
+
+
+def rebuild(ai_service=None) -> Dict[str, int]:
+    """
+    Recreate the index from all ended conversations. With an AIService,
+    every node's summary text is generated too (days first).
+
+    Returns:
+        Dict with the number of nodes written and the number summarized
+    """
+    with transaction.atomic():
+        SummaryNode.objects.all().delete()
+        for conversation in Conversation.objects.filter(
+            status='ended', end_timestamp__isnull=False
+        ).only('end_timestamp', 'metadata').iterator():
+            record_conversation(conversation)
+    summarized = 0
+    if ai_service is not None:
+        summarized = refresh_stale(ai_service)
+    return {'nodes': SummaryNode.objects.count(), 'summarized': summarized}
+
+
+def refresh_stale(ai_service) -> int:
+    """Refresh every stale node, days first. Returns the number refreshed."""
+    refreshed = 0
+    for level in LEVELS:
+        for node in SummaryNode.objects.filter(level=level, stale=True).order_by('period_start'):
+            node.refresh_from_db()
+            if node.stale:
+                refresh_node(node, ai_service)
+                refreshed += 1
+    return refreshed
+
+
+def schedule_refresh():
+    """Refresh stale summaries on a background thread after the current transaction commits."""
+    if settings.SUMMARY_INDEX_BACKGROUND_REFRESH:
+        transaction.on_commit(_start_refresh)
+
+
+def _lock_timeout() -> float:
+    return REFRESH_LOCK_TIMEOUT + settings.SUMMARY_INDEX_REFRESH_INTERVAL
+
+
+def _start_refresh():
+    cache.set(REFRESH_PENDING_KEY, True, _lock_timeout())
+    if cache.add(REFRESH_LOCK_KEY, True, _lock_timeout()):
+        threading.Thread(target=_refresh_in_background, name='summary-index-refresh', daemon=True).start()
+
+
+def refresh_rate_limiter():
+    """Token bucket shared by every background refresh of this process."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        # chat.backfill imports this module
+        from .backfill import RateLimiter
+        _rate_limiter = RateLimiter(settings.SUMMARY_INDEX_REFRESH_RATE)
+    return _rate_limiter
+
+
+def _wait_for_interval():
+    """Sleep until SUMMARY_INDEX_REFRESH_INTERVAL has passed since the previous pass started."""
+    last = cache.get(REFRESH_LAST_KEY)
+    if last is not None:
+        wait = last + settings.SUMMARY_INDEX_REFRESH_INTERVAL - timezone.now().timestamp()
+        if wait > 0:
+            sleep(wait)
+    cache.set(REFRESH_LAST_KEY, timezone.now().timestamp(), None)
+
+
+def _refresh_in_background():
+    try:
+        while True:
+            while cache.get(REFRESH_PENDING_KEY):
+                # Ends recorded while waiting are covered by the same pass
+                _wait_for_interval()
+                cache.delete(REFRESH_PENDING_KEY)
+                ai_service = AIService()
+                ai_service.rate_limiter = refresh_rate_limiter()
+                try:
+                    refresh_stale(ai_service)
+                finally:
+                    record_usage(ai_service)
+            cache.delete(REFRESH_LOCK_KEY)
+            # An end recorded between the last check and the unlock found the lock taken
+            if not cache.get(REFRESH_PENDING_KEY) or not cache.add(REFRESH_LOCK_KEY, True, _lock_timeout()):
+                return
+    except Exception:
+        cache.delete(REFRESH_LOCK_KEY)
+        logger.exception('Summary index refresh failed; stale nodes are left for build_summary_index')
+    finally:
+        connection.close()
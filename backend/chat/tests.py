@@ -1,13 +1,59 @@
 """
 Tests for chat application.
 """
-from django.test import TestCase
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.http import HttpResponse
+from django.core.cache import cache
 from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from unittest.mock import patch, MagicMock
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
 from django.conf import settings
-from .models import Conversation, Message
+from .models import (
+    AIUsage, ArchiveTerm, Conversation, ConversationArchive, ConversationSignature, IdempotencyRecord, Message,
+    DailyStats, MinHashBand, RequestProfile, SummaryChunk, SummaryNode, TopicCorpus, TopicCount, TopicTerm,
+    WriteGeneration
+)
+from . import analytics, caching, services
+from .history_cache import HistoryCache, history_cache
+from . import providers
+from .startup import migrations_pending, parse_importtime
+from .settings_store import ai_settings
+from .ai_service import AIService
+from . import dedup, routing, summarization, summary_index, topics, usage
+import sys
+import io
+import re
+from collections import Counter
+import pstats
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from django.core.management import call_command
+from .backfill import BatchBackend, RateLimiter, ThreadPoolBackend, select_conversations
+from .idempotency import claim
+from .admin import ConversationAdmin, EstimatedCountPaginator, indexed_dates
+from .deadlines import CLIENT_CLOSED_REQUEST, Deadline, DeadlineExceeded
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from .db_router import PIN_COOKIE, ReplicaPinningMiddleware, ReplicaRouter, use_primary as db_use_primary
+from .fast_serializers import (
+    conversation_list_rows,
+    serialize_conversation_detail,
+    serialize_conversation_list
+)
+from .serializers import ConversationDetailSerializer, ConversationListSerializer
+from .archive import archive_conversation, archivable_conversations, expire_archives, search_archives
+from .typeahead import typeahead_index
 
 
 class ConversationModelTest(TestCase):
@@ -229,3 +275,1954 @@ class AIProviderSettingsTest(APITestCase):
             self.assertEqual(providers[0]['name'], 'LM Studio (Local)')
             self.assertEqual(providers[0]['model'], 'local-model')
             self.assertEqual(response.data['current_provider'], 'lmstudio')
+
+
+class ConversationArchiveTest(APITestCase):
+    """Test cases for compressed cold storage of ended conversations."""
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(
+            title="Old Conversation",
+            status="ended",
+            end_timestamp=timezone.now() - timezone.timedelta(days=60)
+        )
+        Message.objects.create(conversation=self.conversation, content="Tell me about pandas", sender="user")
+        Message.objects.create(conversation=self.conversation, content="Pandas is a dataframe library", sender="ai")
+    
+    def test_archive_removes_message_rows(self):
+        """Test that archiving compacts messages into one blob."""
+        archive = archive_conversation(self.conversation, codec='zlib')
+        self.assertEqual(archive.message_count, 2)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 0)
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.archived)
+    
+    def test_detail_view_reads_archived_messages(self):
+        """Test that archived messages are served transparently."""
+        before = self.client.get(f'/api/conversations/{self.conversation.id}/').data
+        archive_conversation(self.conversation, codec='lzma')
+        after = self.client.get(f'/api/conversations/{self.conversation.id}/').data
+        self.assertEqual(before['messages'], after['messages'])
+        self.assertEqual(after['message_count'], 2)
+    
+    def test_search_finds_archived_content(self):
+        """Test keyword search finds archives through their stored terms."""
+        archive_conversation(self.conversation)
+        self.assertIn('dataframe', set(ArchiveTerm.objects.values_list('term', flat=True)))
+        response = self.client.get('/api/conversations/search/?q=dataframe')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c['id'] for c in response.data['results']], [self.conversation.id])
+        self.assertEqual(search_archives('a DataFrame lib'), [self.conversation.id])
+        self.assertEqual(search_archives('dataframe tools'), [])
+    
+    def test_search_decompresses_only_candidate_archives(self):
+        """Test that archives without the query's words are never decompressed."""
+        archive_conversation(self.conversation)
+        with patch.object(ConversationArchive, 'contains') as contains:
+            self.assertEqual(search_archives('spreadsheet'), [])
+        contains.assert_not_called()
+    
+    def test_archivable_and_retention(self):
+        """Test age selection and the retention policy."""
+        self.assertEqual(list(archivable_conversations(30)), [self.conversation])
+        self.assertEqual(list(archivable_conversations(90)), [])
+        archive_conversation(self.conversation)
+        self.assertEqual(expire_archives(90), 0)
+        self.assertEqual(expire_archives(30), 1)
+        self.assertFalse(Conversation.objects.filter(id=self.conversation.id).exists())
+
+
+class AnalyticsRollupTest(APITestCase):
+    """Test cases for incrementally maintained analytics rollups."""
+    
+    @patch('chat.views.AIService')
+    def test_rollups_updated_on_send_and_end(self, mock_ai_service):
+        """Test that sending messages and ending a conversation update rollups."""
+        mock_instance = MagicMock()
+        mock_instance.generate_response.return_value = "Sure."
+        mock_instance.generate_summary.return_value = "A summary."
+        mock_instance.model = "test-model"
+        mock_instance.extract_key_topics.return_value = ["Python", " python ", "Django"]
+        mock_ai_service.return_value = mock_instance
+        
+        conversation = Conversation.objects.create(title="Test", status="active")
+        self.client.post('/api/messages/send/', {
+            'conversation_id': conversation.id,
+            'content': 'Hello'
+        }, format='json')
+        self.client.post(f'/api/conversations/{conversation.id}/end/')
+        
+        stats = DailyStats.objects.get(date=timezone.localdate())
+        self.assertEqual(stats.user_messages, 1)
+        self.assertEqual(stats.ai_messages, 1)
+        self.assertEqual(stats.conversations_ended, 1)
+        self.assertEqual(
+            dict(TopicCount.objects.values_list('topic', 'count')),
+            {'python': 1, 'django': 1}
+        )
+        
+        response = self.client.get('/api/analytics/summary/')
+        self.assertEqual(response.data['messages_by_sender'], {'user': 1, 'ai': 1})
+        response = self.client.get('/api/analytics/topics/')
+        self.assertEqual(len(response.data['topics']), 2)
+    
+    def test_rebuild_matches_incremental(self):
+        """Test that the rebuild recomputes the same totals."""
+        conversation = Conversation.objects.create(title="Test", status="active")
+        analytics.record_conversation_started(conversation)
+        for sender in ['user', 'ai', 'user']:
+            analytics.record_message(
+                Message.objects.create(conversation=conversation, content="x", sender=sender)
+            )
+        incremental = list(DailyStats.objects.values())
+        
+        analytics.rebuild()
+        rebuilt = list(DailyStats.objects.values())
+        for row in incremental + rebuilt:
+            row.pop('id')
+        self.assertEqual(incremental, rebuilt)
+
+
+class ConditionalGetTest(APITestCase):
+    """Test cases for ETag / Last-Modified handling on conversation endpoints."""
+    
+    def setUp(self):
+        cache.clear()
+        self.conversation = Conversation.objects.create(title="Test", status="active")
+    
+    def test_detail_not_modified(self):
+        """Test that an unchanged conversation returns 304."""
+        response = self.client.get(f'/api/conversations/{self.conversation.id}/')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        
+        response = self.client.get(f'/api/conversations/{self.conversation.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    @patch('chat.views.AIService')
+    def test_message_write_invalidates(self, mock_ai_service):
+        """Test that sending a message changes validators and cached payloads."""
+        mock_instance = MagicMock()
+        mock_instance.generate_response.return_value = "Hi!"
+        mock_ai_service.return_value = mock_instance
+        
+        detail_url = f'/api/conversations/{self.conversation.id}/'
+        detail_etag = self.client.get(detail_url)['ETag']
+        list_etag = self.client.get('/api/conversations/')['ETag']
+        
+        self.client.post('/api/messages/send/', {
+            'conversation_id': self.conversation.id,
+            'content': 'Hello'
+        }, format='json')
+        
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['messages']), 2)
+        response = self.client.get('/api/conversations/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['message_count'], 2)
+    
+    def test_not_modified_skips_serialization(self):
+        """Test that a list 304 and a cached list only read the write generation."""
+        response = self.client.get('/api/conversations/')
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/conversations/', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(self.client.get('/api/conversations/').status_code, status.HTTP_200_OK)
+    
+    def test_write_in_another_worker_invalidates_list(self):
+        """Test that the list validator follows the generation in the database, not this worker's cache."""
+        etag = self.client.get('/api/conversations/')['ETag']
+        Conversation.objects.create(title="Created elsewhere")
+        # Another worker's write: advances the database row, this worker's cache is untouched
+        WriteGeneration.objects.update(value=F('value') + 1)
+        
+        response = self.client.get('/api/conversations/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+    
+    def test_list_cache_keyed_by_all_query_params(self):
+        """Test that responses for other query parameters are cached and validated separately."""
+        first = self.client.get('/api/conversations/', {'page': 1, 'page_size': 1})
+        default = self.client.get('/api/conversations/', {'page': 1})
+        self.assertNotEqual(first['ETag'], default['ETag'])
+        self.assertEqual(
+            self.client.get('/api/conversations/', {'page_size': 1, 'page': 1})['ETag'], first['ETag']
+        )
+
+
+class FastSerializationTest(TestCase):
+    """Test that the fast serialization path matches the DRF serializers."""
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(
+            title="Test", status="ended", end_timestamp=timezone.now(), metadata={'topics': ['a']}
+        )
+        for i in range(5):
+            Message.objects.create(conversation=self.conversation, content=f"Message {i}", sender="user")
+    
+    def test_detail_matches_serializer(self):
+        """Test detail payload equality."""
+        self.assertEqual(
+            serialize_conversation_detail(self.conversation),
+            dict(ConversationDetailSerializer(self.conversation).data)
+        )
+    
+    def test_archived_detail_matches_serializer(self):
+        """Test detail payload equality for archived conversations."""
+        expected = dict(ConversationDetailSerializer(self.conversation).data)
+        archive_conversation(self.conversation)
+        self.conversation.refresh_from_db()
+        self.assertEqual(serialize_conversation_detail(self.conversation), expected)
+    
+    def test_list_matches_serializer(self):
+        """Test list payload equality."""
+        Conversation.objects.create(title="Empty")
+        fast = serialize_conversation_list(conversation_list_rows(Conversation.objects.all()))
+        drf = ConversationListSerializer(Conversation.objects.all(), many=True).data
+        for item in fast + list(drf):
+            item.pop('duration')
+        self.assertEqual(fast, [dict(item) for item in drf])
+
+
+class ChatWebSocketTest(TestCase):
+    """Test cases for the WebSocket chat channel."""
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="Test", status="active")
+    
+    def _run(self, frames, mock_ai_service, expected):
+        """Send frames over a socket and collect `expected` server frames."""
+        from .websocket import chat_websocket
+        
+        async def scenario():
+            communicator = ApplicationCommunicator(chat_websocket, {'type': 'websocket', 'path': '/ws/chat/'})
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(1))['type'], 'websocket.accept')
+            received = []
+            for frame in frames:
+                await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(frame)})
+            while len(received) < expected:
+                received.append(json.loads((await communicator.receive_output(2))['text']))
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+            return received
+        
+        with patch('chat.websocket.AIService', mock_ai_service):
+            return async_to_sync(scenario)()
+    
+    def test_streams_tokens_and_persists_messages(self):
+        """Test a full streamed turn over the socket."""
+        mock_ai_service = MagicMock()
+        mock_ai_service.return_value.stream_response.return_value = iter(["Hel", "lo!"])
+        
+        received = self._run([
+            {'type': 'open', 'conversation_id': self.conversation.id},
+            {'type': 'message', 'conversation_id': self.conversation.id, 'content': 'Hi'},
+        ], mock_ai_service, expected=6)
+        
+        self.assertEqual(
+            [frame['type'] for frame in received],
+            ['opened', 'user_message', 'ai_message_started', 'token', 'token', 'ai_message']
+        )
+        self.assertEqual([(f['offset'], f['delta']) for f in received[3:5]], [(0, 'Hel'), (3, 'lo!')])
+        self.assertEqual(received[-1]['message']['content'], 'Hello!')
+        self.assertEqual(received[-1]['message']['id'], received[2]['message']['id'])
+        self.assertEqual(
+            list(Message.objects.filter(conversation=self.conversation).values_list('sender', 'content', 'status')),
+            [('user', 'Hi', 'complete'), ('ai', 'Hello!', 'complete')]
+        )
+        prompt = mock_ai_service.return_value.stream_response.call_args[0][0]
+        self.assertEqual(prompt[-1], {'role': 'user', 'content': 'Hi'})
+    
+    def test_ended_conversation_rejected(self):
+        """Test that ended conversations cannot be opened."""
+        self.conversation.status = 'ended'
+        self.conversation.save()
+        received = self._run(
+            [{'type': 'open', 'conversation_id': self.conversation.id}], MagicMock(), expected=1
+        )
+        self.assertEqual(received[0]['type'], 'error')
+    
+    def test_turn_sees_changes_made_over_http(self):
+        """Test that each turn reloads a history changed elsewhere and refuses an ended conversation."""
+        from .websocket import chat_websocket
+        mock_ai_service = MagicMock()
+        mock_ai_service.return_value.stream_response.side_effect = lambda *args, **kwargs: iter(["Ok"])
+        conversation = Conversation.objects.get(id=self.conversation.id)
+        
+        async def send(communicator, frame):
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(frame)})
+        
+        async def frames(communicator, count):
+            return [json.loads((await communicator.receive_output(2))['text']) for _ in range(count)]
+        
+        async def scenario():
+            communicator = ApplicationCommunicator(chat_websocket, {'type': 'websocket', 'path': '/ws/chat/'})
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(1)
+            await send(communicator, {'type': 'open', 'conversation_id': self.conversation.id})
+            await frames(communicator, 1)
+            await sync_to_async(services.create_message)(conversation, 'user', 'Sent over HTTP')
+            await send(communicator, {'type': 'message', 'conversation_id': self.conversation.id, 'content': 'Hi'})
+            await frames(communicator, 4)
+            await sync_to_async(Conversation.objects.filter(id=self.conversation.id).update)(status='ended')
+            await send(communicator, {'type': 'message', 'conversation_id': self.conversation.id, 'content': 'Again'})
+            received = await frames(communicator, 1)
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+            return received
+        
+        with patch('chat.websocket.AIService', mock_ai_service):
+            received = async_to_sync(scenario)()
+        
+        prompt = mock_ai_service.return_value.stream_response.call_args[0][0]
+        self.assertEqual([m['content'] for m in prompt[1:]], ['Sent over HTTP', 'Hi'])
+        self.assertEqual(received[0]['type'], 'error')
+        self.assertIn('ended', received[0]['error'])
+        self.assertFalse(Message.objects.filter(content='Again').exists())
+    
+    def test_prompt_preparation_error_sent_as_frame(self):
+        """Test that a failure before streaming starts reaches the client."""
+        with patch('chat.websocket.usage.apply_budget', side_effect=RuntimeError("budget lookup failed")):
+            received = self._run([
+                {'type': 'open', 'conversation_id': self.conversation.id},
+                {'type': 'message', 'conversation_id': self.conversation.id, 'content': 'Hi'},
+            ], MagicMock(), expected=3)
+        self.assertEqual([frame['type'] for frame in received], ['opened', 'user_message', 'error'])
+        self.assertIn('budget lookup failed', received[-1]['error'])
+
+    def test_cancel_while_reply_row_is_created_discards_it(self):
+        """Test that a cancel landing during the AI row's creation does not leave it streaming."""
+        from .websocket import chat_websocket
+        entered, release = threading.Event(), threading.Event()
+        created = []
+        real_start = services.start_ai_message
+
+        def slow_start(conversation):
+            entered.set()
+            release.wait(2)
+            created.append(real_start(conversation))
+            return created[-1]
+
+        async def scenario():
+            communicator = ApplicationCommunicator(chat_websocket, {'type': 'websocket', 'path': '/ws/chat/'})
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(1)
+            for frame in [{'type': 'open', 'conversation_id': self.conversation.id},
+                          {'type': 'message', 'conversation_id': self.conversation.id, 'content': 'Hi'}]:
+                await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(frame)})
+            for _ in range(2):
+                await communicator.receive_output(2)
+            await asyncio.get_running_loop().run_in_executor(None, entered.wait, 2)
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(
+                {'type': 'cancel', 'conversation_id': self.conversation.id}
+            )})
+            self.assertEqual(json.loads((await communicator.receive_output(2))['text'])['type'], 'cancelled')
+            release.set()
+            for _ in range(100):
+                if created and not await sync_to_async(Message.objects.filter(id=created[0].id).exists)():
+                    break
+                await asyncio.sleep(0.02)
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+
+        with patch('chat.websocket.AIService', MagicMock()), \
+                patch('chat.websocket.services.start_ai_message', side_effect=slow_start):
+            async_to_sync(scenario)()
+        self.assertEqual(len(created), 1)
+        self.assertFalse(Message.objects.filter(conversation=self.conversation, sender='ai').exists())
+
+
+class HistoryCacheTest(APITestCase):
+    """Test cases for the write-through prompt history cache."""
+    
+    def setUp(self):
+        history_cache.clear()
+        self.conversation = Conversation.objects.create(title="Test", status="active")
+    
+    def test_lru_eviction(self):
+        """Test that the least recently used conversation is evicted."""
+        lru = HistoryCache(max_conversations=2, shared=False)
+        lru.put(1, 0, [])
+        lru.put(2, 0, [])
+        lru.get(1, 0)
+        lru.put(3, 0, [])
+        self.assertIsNone(lru.get(2, 0))
+        self.assertEqual(lru.get(1, 0), [])
+    
+    def test_write_through_append(self):
+        """Test that message writes append to the cached history."""
+        services.create_message(self.conversation, 'user', 'Hello')
+        history = services.get_prompt_history(self.conversation)
+        services.create_message(self.conversation, 'ai', 'Hi!')
+        
+        with self.assertNumQueries(0):
+            cached = services.get_prompt_history(self.conversation)
+        self.assertEqual(cached, history + [{'role': 'assistant', 'content': 'Hi!'}])
+        self.assertEqual(cached, services.build_prompt_history(self.conversation))
+    
+    def test_foreign_write_causes_rebuild(self):
+        """Test that a write not seen by the cache invalidates the entry."""
+        services.get_prompt_history(self.conversation)
+        Message.objects.create(conversation=self.conversation, content="Elsewhere", sender="user")
+        caching.touch_conversation(self.conversation.id)
+        self.conversation.refresh_from_db()
+        
+        self.assertEqual(services.get_prompt_history(self.conversation)[-1]['content'], 'Elsewhere')
+    
+    @patch('chat.views.AIService')
+    def test_end_invalidates(self, mock_ai_service):
+        """Test that ending a conversation drops its cached history."""
+        mock_instance = MagicMock()
+        mock_instance.generate_summary.return_value = "Summary"
+        mock_instance.model = "test-model"
+        mock_instance.extract_key_topics.return_value = []
+        mock_ai_service.return_value = mock_instance
+        
+        services.get_prompt_history(self.conversation)
+        self.client.post(f'/api/conversations/{self.conversation.id}/end/')
+        self.assertIsNone(history_cache.get(self.conversation.id, self.conversation.version))
+
+
+class StartupTest(TestCase):
+    """Test cases for cold-start helpers and the shared provider client pool."""
+    
+    def test_migrations_pending_single_query(self):
+        """Test that the migration check is one query on an up-to-date database."""
+        with self.assertNumQueries(1):
+            self.assertFalse(migrations_pending())
+    
+    def test_parse_importtime(self):
+        """Test aggregation of -X importtime output per top-level package."""
+        stderr = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:      1500 |       1500 |   django.utils\n"
+            "import time:       500 |       2000 | django\n"
+            "import time:       250 |        250 | chat.models\n"
+        )
+        self.assertEqual(parse_importtime(stderr), {'django': 2.0, 'chat': 0.25})
+    
+    def test_provider_clients_pooled_and_lazy(self):
+        """Test that SDKs are imported on first use and clients are shared."""
+        fake_openai = MagicMock()
+        providers.invalidate()
+        with patch.dict(sys.modules, {'openai': fake_openai}), \
+             patch.object(settings, 'OPENAI_API_KEY', 'test-key'):
+            first = providers.get_client('openai', 'gpt-4')
+            second = providers.get_client('openai', 'gpt-4')
+        self.assertIs(first, second)
+        fake_openai.OpenAI.assert_called_once_with(api_key='test-key')
+        providers.invalidate()
+
+
+class AISettingsStoreTest(APITestCase):
+    """Test cases for the shared, versioned AI settings store."""
+    
+    def setUp(self):
+        ai_settings.reset()
+    
+    def tearDown(self):
+        ai_settings.reset()
+    
+    def test_update_persists_and_bumps_version(self):
+        """Test that POSTed settings are stored and versioned."""
+        response = self.client.post('/api/settings/ai/', {
+            'provider': 'openai',
+            'settings': {'model': 'gpt-4o', 'apiKey': 'sk-test'}
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 1)
+        
+        response = self.client.get('/api/settings/ai/')
+        self.assertEqual(response.data['provider'], 'openai')
+        self.assertEqual(response.data['model'], 'gpt-4o')
+        self.assertTrue(response.data['has_openai_key'])
+    
+    def test_other_worker_sees_change_and_rebuilds_affected_clients(self):
+        """Test that a change made elsewhere is picked up on the next version check."""
+        ai_settings.snapshot()
+        with patch('chat.settings_store.providers.invalidate') as invalidate, \
+             patch.object(settings, 'AI_SETTINGS_CHECK_INTERVAL', 0):
+            # Simulate another worker writing the shared row
+            from .models import AISettings
+            AISettings.objects.create(id=1, anthropic_api_key='new-key', version=1)
+            snapshot = ai_settings.snapshot()
+        self.assertEqual(snapshot.ANTHROPIC_API_KEY, 'new-key')
+        invalidate.assert_called_once_with('anthropic')
+    
+    def test_version_checked_once_per_snapshot(self):
+        """Test that reading attributes does not query the database."""
+        with patch.object(settings, 'AI_SETTINGS_CHECK_INTERVAL', 0):
+            with self.assertNumQueries(2):
+                snapshot = ai_settings.snapshot()
+            with self.assertNumQueries(0):
+                snapshot.AI_PROVIDER, snapshot.AI_MODEL, snapshot.OPENAI_API_KEY
+
+
+class TokenUsageTest(APITestCase):
+    """Test cases for token usage accounting and per-conversation budgets."""
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="Test", status="active")
+    
+    def _service(self, prompt_tokens=100, completion_tokens=20):
+        """An AIService on a fake OpenAI client returning the given usage."""
+        response = MagicMock()
+        response.choices[0].message.content = "Answer"
+        response.usage.prompt_tokens = prompt_tokens
+        response.usage.completion_tokens = completion_tokens
+        response.usage.prompt_tokens_details.cached_tokens = 10
+        client = MagicMock()
+        client.chat.completions.create.return_value = response
+        with patch('chat.ai_service.get_client', return_value=client):
+            return AIService(provider='openai')
+    
+    def test_usage_recorded_per_call(self):
+        """Test that provider usage is captured and persisted with cost."""
+        service = self._service()
+        service.generate_response([{'role': 'user', 'content': 'Hi'}])
+        with patch.object(settings, 'AI_MODEL_PRICES', {service.model: {'prompt': 1.0, 'completion': 2.0}}):
+            records = usage.record_usage(service, self.conversation)
+        
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0].prompt_tokens, records[0].completion_tokens, records[0].cached_tokens), (100, 20, 10))
+        self.assertAlmostEqual(records[0].cost, (90 * 1.0 + 10 * 1.0 + 20 * 2.0) / 1000)
+        self.assertEqual(service.usage, [])
+        
+        response = self.client.get(f'/api/usage/conversations/{self.conversation.id}/')
+        self.assertEqual(response.data['total_tokens'], 120)
+        response = self.client.get('/api/usage/providers/')
+        self.assertEqual(response.data['providers'][0]['provider'], 'openai')
+    
+    def test_budget_switches_model_and_truncates(self):
+        """Test that an over-budget conversation uses the fallback model and less context."""
+        service = self._service()
+        service.generate_response([{'role': 'user', 'content': 'Hi'}])
+        usage.record_usage(service, self.conversation)
+        messages = [{'role': 'system', 'content': 'sys'}] + [
+            {'role': 'user', 'content': str(i)} for i in range(10)
+        ]
+        
+        with patch.object(settings, 'CONVERSATION_TOKEN_BUDGET', 100), \
+             patch.object(settings, 'BUDGET_FALLBACK_MODEL', 'small-model'), \
+             patch.object(settings, 'BUDGET_CONTEXT_MESSAGES', 3), \
+             patch('chat.ai_service.get_client'):
+            trimmed = usage.apply_budget(self.conversation, service, messages)
+        
+        self.assertEqual(service.model, 'small-model')
+        self.assertEqual([m['content'] for m in trimmed], ['sys', '7', '8', '9'])
+
+
+class ModelRoutingTest(TestCase):
+    """Test cases for latency-aware model routing."""
+    
+    def _service(self):
+        response = MagicMock()
+        response.choices[0].message.content = "Answer"
+        response.usage.prompt_tokens = 10
+        response.usage.completion_tokens = 5
+        response.usage.prompt_tokens_details.cached_tokens = 0
+        client = MagicMock()
+        client.chat.completions.create.return_value = response
+        with patch('chat.ai_service.get_client', return_value=client):
+            return AIService(provider='openai')
+    
+    def _prompt(self, content):
+        return [{'role': 'system', 'content': 'sys'}, {'role': 'user', 'content': content}]
+    
+    def test_classifier_tiers(self):
+        """Test that small talk is simple and detailed technical asks are complex."""
+        self.assertEqual(routing.classify(routing.extract_features(self._prompt("thanks!"))), 'simple')
+        complex_prompt = self._prompt(
+            "Can you explain step by step how to design and implement a caching layer, "
+            "compare the trade-offs of write-through and write-back, and why each fails?"
+        )
+        self.assertEqual(routing.classify(routing.extract_features(complex_prompt)), 'complex')
+    
+    def test_simple_turn_uses_fast_model_and_records_decision(self):
+        """Test that a simple turn is routed to the fast model and the decision is stored."""
+        service = self._service()
+        with patch.object(settings, 'AI_ROUTING_ENABLED', True), \
+             patch.object(settings, 'AI_FAST_MODEL', 'fast-model'), \
+             patch('chat.ai_service.get_client', return_value=service.client):
+            decision = service.route(self._prompt("ok thanks"))
+            service.generate_response(self._prompt("ok thanks"))
+        
+        self.assertEqual(decision['tier'], 'simple')
+        self.assertEqual(service.model, 'fast-model')
+        self.assertEqual(
+            service.client.chat.completions.create.call_args.kwargs['max_tokens'],
+            settings.AI_ROUTING_MAX_TOKENS['simple']
+        )
+        record = usage.record_usage(service)[0]
+        self.assertEqual(record.model, 'fast-model')
+        self.assertEqual(record.routing['tier'], 'simple')
+        self.assertIn('prompt_words', record.routing['features'])
+    
+    def test_routing_disabled_keeps_defaults(self):
+        """Test that nothing changes when routing is disabled."""
+        service = self._service()
+        model = service.model
+        with patch.object(settings, 'AI_ROUTING_ENABLED', False):
+            self.assertEqual(service.route(self._prompt("ok thanks")), {})
+        self.assertEqual((service.model, service.max_tokens), (model, 2000))
+
+
+class TopicExtractionTest(TestCase):
+    """Test cases for local topic extraction."""
+    
+    def test_extracts_key_phrases(self):
+        """Test that content phrases are extracted and filler words ignored."""
+        extracted = topics.extract_topics([
+            "Hi! I need help deploying my Django app to Kubernetes.",
+            "Sure, deploying Django on Kubernetes needs a container image and a deployment manifest.",
+        ])
+        self.assertTrue(extracted)
+        self.assertTrue(any('kubernetes' in t for t in extracted))
+        self.assertNotIn('hi', ' '.join(extracted).split())
+        self.assertLessEqual(len(extracted), 5)
+    
+    def test_corpus_statistics_downweight_common_terms(self):
+        """Test that terms seen in every conversation rank below distinctive ones."""
+        for i in range(5):
+            topics.update_corpus([f"question about python project{i}"])
+        self.assertEqual(TopicTerm.objects.get(term='python').documents, 5)
+        
+        self.assertEqual(topics.extract_topics(["python. websockets."], limit=1), ['websockets'])
+        idf = topics.idf_weights(['python', 'websockets'])
+        self.assertLess(idf['python'], idf['websockets'])
+    
+    def test_parse_topic_list(self):
+        """Test that bulleted, numbered and error responses are parsed safely."""
+        self.assertEqual(topics.parse_topic_list("1. Python\n2. Django\n- python"), ['Python', 'Django'])
+        self.assertEqual(topics.parse_topic_list("Error generating response: timeout"), [])
+    
+    def test_extract_key_topics_is_local_by_default(self):
+        """Test that no LLM call is made unless refinement is enabled."""
+        with patch('chat.ai_service.get_client') as get_client:
+            service = AIService(provider='openai')
+            result = service.extract_key_topics([{'sender': 'user', 'content': 'Configuring nginx reverse proxy'}])
+        get_client.return_value.chat.completions.create.assert_not_called()
+        self.assertTrue(result)
+
+    def test_dry_run_writes_nothing(self):
+        """Test that a dry run previews topics without building the corpus or saving topics."""
+        conversation = Conversation.objects.create(title="Ended", status="ended", end_timestamp=timezone.now())
+        Message.objects.create(conversation=conversation, content="Configuring nginx reverse proxy", sender="user")
+        out = io.StringIO()
+
+        call_command('extract_topics', dry_run=True, stdout=out)
+
+        self.assertIn(f"{conversation.id}: ", out.getvalue())
+        self.assertFalse(TopicCorpus.objects.exists())
+        self.assertFalse(TopicTerm.objects.exists())
+        conversation.refresh_from_db()
+        self.assertNotIn('topics', conversation.metadata)
+
+
+class BackfillSummariesTest(TestCase):
+    """Test cases for the parallel, resumable summary backfill."""
+    
+    def setUp(self):
+        self.conversations = []
+        for i in range(3):
+            conversation = Conversation.objects.create(
+                title=f"Conv {i}", status="ended", end_timestamp=timezone.now(),
+                ai_summary="Error generating response: provider down" if i else None
+            )
+            Message.objects.create(conversation=conversation, content=f"Deploying kubernetes cluster {i}", sender="user")
+            self.conversations.append(conversation)
+        self.checkpoint = tempfile.mktemp(suffix='.json')
+        self.addCleanup(lambda: os.path.exists(self.checkpoint) and os.remove(self.checkpoint))
+    
+    def _client(self, fail_for=()):
+        def create(**kwargs):
+            response = MagicMock()
+            text = kwargs['messages'][-1]['content']
+            if any(f"cluster {i}" in text for i in fail_for):
+                raise RuntimeError("rate limited")
+            response.choices[0].message.content = "Fresh summary"
+            response.usage.prompt_tokens = 10
+            response.usage.completion_tokens = 5
+            response.usage.prompt_tokens_details.cached_tokens = 0
+            return response
+        client = MagicMock()
+        client.chat.completions.create.side_effect = create
+        return client
+    
+    def _run(self, client, **options):
+        with patch('chat.ai_service.get_client', return_value=client), \
+             patch('chat.backfill.time.sleep'):
+            call_command(
+                'backfill_summaries', checkpoint=self.checkpoint, rate=0, stdout=io.StringIO(),
+                stderr=io.StringIO(), **options
+            )
+    
+    def test_backfills_missing_summaries_in_parallel(self):
+        """Test that missing and failed summaries are regenerated with topics and usage."""
+        self._run(self._client(), workers=3)
+        
+        for conversation in self.conversations:
+            conversation.refresh_from_db()
+            self.assertEqual(conversation.ai_summary, "Fresh summary")
+            self.assertTrue(conversation.metadata['topics'])
+            self.assertIn('summary_model', conversation.metadata)
+        self.assertEqual(AIUsage.objects.filter(purpose='summary').count(), 3)
+        self.assertFalse(os.path.exists(self.checkpoint))
+        expected = Counter(
+            analytics.normalize_topic(t) for c in Conversation.objects.all() for t in set(c.metadata['topics'])
+        )
+        self.assertEqual(dict(TopicCount.objects.values_list('topic', 'count')), dict(expected))
+    
+    def test_resumes_from_checkpoint(self):
+        """Test that a limited run checkpoints and the next run continues after it."""
+        self._run(self._client(), limit=1, chunk_size=1)
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['last_id'], self.conversations[0].id)
+        
+        client = self._client()
+        self._run(client, limit=5)
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+    
+    def test_local_batch_backend_records_failures(self):
+        """Test that the batch stand-in processes a chunk and failures are kept in the checkpoint."""
+        self._run(self._client(fail_for=[1]), batch='local', limit=10)
+        
+        summaries = [Conversation.objects.get(id=c.id).ai_summary for c in self.conversations]
+        self.assertEqual(summaries[0], "Fresh summary")
+        self.assertTrue(summaries[1].startswith("Error generating response"))
+        self.assertEqual(summaries[2], "Fresh summary")
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['failed'], [self.conversations[1].id])
+    
+    def test_finished_run_keeps_failures_for_retry(self):
+        """Test that a complete run rewinds the cursor but keeps failed ids, and --retry-failed redoes only them."""
+        with patch('chat.management.commands.backfill_summaries.typeahead_index') as index:
+            self._run(self._client(fail_for=[1]), batch='local', chunk_size=2)
+        self.assertEqual(index.invalidate.call_count, 2)
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual((state['last_id'], state['failed']), (0, [self.conversations[1].id]))
+        
+        client = self._client()
+        self._run(client, retry_failed=True)
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+        self.assertEqual(Conversation.objects.get(id=self.conversations[1].id).ai_summary, "Fresh summary")
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['failed'], [])
+    
+    @override_settings(SUMMARY_CHUNK_TOKENS=20)
+    def test_batch_backend_summarizes_long_transcripts_map_reduce(self):
+        """Test that transcripts too long for one prompt skip the batch job and are chunked."""
+        conversation = self.conversations[0]
+        for i in range(6):
+            Message.objects.create(conversation=conversation, content=f"Part {i} of a long deployment discussion", sender="user")
+        batch = MagicMock()
+        batch.run.side_effect = lambda requests: {custom_id: "Batch summary" for custom_id in requests}
+        limiter = MagicMock()
+        histories = services.load_histories(self.conversations)
+        with patch('chat.ai_service.get_client', return_value=self._client()):
+            results = BatchBackend(batch, limiter, lambda: AIService(provider='openai')).summarize(histories)
+        
+        self.assertEqual(set(batch.run.call_args.args[0]), {str(c.id) for c in self.conversations[1:]})
+        self.assertEqual(results[conversation.id]['summary'], "Fresh summary")
+        self.assertGreater(len(results[conversation.id]['service'].usage), 2)
+        self.assertEqual(limiter.acquire.call_count, len(results[conversation.id]['service'].usage))
+    
+    @override_settings(SUMMARY_CHUNK_TOKENS=20)
+    def test_thread_pool_limits_every_chunk_call(self):
+        """Test that each provider call of a long conversation takes a rate-limit token."""
+        history = [{'sender': 'user', 'content': f'Part {i} of a long deployment discussion'} for i in range(6)]
+        limiter = MagicMock()
+        with patch('chat.ai_service.get_client', return_value=self._client()), \
+                patch('chat.summarization.ThreadPoolExecutor', wraps=ThreadPoolExecutor) as pool:
+            backend = ThreadPoolBackend(2, limiter)
+            result = backend._summarize(AIService(provider='openai'), self.conversations[0].id, history)
+        calls = len(result['service'].usage)
+        self.assertGreater(calls, 2)
+        self.assertEqual(limiter.acquire.call_count, calls)
+        self.assertTrue(all(call.kwargs['max_workers'] == 1 for call in pool.call_args_list))
+    
+    def test_rate_limiter_spaces_calls(self):
+        """Test that the token bucket limits the call rate."""
+        limiter = RateLimiter(rate=50, burst=1)
+        started = time.monotonic()
+        for _ in range(4):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+    
+    def test_stale_mode_selects_other_models(self):
+        """Test that 'stale' picks conversations not summarized by the current model."""
+        Conversation.objects.filter(id=self.conversations[0].id).update(metadata={'summary_model': 'current'})
+        Conversation.objects.filter(id=self.conversations[1].id).update(metadata={'summary_model': 'old'})
+        
+        selected = list(select_conversations('stale', 'current').values_list('id', flat=True))
+        self.assertEqual(selected, [self.conversations[1].id, self.conversations[2].id])
+
+
+@override_settings(REPLICA_DATABASES=['replica_1'])
+class ReplicaRoutingTest(SimpleTestCase):
+    """Test cases for read-replica routing and read-your-writes pinning."""
+    
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+    
+    def _read_db(self, request, view_attrs=None):
+        """The database a read inside the view would use, and the response."""
+        seen = {}
+        
+        def view(request):
+            seen['db'] = self.router.db_for_read(Conversation)
+            return HttpResponse()
+        for name, value in (view_attrs or {}).items():
+            setattr(view, name, value)
+        
+        middleware = ReplicaPinningMiddleware(lambda req: middleware.process_view(req, view, (), {}) or view(req))
+        response = middleware(request)
+        return seen['db'], response
+    
+    def test_reads_go_to_replicas_and_writes_to_primary(self):
+        """Test the router's default choices."""
+        self.assertEqual(self.router.db_for_read(Conversation), 'replica_1')
+        self.assertEqual(self.router.db_for_write(Conversation), 'default')
+        with db_use_primary():
+            self.assertEqual(self.router.db_for_read(Conversation), 'default')
+    
+    def test_write_request_pins_and_sets_sticky_cookie(self):
+        """Test that a write request reads from the primary and pins the client afterwards."""
+        db, response = self._read_db(self.factory.post('/api/chat/send/'))
+        self.assertEqual(db, 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+        
+        request = self.factory.get('/api/conversations/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self._read_db(request)[0], 'default')
+        self.assertEqual(self._read_db(self.factory.get('/api/conversations/'))[0], 'replica_1')
+    
+    def test_read_only_post_uses_replicas(self):
+        """Test that @replica_reads views read from replicas without pinning the client."""
+        db, response = self._read_db(self.factory.post('/api/intelligence/query/'), {'replica_reads': True})
+        self.assertEqual(db, 'replica_1')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+class IdempotencyTest(APITestCase):
+    """Test cases for Idempotency-Key handling on send_message and end_conversation."""
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="Test", status="active")
+        patcher = patch('chat.views.AIService')
+        mock_ai_service = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ai = MagicMock()
+        self.ai.generate_response.return_value = "Hello!"
+        mock_ai_service.return_value = self.ai
+    
+    def _send(self, key, content='Hello, AI!'):
+        return self.client.post('/api/messages/send/', {
+            'conversation_id': self.conversation.id,
+            'content': content
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+    
+    def test_retry_replays_stored_response(self):
+        """Test that a retry returns the first response without new writes or LLM calls."""
+        first = self._send('key-1')
+        second = self._send('key-1')
+        
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.data, json.loads(json.dumps(first.data)))
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 2)
+        self.assertEqual(self.ai.generate_response.call_count, 1)
+    
+    def test_key_reuse_with_different_body_rejected(self):
+        """Test that a key cannot be reused for a different request."""
+        self._send('key-2')
+        response = self._send('key-2', content='Something else')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+    
+    def test_duplicate_waits_for_in_flight_request(self):
+        """Test that a concurrent duplicate waits and then gets the first response."""
+        record, _ = claim('key-3', '/api/messages/send/', 'fingerprint')
+        
+        def complete(_):
+            IdempotencyRecord.objects.filter(id=record.id).update(
+                status='completed', response_status=201, response_body={'done': True}
+            )
+        with patch('chat.idempotency.request_fingerprint', return_value='fingerprint'), \
+             patch('chat.idempotency.time.sleep', side_effect=complete):
+            response = self._send('key-3')
+        
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'done': True})
+        self.assertEqual(self.ai.generate_response.call_count, 0)
+    
+    def test_duplicate_gets_conflict_when_wait_times_out(self):
+        """Test that a duplicate of a still-running request gets 409."""
+        claim('key-4', '/api/messages/send/', 'fingerprint')
+        with patch('chat.idempotency.request_fingerprint', return_value='fingerprint'), \
+             patch.object(settings, 'IDEMPOTENCY_WAIT_SECONDS', 0):
+            response = self._send('key-4')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+    
+    def test_retry_after_timeout_reuses_user_message(self):
+        """Test that a retry of a 504 answers the saved user message instead of saving a copy."""
+        self.ai.generate_response.side_effect = [DeadlineExceeded("too slow"), "Hello!"]
+        first = self._send('key-5')
+        self.assertEqual(first.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(IdempotencyRecord.objects.get(key='key-5').status, 'failed')
+        
+        second = self._send('key-5')
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data['user_message']['id'], first.data['user_message']['id'])
+        self.assertEqual(
+            list(Message.objects.filter(conversation=self.conversation).values_list('sender', flat=True)),
+            ['user', 'ai']
+        )
+        self.assertEqual(self._send('key-5')['Idempotent-Replayed'], 'true')
+    
+    def test_end_conversation_double_submit(self):
+        """Test that a double-submitted end is replayed instead of failing."""
+        self.ai.generate_summary.return_value = "Summary"
+        self.ai.extract_key_topics.return_value = []
+        self.ai.model = "test-model"
+        url = f'/api/conversations/{self.conversation.id}/end/'
+        first = self.client.post(url, HTTP_IDEMPOTENCY_KEY='end-1')
+        second = self.client.post(url, HTTP_IDEMPOTENCY_KEY='end-1')
+        
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.ai.generate_summary.call_count, 1)
+
+
+class AdminScalingTest(TestCase):
+    """Test cases for the admin change lists on large tables."""
+    
+    def setUp(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        for i in range(5):
+            conversation = Conversation.objects.create(title=f"Conv {i}")
+            for j in range(i):
+                Message.objects.create(conversation=conversation, content=f"msg {j}", sender="user")
+    
+    def test_conversation_changelist_query_count_is_constant(self):
+        """Test that message counts do not cost a query per row."""
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get('/admin/chat/conversation/')
+        self.assertEqual(response.status_code, 200)
+        
+        for i in range(5, 15):
+            Conversation.objects.create(title=f"Conv {i}")
+        with CaptureQueriesContext(connection) as many:
+            self.client.get('/admin/chat/conversation/')
+        self.assertEqual(len(few), len(many))
+        
+        counts = sorted(c.total_message_count for c in response.context['cl'].result_list)
+        self.assertEqual(counts, [0, 1, 2, 3, 4])
+    
+    def test_message_count_column_sorts_archived_conversations_by_archived_count(self):
+        """Test that archived conversations show and sort by the count kept on their archive."""
+        archived = Conversation.objects.get(title="Conv 4")
+        archived.status, archived.end_timestamp = 'ended', timezone.now()
+        archived.save()
+        archive_conversation(archived)
+        
+        # Sort descending by the sixth list_display column, message_count
+        response = self.client.get('/admin/chat/conversation/', {'o': '-6'})
+        rows = response.context['cl'].result_list
+        self.assertEqual([c.title for c in rows][:2], ["Conv 4", "Conv 3"])
+        self.assertEqual(ConversationAdmin.message_count(None, rows[0]), 4)
+    
+    def test_message_changelist_and_search(self):
+        """Test the message list, conversation search and date drill-down."""
+        conversation = Conversation.objects.get(title="Conv 2")
+        response = self.client.get('/admin/chat/message/', {'q': f'#{conversation.id}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        
+        year = timezone.now().year
+        response = self.client.get('/admin/chat/message/', {'timestamp__year': year})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 10)
+    
+    def test_estimated_count_for_large_unfiltered_lists(self):
+        """Test that the paginator uses the table estimate above the exact-count limit."""
+        with patch.object(settings, 'ADMIN_EXACT_COUNT_LIMIT', 3):
+            self.assertEqual(EstimatedCountPaginator(Message.objects.all(), 20).count,
+                             Message.objects.order_by('-id').first().id)
+            self.assertEqual(EstimatedCountPaginator(Message.objects.filter(sender='user'), 20).count, 3)
+    
+    def test_admin_edits_invalidate_conditional_gets_and_history(self):
+        """Test that admin edits change the detail validators, cached payload and prompt history."""
+        cache.clear()
+        conversation = Conversation.objects.get(title="Conv 2")
+        message = conversation.messages.first()
+        detail_url = f'/api/conversations/{conversation.id}/'
+        etag = self.client.get(detail_url)['ETag']
+        services.get_prompt_history(conversation)
+
+        response = self.client.post(f'/admin/chat/message/{message.id}/change/', {
+            'conversation': conversation.id, 'content': 'edited by admin', 'sender': 'user', 'status': 'complete'
+        })
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('edited by admin', [m['content'] for m in response.json()['messages']])
+        conversation.refresh_from_db()
+        self.assertIn('edited by admin', [m['content'] for m in services.get_prompt_history(conversation)])
+
+        etag = response['ETag']
+        response = self.client.post(f'/admin/chat/conversation/{conversation.id}/change/', {
+            'title': 'Renamed', 'status': 'active', 'ai_summary': '', 'metadata': '{}', 'version': conversation.version
+        })
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+    def test_indexed_date_drilldown(self):
+        """Test that datetimes() returns the same periods as the DISTINCT query."""
+        queryset = indexed_dates(Message.objects.all())
+        self.assertEqual(
+            list(queryset.datetimes('timestamp', 'month')),
+            list(Message.objects.datetimes('timestamp', 'month'))
+        )
+
+
+class DeadlineTest(APITestCase):
+    """Test cases for request deadlines and cancellation of provider calls."""
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="Test", status="active")
+    
+    def _service(self, create):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = create
+        with patch('chat.ai_service.get_client', return_value=client):
+            return AIService(provider='openai')
+    
+    def _reply(self, **kwargs):
+        response = MagicMock()
+        response.choices[0].message.content = "Answer"
+        response.usage.prompt_tokens = 10
+        response.usage.completion_tokens = 5
+        response.usage.prompt_tokens_details.cached_tokens = 0
+        return response
+    
+    def test_remaining_time_passed_as_provider_timeout(self):
+        """Test that the deadline becomes the provider call's timeout."""
+        service = self._service(self._reply)
+        service.deadline = Deadline(10)
+        service.generate_response([{'role': 'user', 'content': 'Hi'}])
+        timeout = service.client.chat.completions.create.call_args.kwargs['timeout']
+        self.assertTrue(0 < timeout <= 10)
+    
+    def test_provider_timeout_raises_deadline_exceeded(self):
+        """Test that a call cut short by the deadline raises instead of returning an error string."""
+        service = self._service(None)
+        service.deadline = Deadline(10)
+        
+        def timed_out(**kwargs):
+            service.deadline.expires_at = time.monotonic() - 1
+            raise TimeoutError("Request timed out")
+        service.client.chat.completions.create.side_effect = timed_out
+        
+        with self.assertRaises(DeadlineExceeded):
+            service.generate_response([{'role': 'user', 'content': 'Hi'}])
+    
+    def test_send_message_returns_504_without_ai_message(self):
+        """Test that a timed-out turn keeps the user message and saves no AI reply."""
+        service = self._service(lambda **kwargs: (_ for _ in ()).throw(DeadlineExceeded("late")))
+        with patch('chat.views.AIService', return_value=service):
+            response = self.client.post('/api/messages/send/', {
+                'conversation_id': self.conversation.id, 'content': 'Hi'
+            }, format='json', HTTP_X_REQUEST_TIMEOUT='5')
+        
+        self.assertEqual(response.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(
+            list(Message.objects.filter(conversation=self.conversation).values_list('sender', flat=True)),
+            ['user']
+        )
+    
+    def test_disconnected_client_reply_not_saved(self):
+        """Test that a reply arriving after the client went away is dropped."""
+        def reply_after_disconnect(**kwargs):
+            service.deadline.cancel()
+            return self._reply()
+        service = self._service(reply_after_disconnect)
+        with patch('chat.views.AIService', return_value=service):
+            response = self.client.post('/api/messages/send/', {
+                'conversation_id': self.conversation.id, 'content': 'Hi'
+            }, format='json')
+        
+        self.assertEqual(response.status_code, CLIENT_CLOSED_REQUEST)
+        self.assertFalse(Message.objects.filter(conversation=self.conversation, sender='ai').exists())
+        self.assertEqual(AIUsage.objects.filter(conversation=self.conversation).count(), 1)
+    
+    def test_stream_deadline_saves_partial_output_by_policy(self):
+        """Test that a timed-out stream's text is saved with a marker under the 'save' policy."""
+        def stream(messages):
+            yield "Partial"
+            raise DeadlineExceeded("late")
+        mock_ai_service = MagicMock()
+        mock_ai_service.return_value.stream_response.side_effect = stream
+        
+        with patch.object(settings, 'PARTIAL_OUTPUT_POLICY', 'save'):
+            received = ChatWebSocketTest._run(self, [
+                {'type': 'open', 'conversation_id': self.conversation.id},
+                {'type': 'message', 'conversation_id': self.conversation.id, 'content': 'Hi'},
+            ], mock_ai_service, expected=6)
+        
+        self.assertEqual(
+            [f['type'] for f in received],
+            ['opened', 'user_message', 'ai_message_started', 'token', 'error', 'ai_message']
+        )
+        self.assertTrue(received[-1]['partial'])
+        message = Message.objects.get(conversation=self.conversation, sender='ai')
+        self.assertEqual(message.content, "Partial" + settings.PARTIAL_OUTPUT_MARKER)
+        self.assertEqual(message.status, 'interrupted')
+
+
+@override_settings(SUMMARY_CHUNK_TOKENS=50, SUMMARY_MAP_WORKERS=3)
+class MapReduceSummaryTest(TestCase):
+    """Test cases for chunked summaries of long conversations."""
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="Long")
+        self.history = [
+            {'sender': 'user' if i % 2 == 0 else 'ai', 'content': f"Message {i} " + "about the project plan " * 4}
+            for i in range(12)
+        ]
+        self.client_mock = MagicMock()
+        self.client_mock.chat.completions.create.side_effect = self._reply
+        with patch('chat.ai_service.get_client', return_value=self.client_mock):
+            self.service = AIService(provider='openai')
+    
+    def _reply(self, **kwargs):
+        response = MagicMock()
+        response.choices[0].message.content = "Summary of part"
+        response.usage.prompt_tokens = 10
+        response.usage.completion_tokens = 5
+        response.usage.prompt_tokens_details.cached_tokens = 0
+        return response
+    
+    def _calls(self):
+        return self.client_mock.chat.completions.create.call_count
+    
+    def test_chunk_boundaries_are_stable_when_messages_are_appended(self):
+        """Test that appending messages only changes the last chunk."""
+        before = summarization.chunk_transcript(self.history, 50)
+        after = summarization.chunk_transcript(self.history + [{'sender': 'user', 'content': 'One more'}], 50)
+        self.assertGreater(len(before), 1)
+        self.assertEqual(after[:len(before) - 1], before[:-1])
+        self.assertTrue(all(summarization.estimate_tokens(chunk) <= 51 for chunk in after))
+    
+    def test_short_conversation_uses_a_single_call(self):
+        """Test that a conversation fitting one chunk is summarized directly."""
+        self.service.generate_summary(self.history[:1], self.conversation.id)
+        self.assertEqual(self._calls(), 1)
+        self.assertFalse(SummaryChunk.objects.exists())
+    
+    def test_resummarizing_only_processes_new_chunks(self):
+        """Test that cached chunk summaries are reused after new messages."""
+        chunks = summarization.chunk_transcript(self.history, 50)
+        self.service.generate_summary(self.history, self.conversation.id)
+        first_run = self._calls()
+        self.assertGreaterEqual(first_run, len(chunks) + 1)
+        self.assertEqual(SummaryChunk.objects.filter(conversation=self.conversation).count(), len(chunks))
+        
+        extended = self.history + [{'sender': 'user', 'content': 'One more question'}]
+        self.service.generate_summary(extended, self.conversation.id)
+        reduce_calls = first_run - len(chunks)
+        # The changed last chunk plus the reduce step
+        self.assertEqual(self._calls() - first_run, 1 + reduce_calls)
+    
+    def test_failed_chunk_raises_and_keeps_successful_chunks(self):
+        """Test that a provider error surfaces as SummaryError, not as summary text."""
+        replies = iter([self._reply(), RuntimeError("context length exceeded")] + [self._reply()] * 20)
+        
+        def flaky(**kwargs):
+            reply = next(replies)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+        self.client_mock.chat.completions.create.side_effect = flaky
+        
+        with patch.object(settings, 'SUMMARY_MAP_WORKERS', 1):
+            with self.assertRaises(summarization.SummaryError):
+                self.service.generate_summary(self.history, self.conversation.id)
+        chunks = summarization.chunk_transcript(self.history, 50)
+        self.assertEqual(SummaryChunk.objects.count(), len(chunks) - 1)
+    
+    def test_end_conversation_does_not_store_error_as_summary(self):
+        """Test that a failed summary leaves ai_summary empty for a later backfill."""
+        Message.objects.create(conversation=self.conversation, content="Hello", sender="user")
+        self.client_mock.chat.completions.create.side_effect = RuntimeError("boom")
+        with patch('chat.views.AIService', return_value=self.service):
+            response = self.client.post(f'/api/conversations/{self.conversation.id}/end/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.json()['summary'])
+        self.assertIn('boom', response.json()['summary_error'])
+        self.conversation.refresh_from_db()
+        self.assertIsNone(self.conversation.ai_summary)
+        self.assertNotIn('summary_model', self.conversation.metadata)
+        self.assertIn(self.conversation, select_conversations('missing', 'test-model'))
+
+
+class SummaryIndexTest(APITestCase):
+    """Test cases for the day/week/month summary index."""
+    
+    def setUp(self):
+        today = timezone.localdate()
+        self.last_month = summary_index.period_of('month', today.replace(day=1) - timedelta(days=1))[0]
+        for offset, title, topic_list in [(1, "Deploy", ["Kubernetes", "deployment"]),
+                                          (3, "Cluster", ["kubernetes"]),
+                                          (3, "Lunch", ["food"])]:
+            conversation = Conversation.objects.create(title=title, status='ended')
+            conversation.end_timestamp = timezone.make_aware(
+                datetime.combine(self.last_month + timedelta(days=offset), datetime.min.time().replace(hour=12))
+            )
+            conversation.ai_summary = f"Talked about {title.lower()}."
+            conversation.metadata = {'topics': topic_list}
+            conversation.save()
+            services.conversation_ended(conversation)
+        
+        self.client_mock = MagicMock()
+        self.client_mock.chat.completions.create.side_effect = self._reply
+        with patch('chat.ai_service.get_client', return_value=self.client_mock):
+            self.service = AIService(provider='openai')
+    
+    def _reply(self, **kwargs):
+        response = MagicMock()
+        response.choices[0].message.content = "Mostly Kubernetes."
+        response.usage.prompt_tokens = 10
+        response.usage.completion_tokens = 5
+        response.usage.prompt_tokens_details.cached_tokens = 0
+        return response
+    
+    def test_ending_conversations_updates_day_week_and_month_nodes(self):
+        """Test that counts and topics roll up incrementally into every level."""
+        month = SummaryNode.objects.get(level='month', period_start=self.last_month)
+        self.assertEqual(month.conversation_count, 3)
+        self.assertEqual(month.topics, {'kubernetes': 2, 'deployment': 1, 'food': 1})
+        self.assertTrue(month.stale)
+        day = SummaryNode.objects.get(level='day', period_start=self.last_month + timedelta(days=3))
+        self.assertEqual(day.conversation_count, 2)
+    
+    def test_parse_time_range_and_cover(self):
+        """Test that relative ranges map to whole months, weeks and days."""
+        today = datetime(2026, 10, 19).date()
+        start, end = summary_index.parse_time_range("What came up most last quarter?", today)
+        self.assertEqual((start.isoformat(), end.isoformat()), ('2026-07-01', '2026-10-01'))
+        self.assertEqual([level for level, _ in summary_index.cover(start, end)], ['month'] * 3)
+        self.assertEqual(
+            summary_index.cover(*summary_index.parse_time_range("in the last 10 days", today)),
+            [('day', today - timedelta(days=9)), ('day', today - timedelta(days=8)),
+             ('week', today - timedelta(days=7)), ('day', today)]
+        )
+        self.assertIsNone(summary_index.parse_time_range("May I ask something?", today))
+    
+    def test_time_range_question_reads_month_node(self):
+        """Test that a time-range question reads stored nodes without refreshing them."""
+        with patch('chat.views.AIService', return_value=self.service):
+            response = self.client.post('/api/intelligence/query/', {
+                'query': 'Which topics came up most last month?'
+            }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['level'] for p in response.json()['periods']], ['month'])
+        self.assertEqual(response.json()['periods'][0]['top_topics'][0], {'topic': 'kubernetes', 'count': 2})
+        self.assertEqual(len(response.json()['relevant_conversations']), 3)
+        # Only the answer; node summaries are regenerated in the background
+        self.assertEqual(self.client_mock.chat.completions.create.call_count, 1)
+        question = self.client_mock.chat.completions.create.call_args.kwargs['messages'][-1]['content']
+        self.assertIn('kubernetes (2)', question)
+        self.assertTrue(SummaryNode.objects.get(level='month', period_start=self.last_month).stale)
+    
+    def test_time_range_question_with_keywords_reads_matching_conversations(self):
+        """Test that keywords narrow a time-range question instead of being ignored."""
+        with patch('chat.views.AIService', return_value=self.service):
+            response = self.client.post('/api/intelligence/query/', {
+                'query': 'What did we decide last month?',
+                'search_keywords': 'lunch'
+            }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('periods', response.json())
+        self.assertEqual([c['title'] for c in response.json()['relevant_conversations']], ['Lunch'])
+    
+    def test_refresh_stale_summarizes_days_before_months(self):
+        """Test that refreshing writes the summaries a later question reads."""
+        refreshed = summary_index.refresh_stale(self.service)
+        self.assertEqual(refreshed, SummaryNode.objects.count())
+        self.assertFalse(SummaryNode.objects.filter(stale=True).exists())
+        month = SummaryNode.objects.get(level='month', period_start=self.last_month)
+        self.assertEqual(month.summary, "Mostly Kubernetes.")
+    
+    def _end_and_refresh(self, conversation):
+        """End a conversation, run the refresh threads it starts; returns (threads, refresh mock, sleep mock)."""
+        threads = []
+        real_thread = threading.Thread
+        
+        def spawn(*args, **kwargs):
+            threads.append(real_thread(*args, **kwargs))
+            return threads[-1]
+        
+        with patch('chat.summary_index.threading.Thread', side_effect=spawn), \
+                patch('chat.summary_index.AIService', return_value=self.service), \
+                patch('chat.summary_index.sleep') as sleep, \
+                patch('chat.summary_index.refresh_stale') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                services.conversation_ended(conversation)
+            for thread in threads:
+                thread.join(5)
+        return threads, refresh, sleep
+    
+    def test_ending_conversation_refreshes_in_background(self):
+        """Test that ending a conversation starts one rate-limited refresh thread after commit."""
+        cache.clear()
+        conversation = Conversation.objects.create(title="Late", status='ended', end_timestamp=timezone.now())
+        threads, refresh, sleep = self._end_and_refresh(conversation)
+        
+        self.assertEqual(len(threads), 1)
+        refresh.assert_called_once_with(self.service)
+        sleep.assert_not_called()
+        self.assertIs(self.service.rate_limiter, summary_index.refresh_rate_limiter())
+        self.assertIsNone(cache.get(summary_index.REFRESH_LOCK_KEY))
+    
+    @override_settings(SUMMARY_INDEX_REFRESH_INTERVAL=300)
+    def test_refreshes_at_most_once_per_interval(self):
+        """Test that a refresh soon after the previous one waits out the interval."""
+        cache.clear()
+        cache.set(summary_index.REFRESH_LAST_KEY, timezone.now().timestamp() - 100, None)
+        conversation = Conversation.objects.create(title="Late", status='ended', end_timestamp=timezone.now())
+        threads, refresh, sleep = self._end_and_refresh(conversation)
+        
+        refresh.assert_called_once_with(self.service)
+        self.assertAlmostEqual(sleep.call_args.args[0], 200, delta=5)
+    
+    def test_refresh_keeps_node_stale_after_concurrent_change(self):
+        """Test that a refresh does not clear a change made while it ran."""
+        node = SummaryNode.objects.get(level='day', period_start=self.last_month + timedelta(days=1))
+        SummaryNode.objects.filter(id=node.id).update(version=node.version + 1)
+        summary_index.refresh_node(node, self.service)
+        node.refresh_from_db()
+        self.assertTrue(node.stale)
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0, PROFILING_TOKEN='secret')
+class ProfilingTest(APITestCase):
+    """Test cases for the request profiling middleware and endpoints."""
+    
+    def setUp(self):
+        self.conversation = Conversation.objects.create(title="Profiled")
+        Message.objects.create(conversation=self.conversation, content="Hello", sender="user")
+    
+    def test_unsampled_request_without_valid_header_is_not_profiled(self):
+        """Test that anonymous X-Profile requests need the token."""
+        self.client.get('/api/conversations/', HTTP_X_PROFILE='1')
+        self.assertFalse(RequestProfile.objects.exists())
+    
+    def test_header_profile_records_queries_and_serializer_time(self):
+        """Test that a profiled request stores endpoint, duration, queries and sections."""
+        response = self.client.get(f'/api/conversations/{self.conversation.id}/', HTTP_X_PROFILE='secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.trigger, 'header')
+        self.assertEqual(profile.view_name, 'conversation-detail')
+        self.assertEqual(profile.status_code, 200)
+        self.assertGreater(profile.query_count, 0)
+        self.assertIn('serializer', profile.sections)
+        self.assertGreater(profile.duration_ms, 0)
+    
+    def test_ai_calls_are_timed_separately(self):
+        """Test that AIService provider calls get their own section."""
+        client = MagicMock()
+        reply = client.chat.completions.create.return_value
+        reply.choices[0].message.content = "Hi there"
+        reply.usage.prompt_tokens = 10
+        reply.usage.completion_tokens = 5
+        reply.usage.prompt_tokens_details.cached_tokens = 0
+        with patch('chat.ai_service.get_client', return_value=client):
+            service = AIService(provider='openai')
+        with patch('chat.views.AIService', return_value=service):
+            self.client.post('/api/messages/send/', {
+                'conversation_id': self.conversation.id, 'content': 'Hi'
+            }, format='json', HTTP_X_PROFILE='secret')
+        
+        self.assertEqual(RequestProfile.objects.get().sections['ai']['calls'], 1)
+    
+    def test_retention_keeps_newest_profiles(self):
+        """Test that only PROFILING_MAX_PROFILES profiles are kept."""
+        with self.settings(PROFILING_SAMPLE_RATE=1, PROFILING_MAX_PROFILES=2):
+            for _ in range(3):
+                self.client.get('/api/conversations/')
+        self.assertEqual(RequestProfile.objects.count(), 2)
+        self.assertEqual(set(RequestProfile.objects.values_list('trigger', flat=True)), {'sample'})
+    
+    def test_profiles_are_admin_only_and_downloadable(self):
+        """Test listing, detail and download of stored profiles."""
+        self.client.get('/api/conversations/', HTTP_X_PROFILE='secret')
+        profile = RequestProfile.objects.get()
+        self.assertEqual(self.client.get('/api/profiles/').status_code, status.HTTP_403_FORBIDDEN)
+        
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        listing = self.client.get('/api/profiles/?path=conversations').json()
+        self.assertEqual([row['id'] for row in listing], [profile.id])
+        detail = self.client.get(f'/api/profiles/{profile.id}/').json()
+        self.assertTrue(detail['top_functions'])
+        
+        download = self.client.get(f'/api/profiles/{profile.id}/download/')
+        with tempfile.NamedTemporaryFile(suffix='.prof') as f:
+            f.write(download.content)
+            f.flush()
+            stats = pstats.Stats(f.name, stream=io.StringIO())
+        self.assertGreater(stats.total_calls, 0)
+
+
+class QueryBudgetMixin:
+    """
+    Guardrails for the SQL cost of endpoints as data grows.
+    
+    assertScalesWithinBudget seeds the database up to each of SIZES
+    conversations, runs the request at every size, and fails if it issues
+    more than max_queries queries or takes longer than max_seconds. The
+    failure message lists the queries, with repeated statements (the usual
+    sign of an N+1) counted together.
+    """
+    SIZES = (10, 100, 1000)
+    MESSAGES_PER_CONVERSATION = 3
+    
+    def seed_conversations(self, total):
+        """Add ended conversations (with messages) until there are `total`."""
+        existing = Conversation.objects.count()
+        if total <= existing:
+            return
+        now = timezone.now()
+        conversations = Conversation.objects.bulk_create([
+            Conversation(
+                title=f"Budget conversation {i}",
+                status='ended',
+                end_timestamp=now,
+                ai_summary=f"Summary {i} about budgets",
+                metadata={'topics': ['budgets']}
+            )
+            for i in range(existing, total)
+        ])
+        Message.objects.bulk_create([
+            Message(conversation=conversation, content=f"Budget message {j}", sender='user' if j % 2 == 0 else 'ai')
+            for conversation in conversations
+            for j in range(self.MESSAGES_PER_CONVERSATION)
+        ])
+        # Bulk writes skip the write hooks that invalidate cached payloads
+        cache.clear()
+    
+    @staticmethod
+    def format_queries(queries):
+        shapes = Counter(re.sub(r"\b\d+\b|'[^']*'", '?', query['sql']) for query in queries)
+        lines = [f"  {index}. {query['sql']}" for index, query in enumerate(queries, start=1)]
+        repeated = [f"  {count}x {sql}" for sql, count in shapes.most_common() if count > 1]
+        if repeated:
+            lines += ["Repeated statements:"] + repeated
+        return "\n".join(lines)
+    
+    def assertScalesWithinBudget(self, label, request, max_queries, max_seconds):
+        """Run request() at every size; returns the query count per size."""
+        counts = {}
+        for size in self.SIZES:
+            self.seed_conversations(size)
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = request()
+                elapsed = time.perf_counter() - started
+            self.assertLess(response.status_code, 400, f"{label} failed at {size} conversations")
+            counts[size] = len(context.captured_queries)
+            if counts[size] > max_queries:
+                self.fail(
+                    f"{label} ran {counts[size]} queries at {size} conversations "
+                    f"(budget {max_queries}):\n{self.format_queries(context.captured_queries)}"
+                )
+            self.assertLess(
+                elapsed, max_seconds,
+                f"{label} took {elapsed:.3f}s at {size} conversations (budget {max_seconds}s)"
+            )
+        return counts
+
+
+class QueryBudgetTest(QueryBudgetMixin, APITestCase):
+    """SQL query and time budgets of the API endpoints at 10, 100 and 1000 conversations."""
+    
+    def setUp(self):
+        cache.clear()
+        client = MagicMock()
+        reply = client.chat.completions.create.return_value
+        reply.choices[0].message.content = "Answer"
+        reply.usage.prompt_tokens = 10
+        reply.usage.completion_tokens = 5
+        reply.usage.prompt_tokens_details.cached_tokens = 0
+        patcher = patch('chat.ai_service.get_client', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_format_queries_groups_repeated_statements(self):
+        """Test that the failure output points at N+1 statements."""
+        output = self.format_queries([
+            {'sql': 'SELECT COUNT(*) FROM "chat_message" WHERE "conversation_id" = 1'},
+            {'sql': 'SELECT COUNT(*) FROM "chat_message" WHERE "conversation_id" = 2'},
+        ])
+        self.assertIn('2x SELECT COUNT(*) FROM "chat_message" WHERE "conversation_id" = ?', output)
+    
+    def test_conversation_list(self):
+        self.assertScalesWithinBudget(
+            'GET /api/conversations/', lambda: self.client.get('/api/conversations/'),
+            max_queries=3, max_seconds=1.0
+        )
+    
+    def test_conversation_detail(self):
+        self.seed_conversations(1)
+        conversation = Conversation.objects.first()
+        self.assertScalesWithinBudget(
+            'GET /api/conversations/{id}/', lambda: self.client.get(f'/api/conversations/{conversation.id}/'),
+            max_queries=3, max_seconds=1.0
+        )
+    
+    def test_keyword_search(self):
+        self.assertScalesWithinBudget(
+            'GET /api/conversations/search/', lambda: self.client.get('/api/conversations/search/?q=Budget'),
+            max_queries=5, max_seconds=2.0
+        )
+    
+    def test_semantic_search(self):
+        self.assertScalesWithinBudget(
+            'GET /api/conversations/search/?semantic=true',
+            lambda: self.client.get('/api/conversations/search/?q=budget&semantic=true'),
+            max_queries=5, max_seconds=3.0
+        )
+    
+    def test_query_intelligence(self):
+        self.assertScalesWithinBudget(
+            'POST /api/intelligence/query/',
+            lambda: self.client.post('/api/intelligence/query/', {
+                'query': 'What did we discuss?', 'search_keywords': 'budget'
+            }, format='json'),
+            max_queries=8, max_seconds=2.0
+        )
+    
+    def test_analytics_and_usage(self):
+        for url in ['/api/analytics/summary/', '/api/analytics/topics/', '/api/usage/conversations/']:
+            self.assertScalesWithinBudget(
+                f'GET {url}', lambda: self.client.get(url), max_queries=4, max_seconds=1.0
+            )
+
+
+class TypeaheadTest(APITestCase):
+    """Tests for the in-memory typeahead index and the autocomplete endpoint"""
+    
+    def setUp(self):
+        cache.clear()
+        typeahead_index.invalidate()
+        # Rebuild in the test's thread, which sees its uncommitted rows
+        patcher = patch.object(typeahead_index, '_start_rebuild', typeahead_index.rebuild)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def create(self, title, topics=(), days_ago=0):
+        started = timezone.now() - timedelta(days=days_ago)
+        return Conversation.objects.create(
+            title=title, start_timestamp=started, end_timestamp=started,
+            status='ended', metadata={'topics': list(topics)}
+        )
+    
+    def suggest(self, q, **params):
+        response = self.client.get('/api/conversations/autocomplete/', {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['suggestions']
+    
+    def test_matches_start_of_any_word(self):
+        self.create('Planning the Django migration', ['database migrations'])
+        self.create('Weekend plans')
+        texts = [s['text'] for s in self.suggest('mig')]
+        self.assertEqual(sorted(texts), ['Planning the Django migration', 'database migrations'])
+        self.assertEqual(self.suggest('planning the dj')[0]['text'], 'Planning the Django migration')
+        self.assertEqual(self.suggest('ration'), [])
+        self.assertEqual(self.suggest(''), [])
+        self.assertEqual([s['kind'] for s in self.suggest('mig', kind='topic')], ['topic'])
+    
+    def test_ranks_by_frequency_and_recency(self):
+        for _ in range(3):
+            self.create('Python help', days_ago=10)
+        self.create('Python packaging', days_ago=60)
+        self.create('Python typing', days_ago=0)
+        suggestions = self.suggest('pyth')
+        self.assertEqual(suggestions[0]['text'], 'Python help')
+        self.assertEqual(suggestions[0]['count'], 3)
+        self.assertEqual(
+            [s['text'] for s in suggestions[1:]], ['Python typing', 'Python packaging']
+        )
+    
+    def test_updated_incrementally_on_create_and_end(self):
+        self.suggest('anything')  # build the index
+        response = self.client.post('/api/conversations/', {'title': 'Kubernetes rollout'}, format='json')
+        conversation = Conversation.objects.get(id=response.data['id'])
+        with self.assertNumQueries(0):
+            suggestions = self.suggest('kube')
+        self.assertEqual(suggestions[0]['conversation_id'], conversation.id)
+        
+        conversation.status = 'ended'
+        conversation.end_timestamp = timezone.now()
+        conversation.metadata = {'topics': ['Helm charts']}
+        conversation.save()
+        services.conversation_ended(conversation)
+        with self.assertNumQueries(0):
+            self.assertEqual([s['text'] for s in self.suggest('helm')], ['helm charts'])
+    
+    def test_rebuilds_when_another_worker_changes_generation(self):
+        self.create('Old title')
+        self.assertEqual(len(self.suggest('old')), 1)
+        Conversation.objects.all().delete()
+        typeahead_index.invalidate()
+        self.assertEqual(self.suggest('old'), [])
+    
+    @override_settings(TYPEAHEAD_CHECK_INTERVAL=60)
+    def test_warm_lookup_runs_no_queries(self):
+        for i in range(50):
+            self.create(f'Budget review {i}', ['budget'])
+        self.suggest('bud')
+        with self.assertNumQueries(0):
+            started = time.perf_counter()
+            suggestions = self.suggest('budget r', limit=5)
+        self.assertEqual(len(suggestions), 5)
+        self.assertLess(time.perf_counter() - started, 0.5)
+    
+    def test_short_prefix_ranks_all_matches(self):
+        old = timezone.now() - timedelta(days=90)
+        Conversation.objects.bulk_create([
+            Conversation(title=f'Aardvark {i:03d}', start_timestamp=old) for i in range(300)
+        ])
+        for _ in range(3):
+            self.create('Azure setup')
+        self.assertEqual(self.suggest('a')[0]['text'], 'Azure setup')
+        # Updated in place: a growing entry enters the ranked lists of its prefixes
+        for _ in range(4):
+            self.client.post('/api/conversations/', {'title': 'Apple pie'}, format='json')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('a', kind='title')[0]['text'], 'Apple pie')
+    
+    def test_long_prefix_ranks_every_match(self):
+        old = timezone.now() - timedelta(days=90)
+        Conversation.objects.bulk_create([
+            Conversation(title=f'Deploy {i:04d}', start_timestamp=old) for i in range(2500)
+        ])
+        for _ in range(3):
+            self.create('Deploy zebra cluster')
+        self.assertEqual(self.suggest('deploy')[0]['text'], 'Deploy zebra cluster')
+        self.assertEqual(self.suggest('deploy', kind='title', limit=1)[0]['count'], 3)
+
+    def test_stale_index_rebuilds_in_background(self):
+        self.create('Old title')
+        self.suggest('old')
+        typeahead_index.invalidate()
+        with patch.object(typeahead_index, '_start_rebuild') as start, self.assertNumQueries(0):
+            suggestions = self.suggest('old')
+        start.assert_called_once()
+        self.assertEqual([s['text'] for s in suggestions], ['Old title'])
+    
+    def test_rejects_unknown_kind(self):
+        response = self.client.get('/api/conversations/autocomplete/', {'q': 'a', 'kind': 'message'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DedupTest(APITestCase):
+    """Tests for MinHash/LSH near-duplicate detection"""
+    
+    ONBOARDING = [
+        "How do I reset my password for the staging environment?",
+        "Where can I find the onboarding checklist for new engineers on the platform team?",
+        "Who approves access requests to the production database and how long does it take?",
+    ]
+    
+    def setUp(self):
+        cache.clear()
+    
+    def create(self, title, user_messages, days_ago=0):
+        started = timezone.now() - timedelta(days=days_ago)
+        conversation = Conversation.objects.create(title=title)
+        conversation.start_timestamp = started  # auto_now_add ignores the value given to create()
+        for content in user_messages:
+            Message.objects.create(conversation=conversation, sender='user', content=content)
+            Message.objects.create(conversation=conversation, sender='ai', content=f'Reply {conversation.id}')
+        conversation.status = 'ended'
+        conversation.end_timestamp = started
+        conversation.save()
+        services.conversation_ended(conversation)
+        return conversation
+    
+    def test_signature_estimates_jaccard_similarity(self):
+        first = dedup.user_shingles([{'sender': 'user', 'content': text} for text in self.ONBOARDING])
+        second = dedup.user_shingles([{'sender': 'user', 'content': text} for text in self.ONBOARDING[:2]])
+        jaccard = len(first & second) / len(first | second)
+        estimate = dedup.similarity(dedup.minhash(first), dedup.minhash(second))
+        self.assertAlmostEqual(estimate, jaccard, delta=0.15)
+        self.assertIsNone(dedup.minhash(set()))
+    
+    def test_indexed_on_end_and_found_through_lsh(self):
+        original = self.create('Onboarding', self.ONBOARDING)
+        copy = self.create('Onboarding again', [text.upper() for text in self.ONBOARDING])
+        other = self.create('Kubernetes', ["Why does my pod restart every few minutes with exit code 137?"])
+        self.assertEqual(MinHashBand.objects.filter(conversation=original).count(), settings.DEDUP_BANDS)
+        self.assertEqual(dedup.find_similar(original.id), [(copy.id, 1.0)])
+        self.assertEqual(dedup.find_similar(other.id), [])
+        
+        response = self.client.get(f'/api/conversations/{original.id}/duplicates/')
+        self.assertEqual([row['id'] for row in response.data['duplicates']], [copy.id])
+        self.assertEqual(response.data['duplicates'][0]['similarity'], 1.0)
+        self.assertEqual(self.client.get('/api/conversations/999999/duplicates/').status_code, 404)
+    
+    def test_search_collapses_near_duplicates(self):
+        older = self.create('Onboarding questions', self.ONBOARDING, days_ago=2)
+        newer = self.create('Onboarding questions', self.ONBOARDING + ["Thanks!"], days_ago=1)
+        distinct = self.create('Onboarding laptop', ["Which laptop model do new hires get on their first day?"])
+        
+        response = self.client.get('/api/conversations/search/', {'q': 'onboarding'})
+        self.assertEqual([row['id'] for row in response.data['results']], [distinct.id, newer.id])
+        self.assertEqual(response.data['duplicates'], {str(newer.id): [older.id]})
+        
+        response = self.client.get('/api/conversations/search/', {'q': 'onboarding', 'dedupe': 'false'})
+        self.assertEqual(len(response.data['results']), 3)
+    
+    def test_intelligence_context_skips_near_duplicates(self):
+        for day in range(12):
+            self.create(f'Onboarding {day}', self.ONBOARDING, days_ago=day)
+        distinct = self.create('Budget', ["What is the hardware budget for the next quarter?"], days_ago=20)
+        service = MagicMock()
+        service.model = "test-model"
+        service.query_conversations.return_value = "Answer"
+        with patch('chat.views.AIService', return_value=service):
+            response = self.client.post('/api/intelligence/query/', {'query': 'What came up?'}, format='json')
+        context = service.query_conversations.call_args[0][1]
+        self.assertEqual([conv['title'] for conv in context], ['Onboarding 0', 'Budget'])
+        self.assertEqual([row['id'] for row in response.data['relevant_conversations']][1], distinct.id)
+    
+    def test_find_duplicates_command_indexes_and_clusters(self):
+        first = self.create('Onboarding', self.ONBOARDING)
+        second = self.create('Onboarding', self.ONBOARDING)
+        third = self.create('Onboarding', self.ONBOARDING[1:] + self.ONBOARDING[:1])
+        self.create('Other', ["Completely unrelated question about quarterly expense reports"])
+        ConversationSignature.objects.all().delete()
+        MinHashBand.objects.all().delete()
+        
+        out = io.StringIO()
+        call_command('find_duplicates', '--index', '--json', stdout=out)
+        lines = out.getvalue().strip().splitlines()
+        self.assertEqual(lines[0], 'Signed 4 conversation(s)')
+        self.assertEqual(json.loads(lines[1]), [sorted([first.id, second.id, third.id])])
+        
+        out = io.StringIO()
+        call_command('find_duplicates', stdout=out)
+        self.assertIn('1 cluster(s) with 2 redundant conversation(s)', out.getvalue())
+
+
+class SearchCacheTest(APITestCase):
+    """Tests for the write-generation search result cache"""
+    
+    def setUp(self):
+        cache.clear()
+        self.conversation = Conversation.objects.create(title='Deploy pipeline')
+        services.create_message(self.conversation, 'user', 'The deploy pipeline is failing on staging')
+    
+    def search(self, q, **params):
+        response = self.client.get('/api/conversations/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in response.json()['results']]
+    
+    def test_identical_searches_are_served_from_cache(self):
+        self.assertEqual(self.search('deploy'), [self.conversation.id])
+        # Only the write generation is read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search('  DEPLOY '), [self.conversation.id])
+        with self.assertNumQueries(1):
+            self.search('deploy', semantic='false')
+        stats = self.client.get('/api/analytics/cache/').data['search']
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3, places=3)
+    
+    def test_modes_are_cached_separately(self):
+        self.search('deploy')
+        with patch('chat.views.AIService') as service:
+            service.return_value.model = "test-model"
+            service.return_value.semantic_search.return_value = []
+            self.assertEqual(self.search('deploy', semantic='true'), [])
+            self.search('deploy', semantic='true')
+        self.assertEqual(service.return_value.semantic_search.call_count, 1)
+    
+    def test_writes_invalidate_cached_results(self):
+        self.assertEqual(self.search('rollback'), [])
+        services.create_message(self.conversation, 'user', 'Should we rollback?')
+        self.assertEqual(self.search('rollback'), [self.conversation.id])
+        
+        response = self.client.post('/api/conversations/', {'title': 'Rollback plan'}, format='json')
+        self.assertEqual(len(self.search('rollback')), 2)
+        
+        Conversation.objects.filter(id=response.data['id']).delete()
+        self.assertEqual(len(self.search('rollback')), 2)  # deleted outside the write paths
+        caching.bump_write_generation()
+        self.assertEqual(self.search('rollback'), [self.conversation.id])
+    
+    def test_write_in_another_worker_invalidates_results(self):
+        """Test that results cached by this worker are not served after a write in another worker."""
+        self.assertEqual(self.search('deploy'), [self.conversation.id])
+        other = Conversation.objects.create(title='Deploy checklist')
+        # Another worker's write: advances the database row, this worker's cache is untouched
+        WriteGeneration.objects.update(value=F('value') + 1)
+        self.assertEqual(sorted(self.search('deploy')), [self.conversation.id, other.id])
+    
+    def test_generation_survives_cache_loss(self):
+        caching.bump_write_generation()
+        before = caching.write_generation()
+        cache.clear()
+        self.assertEqual(caching.write_generation(), before)
+        WriteGeneration.objects.all().delete()
+        self.assertGreater(caching.write_generation(), before)
+
+
+@override_settings(STREAM_PERSIST_INTERVAL=0, STREAM_RESUME_POLL_SECONDS=0.01)
+class StreamResumeTest(TestCase):
+    """Tests for incrementally persisted AI replies and resuming their streams"""
+    
+    def setUp(self):
+        cache.clear()
+        self.conversation = Conversation.objects.create(title="Flaky network", status="active")
+    
+    def test_dropped_socket_resumes_same_generation(self):
+        from . import websocket
+        from .websocket import chat_websocket
+        
+        release = threading.Event()
+        
+        def stream(messages):
+            yield "Hel"
+            release.wait(5)
+            yield "lo!"
+        mock_ai_service = MagicMock()
+        mock_ai_service.return_value.stream_response.side_effect = stream
+        
+        async def connect():
+            communicator = ApplicationCommunicator(chat_websocket, {'type': 'websocket', 'path': '/ws/chat/'})
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(1)
+            return communicator
+        
+        async def send(communicator, frame):
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(frame)})
+        
+        async def receive(communicator, count):
+            return [json.loads((await communicator.receive_output(2))['text']) for _ in range(count)]
+        
+        async def scenario():
+            first = await connect()
+            await send(first, {'type': 'open', 'conversation_id': self.conversation.id})
+            await send(first, {'type': 'message', 'conversation_id': self.conversation.id, 'content': 'Hi'})
+            frames = await receive(first, 4)
+            message_id = frames[2]['message']['id']
+            await first.send_input({'type': 'websocket.disconnect', 'code': 1006})
+            await first.wait(1)
+            
+            persisted = await sync_to_async(Message.objects.get)(id=message_id)
+            self.assertEqual((persisted.content, persisted.status), ('Hel', 'streaming'))
+            
+            second = await connect()
+            await send(second, {
+                'type': 'resume', 'conversation_id': self.conversation.id, 'message_id': message_id, 'offset': 3
+            })
+            release.set()
+            resumed = await receive(second, 2)
+            await asyncio.gather(*list(websocket._detached))
+            await second.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await second.wait(1)
+            return resumed
+        
+        with patch('chat.websocket.AIService', mock_ai_service):
+            resumed = async_to_sync(scenario)()
+        
+        self.assertEqual([(f['type'], f.get('offset'), f.get('delta')) for f in resumed[:1]], [('token', 3, 'lo!')])
+        self.assertEqual(resumed[1]['type'], 'ai_message')
+        self.assertEqual(resumed[1]['message']['content'], 'Hello!')
+        self.assertEqual(mock_ai_service.return_value.stream_response.call_count, 1)
+        message = Message.objects.get(sender='ai')
+        self.assertEqual((message.content, message.status), ('Hello!', 'complete'))
+    
+    def test_discarded_on_error_under_discard_policy(self):
+        def stream(messages):
+            yield "Partial"
+            raise RuntimeError("upstream reset")
+        mock_ai_service = MagicMock()
+        mock_ai_service.return_value.stream_response.side_effect = stream
+        received = ChatWebSocketTest._run(self, [
+            {'type': 'open', 'conversation_id': self.conversation.id},
+            {'type': 'message', 'conversation_id': self.conversation.id, 'content': 'Hi'},
+        ], mock_ai_service, expected=5)
+        self.assertEqual(received[-1]['type'], 'error')
+        self.assertFalse(Message.objects.filter(sender='ai').exists())
+    
+    def test_streaming_reply_left_out_of_prompt_history(self):
+        services.create_message(self.conversation, 'user', 'Hi')
+        services.start_ai_message(self.conversation)
+        self.assertEqual(
+            services.build_prompt_history(self.conversation)[1:], [{'role': 'user', 'content': 'Hi'}]
+        )
+    
+    @override_settings(PARTIAL_OUTPUT_POLICY='save')
+    def test_abandoned_reply_is_settled_as_interrupted(self):
+        services.create_message(self.conversation, 'user', 'Hi')
+        message = services.start_ai_message(self.conversation)
+        services.save_stream_progress(message, 'Half a')
+        Message.objects.filter(id=message.id).update(timestamp=timezone.now() - timedelta(hours=1))
+        # Found by the next prompt rather than by a resume
+        history = services.build_prompt_history(self.conversation)
+        self.assertIn({'role': 'assistant', 'content': 'Half a\n\n[Response interrupted]'}, history)
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'interrupted')
+        lines = self.resume(message, 6)
+        self.assertEqual(lines[-1]['status'], 'interrupted')
+        self.assertEqual(lines[-1]['message']['status'], 'interrupted')
+    
+    def resume(self, message, offset, **headers):
+        response = self.client.get(f'/api/messages/{message.id}/resume/', {'offset': offset}, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        
+        return [json.loads(line) for line in async_to_sync(read)().splitlines()]
+    
+    def test_resume_endpoint_sends_rest_of_reply(self):
+        message = services.start_ai_message(self.conversation)
+        services.save_stream_progress(message, 'Hello wor')
+        services.finish_ai_message(self.conversation, message, 'Hello world')
+        lines = self.resume(message, 6)
+        self.assertEqual(lines[0], {'offset': 6, 'delta': 'world'})
+        self.assertEqual(lines[1]['status'], 'complete')
+        self.assertEqual(lines[1]['message']['content'], 'Hello world')
+    
+    def test_resume_endpoint_stops_at_deadline_or_abandoned_stream(self):
+        message = services.start_ai_message(self.conversation)
+        services.save_stream_progress(message, 'Hello')
+        lines = self.resume(message, 0, HTTP_X_REQUEST_TIMEOUT='0.05')
+        self.assertEqual(lines, [
+            {'offset': 0, 'delta': 'Hello'},
+            {'status': 'streaming', 'message': lines[1]['message']},
+        ])
+        
+        Message.objects.filter(id=message.id).update(timestamp=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.resume(message, 5)[-1], {'status': 'discarded', 'message': None})
+        self.assertFalse(Message.objects.filter(id=message.id).exists())
+        
+        response = self.client.get(f'/api/messages/{message.id}/resume/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,187 @@
+"""
+Local keyword/topic extraction.
+
+Candidate phrases are found RAKE-style: the text is split at stop words and
+punctuation, and each remaining run of up to MAX_PHRASE_WORDS content words
+is a candidate. Words are weighted by TF-IDF against corpus statistics
+(TopicTerm document frequencies) that are updated incrementally as
+conversations end, so terms common to every conversation ("code", "question")
+sink and distinctive ones rise. Runs in milliseconds with no provider call.
+"""
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import TopicCorpus, TopicTerm
+
+CORPUS_ROW_ID = 1
+MAX_PHRASE_WORDS = 3
+MAX_TERM_LENGTH = 100
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are aren't as at be because been before being
+below between both but by can can't cannot could couldn't did didn't do does doesn't doing don't down
+during each few for from further had hadn't has hasn't have haven't having he her here hers herself him
+himself his how i i'd i'll i'm i've if in into is isn't it it's its itself let's me more most mustn't my
+myself no nor not of off on once only or other ought our ours ourselves out over own same shan't she
+should shouldn't so some such than that that's the their theirs them themselves then there there's these
+they they'd they'll they're they've this those through to too under until up very was wasn't we we'd
+we'll we're we've were weren't what what's when where which while who whom why will with won't would
+wouldn't you you'd you'll you're you've your yours yourself yourselves
+ok okay yes yeah no hi hello hey thanks thank please sure great good nice cool awesome perfect fine
+like just really actually basically maybe also still even well much many lot lots thing things stuff
+want wants need needs know think get got make made use used using help tell give say said see look
+one two first new way something anything everything someone anyone here's let able sorry right
+""".split())
+
+WORD_RE = re.compile(r"[a-z0-9][a-z0-9+#'.-]*[a-z0-9+#]|[a-z]")
+# Phrase boundaries: punctuation, and periods that end a sentence (not "node.js")
+SPLIT_RE = re.compile(r"[,;:!?()\[\]{}\"\n\t/|]+|\.(?=\s|$)")
+
+
+def words(text: str) -> List[str]:
+    """Lower-cased word tokens of a text."""
+    return WORD_RE.findall(text.lower())
+
+
+def is_content_word(word: str) -> bool:
+    return (
+        len(word) > 1
+        and len(word) <= MAX_TERM_LENGTH
+        and word not in STOPWORDS
+        and not word.replace('.', '').isdigit()
+    )
+
+
+def candidate_phrases(text: str) -> List[List[str]]:
+    """Runs of content words between stop words and punctuation."""
+    phrases = []
+    for fragment in SPLIT_RE.split(text.lower()):
+        run: List[str] = []
+        for word in words(fragment):
+            if is_content_word(word):
+                run.append(word)
+                if len(run) == MAX_PHRASE_WORDS:
+                    phrases.append(run)
+                    run = []
+            else:
+                if run:
+                    phrases.append(run)
+                run = []
+        if run:
+            phrases.append(run)
+    return phrases
+
+
+def document_terms(text: str) -> set:
+    """Distinct content words of a document, as counted in the corpus statistics."""
+    return {word for word in words(text) if is_content_word(word)}
+
+
+def idf_weights(terms: Iterable[str]) -> Dict[str, float]:
+    """Smoothed inverse document frequency of each term (1.0 for an empty corpus)."""
+    terms = list(terms)
+    corpus = TopicCorpus.objects.filter(id=CORPUS_ROW_ID).values_list('documents', flat=True).first() or 0
+    frequencies = dict(TopicTerm.objects.filter(term__in=terms).values_list('term', 'documents'))
+    return {
+        term: math.log((corpus + 1) / (frequencies.get(term, 0) + 1)) + 1
+        for term in terms
+    }
+
+
+def extract_topics(texts: Iterable[str], limit: int = 5) -> List[str]:
+    """
+    Extract the top key phrases of a conversation.
+
+    Args:
+        texts: Message contents of the conversation
+        limit: Maximum number of topics
+
+    Returns:
+        Key phrases, best first
+    """
+    text = '\n'.join(texts)
+    phrases = candidate_phrases(text)
+    if not phrases:
+        return []
+
+    term_counts = Counter(word for phrase in phrases for word in phrase)
+    idf = idf_weights(term_counts)
+    word_scores = {word: (1 + math.log(count)) * idf[word] for word, count in term_counts.items()}
+
+    phrase_counts = Counter(' '.join(phrase) for phrase in phrases)
+    scored = sorted(
+        (
+            sum(word_scores[w] for w in phrase.split()) / math.sqrt(len(phrase.split())) * (1 + math.log(count)),
+            phrase
+        )
+        for phrase, count in phrase_counts.items()
+    )
+
+    topics: List[str] = []
+    covered: set = set()
+    for _, phrase in reversed(scored):
+        phrase_words = set(phrase.split())
+        if phrase_words <= covered:
+            continue
+        topics.append(phrase)
+        covered |= phrase_words
+        if len(topics) == limit:
+            break
+    return topics
+
+
+def parse_topic_list(response: str, limit: int = 5) -> List[str]:
+    """
+    Parse a model's topic list, whether comma-separated, one per line or
+    bulleted/numbered. Error strings and empty items are dropped.
+    """
+    if not response or response.startswith('Error generating response'):
+        return []
+    topics = []
+    for item in re.split(r'[,\n;]', response):
+        item = re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', item).strip(' .\'"`')
+        if item and len(item) <= 100 and item.lower() not in {t.lower() for t in topics}:
+            topics.append(item)
+    return topics[:limit]
+
+
+def update_corpus(texts: Iterable[str]):
+    """Count one more document (conversation) in the corpus statistics."""
+    terms = sorted(document_terms('\n'.join(texts)))
+    with transaction.atomic():
+        TopicCorpus.objects.get_or_create(id=CORPUS_ROW_ID)
+        TopicCorpus.objects.filter(id=CORPUS_ROW_ID).update(documents=F('documents') + 1)
+        for start in range(0, len(terms), 500):
+            batch = terms[start:start + 500]
+            TopicTerm.objects.bulk_create([TopicTerm(term=term) for term in batch], ignore_conflicts=True)
+            TopicTerm.objects.filter(term__in=batch).update(documents=F('documents') + 1)
+
+
+def rebuild_corpus(documents: Iterable[Iterable[str]]) -> int:
+    """
+    Recompute the corpus statistics from scratch.
+
+    Args:
+        documents: The message contents of each conversation
+
+    Returns:
+        Number of documents counted
+    """
+    frequencies: Counter = Counter()
+    count = 0
+    for texts in documents:
+        frequencies.update(document_terms('\n'.join(texts)))
+        count += 1
+    with transaction.atomic():
+        TopicTerm.objects.all().delete()
+        TopicTerm.objects.bulk_create(
+            [TopicTerm(term=term, documents=n) for term, n in frequencies.items()],
+            batch_size=1000
+        )
+        TopicCorpus.objects.update_or_create(id=CORPUS_ROW_ID, defaults={'documents': count})
+    return count
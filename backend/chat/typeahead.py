@@ -0,0 +1,299 @@
+"""
+In-memory typeahead index over conversation titles and topics.
+
+Every word start of every title and topic is a key in a sorted array, so
+the matches of a prefix are one bisect plus a scan, without touching the
+database. Suggestions are ranked by how many conversations use the title or
+topic and how recently one was last seen; every match is ranked, keeping
+only the best ones in a bounded heap during the scan.
+
+One- and two-letter prefixes match too many keys to rank on every
+keystroke, so the best TOP_K entries of each such prefix are kept ranked
+and updated as entries change.
+
+The index is built from the database once per process (one query) and then
+updated in place as conversations are created and ended. Every update also
+bumps a generation counter in the shared Django cache; a worker that sees
+the counter move past its own updates (checked at most every
+TYPEAHEAD_CHECK_INTERVAL seconds) rebuilds, which is also how deletions and
+changes made elsewhere are picked up. Rebuilds run on a background thread
+and swap the new index in whole; lookups keep using the old one meanwhile.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .analytics import normalize_topic
+from .models import Conversation
+
+GENERATION_KEY = 'chat:typeahead:generation'
+WORD_START_RE = re.compile(r'\w+')
+# Prefixes up to this length are served from ranked top lists
+TOP_PREFIX_LENGTH = 2
+# Entries kept per top list; at least the endpoint's largest limit
+TOP_K = 50
+
+
+def normalize(text: str) -> str:
+    return ' '.join(str(text).lower().split())
+
+
+@dataclass
+class Entry:
+    """One suggestion: a title or a topic with its usage."""
+    kind: str
+    text: str
+    count: int = 0
+    last_seen: float = 0.0  # unix timestamp
+    conversation_id: Optional[int] = None  # latest conversation with this title
+
+    def score(self, now: float) -> float:
+        age_days = max(now - self.last_seen, 0) / 86400
+        return math.log1p(self.count) + math.exp(-age_days / settings.TYPEAHEAD_RECENCY_DAYS)
+
+
+class _Index:
+    """One build of the index. A rebuild replaces it; local writes update it in place."""
+
+    def __init__(self):
+        self.keys: List[Tuple[str, int]] = []
+        self.entries: List[Entry] = []
+        self.ids: Dict[Tuple[str, str], int] = {}
+        # (prefix, kind or None) -> best entry ids, best first
+        self.top: Dict[Tuple[str, Optional[str]], List[int]] = {}
+
+    def _rank(self, now: float):
+        return lambda entry_id: (-self.entries[entry_id].score(now), self.entries[entry_id].text)
+
+    def _top_keys(self, entry_id: int) -> set:
+        entry = self.entries[entry_id]
+        normalized = normalize(entry.text)
+        prefixes = {
+            normalized[match.start():match.start() + length].rstrip()
+            for match in WORD_START_RE.finditer(normalized)
+            for length in range(1, TOP_PREFIX_LENGTH + 1)
+        }
+        return {(prefix, kind) for prefix in prefixes for kind in (None, entry.kind)}
+
+    def _promote(self, entry_id: int):
+        """Re-rank the top lists of an entry whose count or recency grew."""
+        rank = self._rank(time.time())
+        for key in self._top_keys(entry_id):
+            ranked = self.top.setdefault(key, [])
+            if entry_id not in ranked:
+                ranked.append(entry_id)
+            ranked.sort(key=rank)
+            del ranked[TOP_K:]
+
+    def add(self, kind: str, text: str, seen: datetime, conversation_id: int = None, bulk: bool = False):
+        text = ' '.join(str(text).split())[:255]
+        if not text:
+            return
+        identity = (kind, normalize(text))
+        entry_id = self.ids.get(identity)
+        if entry_id is None:
+            entry_id = len(self.entries)
+            self.ids[identity] = entry_id
+            self.entries.append(Entry(kind, text))
+            normalized = identity[1]
+            for match in WORD_START_RE.finditer(normalized):
+                key = (normalized[match.start():], entry_id)
+                if bulk:
+                    self.keys.append(key)
+                else:
+                    insort(self.keys, key)
+        entry = self.entries[entry_id]
+        entry.count += 1
+        timestamp = seen.timestamp() if seen else 0.0
+        if timestamp >= entry.last_seen:
+            entry.last_seen = timestamp
+            if conversation_id is not None:
+                entry.conversation_id = conversation_id
+        if not bulk:
+            self._promote(entry_id)
+
+    def add_conversation(self, conversation_id, title, topics, seen, bulk=False):
+        if title:
+            self.add('title', title, seen, conversation_id, bulk)
+        for topic in {normalize_topic(t) for t in topics or []} - {''}:
+            self.add('topic', topic, seen, bulk=bulk)
+
+    def seen(self, kind: str, text: str, seen: datetime):
+        """Refresh the recency of an entry without counting it again."""
+        entry_id = self.ids.get((kind, normalize(text)))
+        if entry_id is not None:
+            entry = self.entries[entry_id]
+            entry.last_seen = max(entry.last_seen, seen.timestamp())
+            self._promote(entry_id)
+
+    def finish_bulk(self):
+        """Sort the keys and rank the top lists after bulk adds."""
+        self.keys.sort()
+        self.top = {}
+        # Visiting entries best first fills every list in rank order
+        for entry_id in sorted(range(len(self.entries)), key=self._rank(time.time())):
+            for key in self._top_keys(entry_id):
+                ranked = self.top.setdefault(key, [])
+                if len(ranked) < TOP_K:
+                    ranked.append(entry_id)
+
+    def _matches(self, prefix: str, kind: Optional[str]):
+        """Ids of the entries with a word starting with prefix, each once."""
+        found = set()
+        position = bisect_left(self.keys, (prefix, -1))
+        while position < len(self.keys):
+            key, entry_id = self.keys[position]
+            if not key.startswith(prefix):
+                break
+            position += 1
+            if entry_id not in found and (kind is None or self.entries[entry_id].kind == kind):
+                found.add(entry_id)
+                yield entry_id
+
+    def candidates(self, prefix: str, kind: Optional[str], limit: int) -> List[Entry]:
+        """The best `limit` entries for the prefix (top lists for short prefixes)."""
+        if len(prefix) <= TOP_PREFIX_LENGTH:
+            return [self.entries[entry_id] for entry_id in self.top.get((prefix, kind), ())]
+        best = heapq.nsmallest(limit, self._matches(prefix, kind), key=self._rank(time.time()))
+        return [self.entries[entry_id] for entry_id in best]
+
+
+class TypeaheadIndex:
+    """Sorted (key, entry id) array over the word starts of every entry."""
+
+    def __init__(self):
+        self._index: Optional[_Index] = None
+        self._lock = threading.Lock()  # guards in-place updates of _index and reads during them
+        self._build_lock = threading.Lock()  # one rebuild at a time
+        self._generation: Optional[int] = None
+        self._checked = 0.0
+        self._stale = False
+        self._rebuilding = False
+
+    def __len__(self):
+        return len(self._index.entries) if self._index else 0
+
+    # Building and updating
+
+    def rebuild(self):
+        """Rebuild from all conversations (one query) and swap the new index in."""
+        with self._build_lock:
+            generation = cache.get(GENERATION_KEY, 0)
+            index = _Index()
+            rows = Conversation.objects.values_list(
+                'id', 'title', 'metadata__topics', 'start_timestamp', 'end_timestamp'
+            )
+            for conversation_id, title, topics, started, ended in rows.iterator():
+                index.add_conversation(
+                    conversation_id, title, topics if isinstance(topics, list) else [], ended or started, bulk=True
+                )
+            index.finish_bulk()
+            with self._lock:
+                self._index = index
+                self._generation = generation
+                self._stale = False
+                self._checked = time.monotonic()
+
+    def _start_rebuild(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, name='typeahead-rebuild', daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def _bump(self, applied: bool):
+        """
+        Advance the shared generation. If nobody else changed it since our
+        last check, this worker is current; otherwise rebuild on next use.
+        """
+        try:
+            generation = cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, 0, None)
+            generation = cache.incr(GENERATION_KEY)
+        with self._lock:
+            if applied and self._generation is not None and generation == self._generation + 1:
+                self._generation = generation
+            else:
+                self._stale = True
+
+    def conversation_created(self, conversation: Conversation):
+        with self._lock:
+            if self._index is not None:
+                self._index.add_conversation(conversation.id, conversation.title, [], conversation.start_timestamp)
+        self._bump(applied=True)
+
+    def conversation_ended(self, conversation: Conversation):
+        """Add the topics of an ended conversation (its title was added when it was created)."""
+        with self._lock:
+            if self._index is not None:
+                seen = conversation.end_timestamp or conversation.start_timestamp
+                for topic in {normalize_topic(t) for t in conversation.metadata.get('topics', [])} - {''}:
+                    self._index.add('topic', topic, seen)
+                if conversation.title:
+                    # Refresh the title's recency without counting the conversation again
+                    self._index.seen('title', conversation.title, seen)
+        self._bump(applied=True)
+
+    def invalidate(self):
+        """Make every worker rebuild (after deletions or bulk changes)."""
+        self._bump(applied=False)
+
+    # Lookup
+
+    def _ensure_current(self):
+        if self._index is None:
+            # Nothing to serve yet: the first lookup waits for the first build
+            with self._build_lock:
+                built = self._index is not None
+            if not built:
+                self.rebuild()
+            return
+        if not self._stale:
+            if time.monotonic() - self._checked < settings.TYPEAHEAD_CHECK_INTERVAL:
+                return
+            self._checked = time.monotonic()
+            if cache.get(GENERATION_KEY, 0) == self._generation:
+                return
+        self._start_rebuild()
+
+    def suggest(self, prefix: str, limit: int = 8, kind: str = None) -> List[Dict]:
+        """Best titles and topics with a word starting with prefix, highest score first."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self._ensure_current()
+        with self._lock:
+            entries = self._index.candidates(prefix, kind, limit)
+        now = time.time()
+        entries = heapq.nsmallest(limit, entries, key=lambda entry: (-entry.score(now), entry.text))
+        return [
+            {
+                'text': entry.text,
+                'kind': entry.kind,
+                'count': entry.count,
+                'last_seen': datetime.fromtimestamp(entry.last_seen, tz=timezone.utc).isoformat(),
+                'conversation_id': entry.conversation_id,
+            }
+            for entry in entries
+        ]
+
+
+typeahead_index = TypeaheadIndex()
@@ -4,19 +4,40 @@ URL patterns for chat API.
 from django.urls import path
 from . import views
 from .views_api_settings import manage_ai_settings, get_configured_providers
+from . import views_analytics, views_profiling, views_usage
 
 urlpatterns = [
     # Conversation endpoints
     path('conversations/', views.ConversationListView.as_view(), name='conversation-list'),
     path('conversations/<int:pk>/', views.ConversationDetailView.as_view(), name='conversation-detail'),
     path('conversations/<int:pk>/end/', views.end_conversation, name='conversation-end'),
+    path('conversations/<int:pk>/duplicates/', views.conversation_duplicates, name='conversation-duplicates'),
     
     # Message endpoints
     path('messages/send/', views.send_message, name='message-send'),
+    path('messages/<int:pk>/resume/', views.resume_message, name='message-resume'),
     
     # Intelligence endpoints
     path('intelligence/query/', views.query_intelligence, name='intelligence-query'),
     path('conversations/search/', views.search_conversations, name='conversation-search'),
+    path('conversations/autocomplete/', views.autocomplete_conversations, name='conversation-autocomplete'),
+    
+    # Analytics endpoints
+    path('analytics/daily/', views_analytics.daily_stats, name='analytics-daily'),
+    path('analytics/topics/', views_analytics.topic_stats, name='analytics-topics'),
+    path('analytics/summary/', views_analytics.summary_stats, name='analytics-summary'),
+    path('analytics/cache/', views_analytics.cache_stats, name='analytics-cache'),
+    
+    # Token usage endpoints
+    path('usage/daily/', views_usage.usage_by_day, name='usage-daily'),
+    path('usage/providers/', views_usage.usage_by_provider, name='usage-providers'),
+    path('usage/conversations/', views_usage.usage_by_conversation, name='usage-conversations'),
+    path('usage/conversations/<int:pk>/', views_usage.conversation_usage, name='usage-conversation'),
+    
+    # Request profiling endpoints (admin only)
+    path('profiles/', views_profiling.profile_list, name='profile-list'),
+    path('profiles/<int:pk>/', views_profiling.profile_detail, name='profile-detail'),
+    path('profiles/<int:pk>/download/', views_profiling.profile_download, name='profile-download'),
     
     # AI Settings endpoint
     path('settings/ai/', manage_ai_settings, name='ai-settings'),
@@ -0,0 +1,87 @@
+"""
+Token usage and cost accounting, and per-conversation token budgets.
+"""
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import AIUsage, Conversation, Message
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    """Cost of a call from the per-1k-token prices in settings.AI_MODEL_PRICES (0 if unknown)."""
+    prices = settings.AI_MODEL_PRICES.get(model)
+    if not prices:
+        return 0.0
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (
+        uncached * prices.get('prompt', 0)
+        + cached_tokens * prices.get('cached', prices.get('prompt', 0))
+        + completion_tokens * prices.get('completion', 0)
+    ) / 1000
+
+
+def record_usage(ai_service, conversation: Optional[Conversation] = None,
+                 message: Optional[Message] = None) -> List[AIUsage]:
+    """
+    Persist the calls recorded by an AIService since the last call and
+    clear its usage log.
+    """
+    records = [
+        AIUsage(
+            conversation=conversation,
+            message=message if call['purpose'] == 'chat' else None,
+            purpose=call['purpose'],
+            provider=call['provider'],
+            model=call['model'],
+            prompt_tokens=call['prompt_tokens'],
+            completion_tokens=call['completion_tokens'],
+            cached_tokens=call['cached_tokens'],
+            latency_ms=call['latency_ms'],
+            routing=call.get('routing') or {},
+            cost=estimate_cost(
+                call['model'], call['prompt_tokens'], call['completion_tokens'], call['cached_tokens']
+            ),
+        )
+        for call in list(ai_service.usage)
+    ]
+    ai_service.usage.clear()
+    if records:
+        AIUsage.objects.bulk_create(records)
+    return records
+
+
+def conversation_tokens(conversation: Conversation) -> int:
+    """Total prompt and completion tokens spent on a conversation so far."""
+    totals = AIUsage.objects.filter(conversation=conversation).aggregate(
+        prompt=Sum('prompt_tokens'),
+        completion=Sum('completion_tokens')
+    )
+    return (totals['prompt'] or 0) + (totals['completion'] or 0)
+
+
+def token_budget(conversation: Conversation) -> int:
+    """The conversation's token budget (metadata override or the global default, 0 = unlimited)."""
+    return int(conversation.metadata.get('token_budget') or settings.CONVERSATION_TOKEN_BUDGET or 0)
+
+
+def apply_budget(conversation: Conversation, ai_service, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Once a conversation has spent its token budget, switch to the cheaper
+    fallback model (if configured) and truncate the prompt to the system
+    message plus the last BUDGET_CONTEXT_MESSAGES messages.
+
+    Returns:
+        The (possibly truncated) prompt messages
+    """
+    budget = token_budget(conversation)
+    if not budget or conversation_tokens(conversation) < budget:
+        return messages
+
+    if settings.BUDGET_FALLBACK_MODEL and ai_service.model != settings.BUDGET_FALLBACK_MODEL:
+        ai_service.use_model(settings.BUDGET_FALLBACK_MODEL)
+
+    system = [m for m in messages[:1] if m['role'] == 'system']
+    history = messages[len(system):]
+    return system + history[-settings.BUDGET_CONTEXT_MESSAGES:]
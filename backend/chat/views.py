@@ -4,8 +4,15 @@ API views for chat functionality.
 from rest_framework import status, generics
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.db.models import Q
+from datetime import date, timedelta
+import asyncio
+from asgiref.sync import sync_to_async
 
 from .models import Conversation, Message
 from .serializers import (
@@ -16,12 +23,37 @@ from .serializers import (
     MessageCreateSerializer
 )
 from .ai_service import AIService
+from . import caching, dedup, services, summary_index, usage
+from .fast_serializers import (
+    FastJSONResponse,
+    dumps,
+    conversation_list_rows,
+    serialize_conversation_detail,
+    serialize_conversation_list
+)
+from .archive import search_archives
+from .topics import update_corpus
+from .db_router import replica_reads, use_primary as db_use_primary
+from .idempotency import idempotent
+from .deadlines import CLIENT_CLOSED_REQUEST, DeadlineExceeded, RequestCancelled
+from .summarization import SummaryError
+from .typeahead import typeahead_index
+from .views_analytics import int_param
 
 
+@method_decorator(
+    condition(etag_func=caching.list_etag),
+    name='get'
+)
 class ConversationListView(generics.ListCreateAPIView):
     """
     GET: List all conversations with basic metadata
     POST: Create a new conversation
+    
+    GET supports conditional requests (ETag), serves cached payloads until
+    any conversation is written (both checked against the write generation,
+    a single primary-key lookup) and otherwise builds the response through the fast
+    serialization path.
     """
     queryset = Conversation.objects.all()
     
@@ -30,23 +62,49 @@ class ConversationListView(generics.ListCreateAPIView):
             return ConversationCreateSerializer
         return ConversationListSerializer
     
+    def list(self, request, *args, **kwargs):
+        state = caching.list_state(request)
+        data = caching.get_list_payload(state)
+        if data is None:
+            rows = self.paginate_queryset(conversation_list_rows(self.get_queryset()))
+            data = self.get_paginated_response(serialize_conversation_list(rows)).data
+            caching.set_list_payload(state, data)
+        return FastJSONResponse(data)
+    
     def perform_create(self, serializer):
         """Create a new conversation with auto-generated title if needed."""
         conversation = serializer.save()
         if not conversation.title:
             conversation.title = f"Conversation {conversation.id}"
             conversation.save()
+        services.conversation_created(conversation)
 
 
+@method_decorator(
+    condition(etag_func=caching.detail_etag, last_modified_func=caching.detail_last_modified),
+    name='get'
+)
 class ConversationDetailView(generics.RetrieveAPIView):
     """
     GET: Retrieve detailed conversation including all messages
+    
+    Supports conditional requests (ETag / Last-Modified); the payload is
+    built through the fast serialization path and cached per conversation version.
     """
     queryset = Conversation.objects.all()
     serializer_class = ConversationDetailSerializer
+    
+    def retrieve(self, request, *args, **kwargs):
+        conversation = self.get_object()
+        data = caching.get_detail_payload(conversation)
+        if data is None:
+            data = serialize_conversation_detail(conversation)
+            caching.set_detail_payload(conversation, data)
+        return FastJSONResponse(data)
 
 
 @api_view(['POST'])
+@idempotent
 def send_message(request):
     """
     POST: Send a message and get AI response
@@ -93,40 +151,44 @@ def send_message(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Create user message
-    user_message = Message.objects.create(
-        conversation=conversation,
-        content=content,
-        sender='user'
-    )
+    # Create user message, unless a retry of a timed-out request already did
+    resumed = getattr(request, 'idempotency_resume', None) or {}
+    user_message = Message.objects.filter(
+        id=resumed.get('user_message_id'), conversation=conversation, sender='user'
+    ).first() if resumed else None
+    if user_message is None:
+        user_message = services.create_message(conversation, 'user', content)
     
     # Prepare conversation history for AI
-    previous_messages = Message.objects.filter(conversation=conversation).order_by('timestamp')
-    messages_for_ai = []
-    
-    # Add system message
-    messages_for_ai.append({
-        "role": "system",
-        "content": "You are a helpful, friendly AI assistant. Provide clear and concise responses."
-    })
-    
-    # Add conversation history
-    for msg in previous_messages:
-        messages_for_ai.append({
-            "role": "user" if msg.sender == "user" else "assistant",
-            "content": msg.content
-        })
-    
-    # Generate AI response
+    messages_for_ai = services.get_prompt_history(conversation)
+    
+    # Generate AI response (model and max_tokens routed by turn complexity,
+    # cheaper model / shorter context once over budget)
     ai_service = AIService(provider=provider)
-    ai_response = ai_service.generate_response(messages_for_ai)
+    ai_service.deadline = getattr(request, 'deadline', None)
+    ai_service.route(messages_for_ai)
+    messages_for_ai = usage.apply_budget(conversation, ai_service, messages_for_ai)
+    try:
+        ai_response = ai_service.generate_response(messages_for_ai)
+    except RequestCancelled:
+        # Nobody is waiting for the reply: don't save it
+        usage.record_usage(ai_service, conversation)
+        response = Response({"error": "Client disconnected"}, status=CLIENT_CLOSED_REQUEST)
+        response.idempotency_resume = {'user_message_id': user_message.id}
+        return response
+    except DeadlineExceeded:
+        usage.record_usage(ai_service, conversation)
+        response = Response({
+            "error": "The AI response did not complete within the request deadline",
+            "user_message": MessageSerializer(user_message).data
+        }, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        # A retry with the same Idempotency-Key answers this user message instead of saving it again
+        response.idempotency_resume = {'user_message_id': user_message.id}
+        return response
     
     # Create AI message
-    ai_message = Message.objects.create(
-        conversation=conversation,
-        content=ai_response,
-        sender='ai'
-    )
+    ai_message = services.create_message(conversation, 'ai', ai_response)
+    usage.record_usage(ai_service, conversation, ai_message)
     
     return Response({
         "user_message": MessageSerializer(user_message).data,
@@ -134,7 +196,61 @@ def send_message(request):
     }, status=status.HTTP_201_CREATED)
 
 
+@api_view(['GET'])
+def resume_message(request, pk):
+    """
+    GET: Resume a streamed AI reply after a dropped connection
+    
+    Query params:
+    - offset: number of characters of the reply the client already has
+    
+    Streams newline-delimited JSON: {"offset": int, "delta": str} lines as
+    the reply grows (it may be generated by another worker), then
+    {"status": str, "message": Message}. The status is 'complete',
+    'interrupted' or 'discarded' (message null); 'streaming' means the
+    request deadline ran out first and the client should resume again.
+    """
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        return Response(
+            {"error": "offset must be an integer"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    with db_use_primary():
+        if not Message.objects.filter(id=pk, sender='ai').exists():
+            return Response(
+                {"error": "Message not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+    deadline = getattr(request, 'deadline', None)
+    
+    def poll(offset):
+        # Progress is written to the primary; a replica may lag behind it
+        with db_use_primary():
+            message, delta, state = services.stream_progress(pk, offset)
+        done = state != 'streaming' or (deadline is not None and (deadline.expired or deadline.cancelled))
+        data = MessageSerializer(message).data if done and message is not None else None
+        return delta, state, done, data
+    
+    async def follow(offset):
+        # Asynchronous, so under ASGI each line is sent as it is produced and
+        # waiting between polls holds no thread
+        while True:
+            delta, state, done, data = await sync_to_async(poll)(offset)
+            if delta:
+                yield dumps({"offset": offset, "delta": delta}) + b'\n'
+                offset += len(delta)
+            if done:
+                yield dumps({"status": state, "message": data}) + b'\n'
+                return
+            await asyncio.sleep(settings.STREAM_RESUME_POLL_SECONDS)
+    
+    return StreamingHttpResponse(follow(offset), content_type='application/x-ndjson')
+
+
 @api_view(['POST'])
+@idempotent
 def end_conversation(request, pk):
     """
     POST: End a conversation and generate summary
@@ -171,26 +287,41 @@ def end_conversation(request, pk):
     ]
     
     ai_service = AIService()
-    summary = ai_service.generate_summary(conversation_history)
+    try:
+        summary = ai_service.generate_summary(conversation_history, conversation.id)
+        summary_error = None
+    except SummaryError as e:
+        # Left empty rather than storing the error; backfill_summaries retries it
+        summary = None
+        summary_error = str(e)
     conversation.ai_summary = summary
     
-    # Extract and store metadata
+    # Extract and store metadata (topics are extracted locally, see chat.topics)
     topics = ai_service.extract_key_topics(conversation_history)
+    update_corpus(msg['content'] for msg in conversation_history)
     conversation.metadata = {
         **conversation.metadata,
         'topics': topics,
         'message_count': len(conversation_history),
-        'duration_seconds': conversation.get_duration()
+        'duration_seconds': conversation.get_duration(),
     }
+    if summary is not None:
+        conversation.metadata['summary_model'] = ai_service.model
     
     conversation.save()
+    services.conversation_ended(conversation)
+    usage.record_usage(ai_service, conversation)
     
-    return Response({
+    data = {
         "conversation": ConversationDetailSerializer(conversation).data,
         "summary": summary
-    }, status=status.HTTP_200_OK)
+    }
+    if summary_error:
+        data["summary_error"] = summary_error
+    return Response(data, status=status.HTTP_200_OK)
 
 
+@replica_reads
 @api_view(['POST'])
 def query_intelligence(request):
     """
@@ -199,13 +330,21 @@ def query_intelligence(request):
     Request body:
     {
         "query": str,
-        "search_keywords": str (optional)
+        "search_keywords": str (optional),
+        "start_date": "YYYY-MM-DD" (optional),
+        "end_date": "YYYY-MM-DD" (optional, inclusive)
     }
     
+    Questions about a time range (given by the dates, or in the query such
+    as "last quarter") are answered from the summary index, unless keywords
+    are given: the index holds whole periods, so keyword questions read the
+    matching conversations of the range instead.
+    
     Returns:
     {
         "answer": str,
-        "relevant_conversations": List[Conversation]
+        "relevant_conversations": List[Conversation],
+        "periods": List[dict] (time-range questions only)
     }
     """
     query = request.data.get('query')
@@ -217,39 +356,106 @@ def query_intelligence(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    try:
+        time_range = _requested_time_range(request.data)
+    except ValueError:
+        return Response(
+            {"error": "start_date and end_date must be dates in YYYY-MM-DD format"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if time_range is None:
+        time_range = summary_index.parse_time_range(query)
+    if time_range is not None and not search_keywords:
+        return _query_time_range(request, query, *time_range)
+    
     # Get relevant conversations
     conversations = Conversation.objects.filter(status='ended')
+    if time_range is not None:
+        first, last = summary_index.day_bounds(*time_range)
+        conversations = conversations.filter(end_timestamp__gte=first, end_timestamp__lt=last)
     
     # Apply keyword filter if provided
     if search_keywords:
-        conversations = conversations.filter(
-            Q(title__icontains=search_keywords) |
-            Q(ai_summary__icontains=search_keywords) |
-            Q(messages__content__icontains=search_keywords)
-        ).distinct()
-    
-    # Prepare conversation data for AI
-    conversations_data = []
-    for conv in conversations[:10]:  # Limit to 10 most recent
-        messages = Message.objects.filter(conversation=conv).order_by('timestamp')
-        conversations_data.append({
+        conversations = _keyword_filter(conversations, search_keywords)
+    
+    # Prepare conversation data for AI (10 most recent, near-duplicates dropped so
+    # repeated conversations do not crowd out the rest; messages in one query)
+    candidates = list(conversations.select_related('archive')[:30])
+    kept, _ = dedup.collapse([conv.id for conv in candidates])
+    kept = set(kept)
+    recent = [conv for conv in candidates if conv.id in kept][:10]
+    histories = services.load_histories(recent)
+    conversations_data = [
+        {
             'id': conv.id,
             'title': conv.title,
             'start_timestamp': conv.start_timestamp.isoformat(),
             'ai_summary': conv.ai_summary,
-            'messages': [
-                {'sender': msg.sender, 'content': msg.content}
-                for msg in messages
-            ]
-        })
+            'messages': histories.get(conv.id, [])
+        }
+        for conv in recent
+    ]
     
     # Get AI response
     ai_service = AIService()
-    answer = ai_service.query_conversations(query, conversations_data)
+    ai_service.deadline = getattr(request, 'deadline', None)
+    try:
+        answer = ai_service.query_conversations(query, conversations_data)
+    except DeadlineExceeded:
+        usage.record_usage(ai_service)
+        return Response(
+            {"error": "The AI response did not complete within the request deadline"},
+            status=status.HTTP_504_GATEWAY_TIMEOUT
+        )
+    usage.record_usage(ai_service)
+    
+    return Response({
+        "answer": answer,
+        "relevant_conversations": _conversation_list(
+            conversations.filter(id__in=[conv.id for conv in recent[:5]])
+        )
+    }, status=status.HTTP_200_OK)
+
+
+def _requested_time_range(data):
+    """(start, exclusive end) from the start_date/end_date fields, or None if neither is given."""
+    start, end = data.get('start_date'), data.get('end_date')
+    if not start and not end:
+        return None
+    today = timezone.localdate()
+    start = date.fromisoformat(start) if start else summary_index.first_day() or today
+    end = date.fromisoformat(end) if end else today
+    return start, end + timedelta(days=1)
+
+
+def _query_time_range(request, query, start, end):
+    """Answer a question about [start, end) from the fewest summary index nodes covering it."""
+    ai_service = AIService()
+    ai_service.deadline = getattr(request, 'deadline', None)
+    try:
+        nodes = summary_index.nodes_for_range(start, end)
+        periods = [summary_index.node_data(node) for node in nodes]
+        if nodes:
+            answer = ai_service.query_periods(query, periods, summary_index.topic_totals(nodes))
+        else:
+            last_day = end - timedelta(days=1)
+            answer = f"No conversations ended between {start.isoformat()} and {last_day.isoformat()}."
+    except DeadlineExceeded:
+        usage.record_usage(ai_service)
+        return Response(
+            {"error": "The AI response did not complete within the request deadline"},
+            status=status.HTTP_504_GATEWAY_TIMEOUT
+        )
+    usage.record_usage(ai_service)
     
+    first, last = summary_index.day_bounds(start, end)
+    conversations = Conversation.objects.filter(
+        status='ended', end_timestamp__gte=first, end_timestamp__lt=last
+    ).order_by('-end_timestamp')
     return Response({
         "answer": answer,
-        "relevant_conversations": ConversationListSerializer(conversations[:5], many=True).data
+        "relevant_conversations": _conversation_list(conversations, limit=5),
+        "periods": periods
     }, status=status.HTTP_200_OK)
 
 
@@ -261,14 +467,21 @@ def search_conversations(request):
     Query params:
     - q: search query
     - semantic: use semantic search (true/false)
+    - dedupe: drop near-duplicates of better-ranked results (default true)
+    
+    Responses are cached per normalized query and mode until the next write
+    to any conversation, in any worker (the key includes the write generation
+    kept in the database; see caching.bump_write_generation).
     
     Returns:
     {
-        "results": List[Conversation]
+        "results": List[Conversation],
+        "duplicates": {conversation id: [ids of its dropped near-duplicates]}
     }
     """
-    query = request.GET.get('q', '')
+    query = caching.normalize_query(request.GET.get('q', ''))
     use_semantic = request.GET.get('semantic', 'false').lower() == 'true'
+    dedupe = request.GET.get('dedupe', 'true').lower() == 'true'
     
     if not query:
         return Response(
@@ -276,38 +489,126 @@ def search_conversations(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    # Read the generation first: a write during the search then leaves the
+    # result under a generation that is already stale
+    generation = caching.write_generation()
+    mode = f"{'semantic' if use_semantic else 'keyword'}{'-dedupe' if dedupe else ''}"
+    cached = caching.get_search_payload(generation, mode, query)
+    if cached is not None:
+        return FastJSONResponse(cached)
+    
     conversations = Conversation.objects.all()
     
     if use_semantic:
-        # Semantic search using AI
-        conversations_data = []
-        for conv in conversations:
-            messages = Message.objects.filter(conversation=conv).order_by('timestamp')
-            conversations_data.append({
+        # Semantic search using AI (all messages in one query)
+        candidates = list(conversations.select_related('archive'))
+        histories = services.load_histories(candidates)
+        conversations_data = [
+            {
                 'id': conv.id,
                 'title': conv.title,
                 'ai_summary': conv.ai_summary,
-                'messages': [
-                    {'sender': msg.sender, 'content': msg.content}
-                    for msg in messages
-                ]
-            })
+                'messages': histories.get(conv.id, [])
+            }
+            for conv in candidates
+        ]
         
         ai_service = AIService()
         results = ai_service.semantic_search(query, conversations_data)
+        usage.record_usage(ai_service)
         
-        # Get conversation objects
-        result_ids = [r['id'] for r in results]
-        conversations = Conversation.objects.filter(id__in=result_ids)
+        # Serialize the matches in relevance order
+        rank = {r['id']: index for index, r in enumerate(results)}
+        data = _conversation_list(Conversation.objects.filter(id__in=rank))
+        data.sort(key=lambda row: rank[row['id']])
         
     else:
         # Keyword search
-        conversations = conversations.filter(
-            Q(title__icontains=query) |
-            Q(ai_summary__icontains=query) |
-            Q(messages__content__icontains=query)
-        ).distinct()
+        data = _conversation_list(_keyword_filter(conversations, query))
+    
+    duplicates = {}
+    if dedupe:
+        kept, duplicates = dedup.collapse([row['id'] for row in data])
+        kept = set(kept)
+        data = [row for row in data if row['id'] in kept]
+    
+    payload = {
+        "results": data,
+        # JSON object keys are strings, in the cached payload too
+        "duplicates": {str(conversation_id): ids for conversation_id, ids in duplicates.items()}
+    }
+    caching.set_search_payload(generation, mode, query, payload)
+    return FastJSONResponse(payload)
+
+
+@api_view(['GET'])
+def conversation_duplicates(request, pk):
+    """
+    GET: Near-duplicates of a conversation, most similar first
     
-    return Response({
-        "results": ConversationListSerializer(conversations, many=True).data
-    }, status=status.HTTP_200_OK)
+    Returns:
+    {
+        "duplicates": List[Conversation with "similarity"]
+    }
+    """
+    if not Conversation.objects.filter(pk=pk).exists():
+        return Response(
+            {"error": "Conversation not found"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    similar = dict(dedup.find_similar(pk))
+    data = _conversation_list(Conversation.objects.filter(id__in=similar))
+    for row in data:
+        row['similarity'] = round(similar[row['id']], 3)
+    data.sort(key=lambda row: -row['similarity'])
+    return Response({"duplicates": data}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def autocomplete_conversations(request):
+    """
+    GET: Title and topic suggestions for a search box, from the in-memory
+    typeahead index (no database queries once the index is built)
+    
+    Query params:
+    - q: prefix typed so far; matches the start of any word
+    - limit: number of suggestions (default 8, max 50)
+    - kind: only 'title' or only 'topic' suggestions (optional)
+    
+    Returns:
+    {
+        "suggestions": [{"text", "kind", "count", "last_seen", "conversation_id"}]
+    }
+    """
+    kind = request.GET.get('kind') or None
+    if kind not in (None, 'title', 'topic'):
+        return Response(
+            {"error": "kind must be 'title' or 'topic'"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    suggestions = typeahead_index.suggest(
+        request.GET.get('q', ''), limit=int_param(request, 'limit', 8, 50), kind=kind
+    )
+    return FastJSONResponse({"suggestions": suggestions})
+
+
+def _conversation_list(conversations, limit=None):
+    """ConversationListSerializer output for a queryset, message counts included, in one query."""
+    rows = conversation_list_rows(conversations)
+    return serialize_conversation_list(rows[:limit] if limit else rows)
+
+
+def _keyword_filter(conversations, keywords):
+    """
+    Filter conversations by keyword in title, summary or message content,
+    including messages held in compressed archives.
+    """
+    matched = conversations.filter(
+        Q(title__icontains=keywords) |
+        Q(ai_summary__icontains=keywords) |
+        Q(messages__content__icontains=keywords)
+    ).distinct()
+    matched_ids = list(matched.values_list('id', flat=True))
+    archived_ids = search_archives(keywords, exclude_ids=matched_ids)
+    # Filtering by id drops the message join, so annotations count all messages
+    return conversations.filter(id__in=matched_ids + archived_ids)
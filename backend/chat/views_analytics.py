@@ -0,0 +1,136 @@
+"""
+Read-only analytics API backed by the incrementally maintained rollup tables,
+and cache metrics.
+"""
+from datetime import timedelta
+
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import caching
+from .models import DailyStats, TopicCount
+
+
+def int_param(request, name, default, maximum):
+    try:
+        value = int(request.GET.get(name, default))
+    except (TypeError, ValueError):
+        value = default
+    return max(1, min(value, maximum))
+
+
+@api_view(['GET'])
+def daily_stats(request):
+    """
+    GET: Per-day conversation counts, durations and message volume by sender
+    
+    Query params:
+    - days: number of days to return, most recent first (default 30, max 366)
+    
+    Returns:
+    {
+        "days": [{"date", "conversations_started", "conversations_ended",
+                  "average_duration_seconds", "user_messages", "ai_messages"}]
+    }
+    """
+    days = int_param(request, 'days', 30, 366)
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rows = DailyStats.objects.filter(date__gte=since)
+    
+    return Response({
+        "days": [
+            {
+                'date': row.date.isoformat(),
+                'conversations_started': row.conversations_started,
+                'conversations_ended': row.conversations_ended,
+                'average_duration_seconds': row.get_average_duration(),
+                'user_messages': row.user_messages,
+                'ai_messages': row.ai_messages,
+            }
+            for row in rows
+        ]
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def topic_stats(request):
+    """
+    GET: Most frequent conversation topics
+    
+    Query params:
+    - limit: number of topics to return (default 20, max 200)
+    
+    Returns:
+    {
+        "topics": [{"topic", "count", "last_seen"}]
+    }
+    """
+    limit = int_param(request, 'limit', 20, 200)
+    rows = TopicCount.objects.all()[:limit]
+    
+    return Response({
+        "topics": [
+            {
+                'topic': row.topic,
+                'count': row.count,
+                'last_seen': row.last_seen.isoformat() if row.last_seen else None,
+            }
+            for row in rows
+        ]
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def summary_stats(request):
+    """
+    GET: Totals over a time window
+    
+    Query params:
+    - days: size of the window (default 30, max 3660)
+    
+    Returns:
+    {
+        "conversations_started": int,
+        "conversations_ended": int,
+        "average_duration_seconds": float,
+        "messages_by_sender": {"user": int, "ai": int}
+    }
+    """
+    days = int_param(request, 'days', 30, 3660)
+    since = timezone.localdate() - timedelta(days=days - 1)
+    totals = DailyStats.objects.filter(date__gte=since).aggregate(
+        conversations_started=Sum('conversations_started'),
+        conversations_ended=Sum('conversations_ended'),
+        total_duration_seconds=Sum('total_duration_seconds'),
+        user_messages=Sum('user_messages'),
+        ai_messages=Sum('ai_messages'),
+    )
+    ended = totals['conversations_ended'] or 0
+    
+    return Response({
+        "conversations_started": totals['conversations_started'] or 0,
+        "conversations_ended": ended,
+        "average_duration_seconds": (totals['total_duration_seconds'] or 0) / ended if ended else 0.0,
+        "messages_by_sender": {
+            'user': totals['user_messages'] or 0,
+            'ai': totals['ai_messages'] or 0,
+        }
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def cache_stats(request):
+    """
+    GET: Hit rate of the search result cache across all workers
+    
+    Returns:
+    {
+        "search": {"hits": int, "misses": int, "hit_rate": float or null, "write_generation": int}
+    }
+    """
+    return Response({
+        "search": caching.search_cache_stats()
+    }, status=status.HTTP_200_OK)
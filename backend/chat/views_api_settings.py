@@ -4,8 +4,7 @@ API endpoint for managing AI provider settings from the frontend.
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from django.conf import settings
-import os
+from .settings_store import ai_settings
 
 
 @api_view(['GET'])
@@ -23,6 +22,7 @@ def get_configured_providers(request):
         "current_provider": "openai"
     }
     """
+    settings = ai_settings.snapshot()
     configured_providers = []
     
     # Check which providers have API keys configured
@@ -67,14 +67,17 @@ def manage_ai_settings(request):
     GET: Get current AI provider settings
     POST: Update AI provider settings
     
+    Settings are persisted and versioned, so every worker picks up a change
+    on its next version check without a restart.
+    
     Note: This is a basic implementation. In production, you should:
     1. Add authentication and authorization
-    2. Store settings in database per user
-    3. Encrypt sensitive data like API keys
-    4. Validate settings before applying
+    2. Encrypt sensitive data like API keys
+    3. Validate settings before applying
     """
     
     if request.method == 'GET':
+        settings = ai_settings.snapshot()
         # Return current settings (without exposing full API keys)
         current_settings = {
             'provider': settings.AI_PROVIDER,
@@ -105,38 +108,28 @@ def manage_ai_settings(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Update environment variables (temporary - in production, use database)
-        # Note: These changes only affect the current process
-        os.environ['AI_PROVIDER'] = provider
-        settings.AI_PROVIDER = provider
-        
-        if 'model' in api_settings:
-            os.environ['AI_MODEL'] = api_settings['model']
-            settings.AI_MODEL = api_settings['model']
+        # Persist the new settings; other workers pick them up on their next version check
+        updates = {'AI_PROVIDER': provider, 'AI_MODEL': api_settings.get('model')}
         
         if 'apiKey' in api_settings:
-            if provider == 'openai':
-                os.environ['OPENAI_API_KEY'] = api_settings['apiKey']
-                settings.OPENAI_API_KEY = api_settings['apiKey']
-            elif provider == 'anthropic':
-                os.environ['ANTHROPIC_API_KEY'] = api_settings['apiKey']
-                settings.ANTHROPIC_API_KEY = api_settings['apiKey']
-            elif provider == 'google':
-                os.environ['GOOGLE_API_KEY'] = api_settings['apiKey']
-                settings.GOOGLE_API_KEY = api_settings['apiKey']
-            elif provider == 'lmstudio':
-                os.environ['LM_STUDIO_API_KEY'] = api_settings['apiKey']
-                settings.LM_STUDIO_API_KEY = api_settings['apiKey']
+            key_setting = {
+                'openai': 'OPENAI_API_KEY',
+                'anthropic': 'ANTHROPIC_API_KEY',
+                'google': 'GOOGLE_API_KEY',
+                'lmstudio': 'LM_STUDIO_API_KEY',
+            }[provider]
+            updates[key_setting] = api_settings['apiKey']
         
         if 'baseUrl' in api_settings and provider == 'lmstudio':
-            os.environ['LM_STUDIO_BASE_URL'] = api_settings['baseUrl']
-            settings.LM_STUDIO_BASE_URL = api_settings['baseUrl']
+            updates['LM_STUDIO_BASE_URL'] = api_settings['baseUrl']
+        
+        version = ai_settings.update(**updates)
         
         return Response(
             {
                 "message": "Settings updated successfully",
                 "provider": provider,
-                "note": "Settings are temporary and will reset on server restart. For persistent settings, configure environment variables or use a database."
+                "version": version
             },
             status=status.HTTP_200_OK
         )
@@ -0,0 +1,76 @@
+"""
+Admin-only endpoints for the request profiles stored by chat.profiling.
+"""
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from .models import RequestProfile
+from .profiling import top_functions
+from .views_analytics import int_param
+
+FIELDS = [
+    'id', 'method', 'path', 'view_name', 'status_code', 'duration_ms',
+    'query_count', 'query_ms', 'sections', 'trigger', 'created_at',
+]
+
+
+def _profile_dict(profile):
+    return {field: getattr(profile, field) for field in FIELDS}
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_list(request):
+    """
+    GET: Stored request profiles, newest first
+    
+    Query params:
+    - path: only profiles whose path contains this text
+    - min_ms: only profiles at least this slow
+    - limit: number of profiles (default 50, max 500)
+    """
+    profiles = RequestProfile.objects.defer('stats')
+    if request.GET.get('path'):
+        profiles = profiles.filter(path__contains=request.GET['path'])
+    if request.GET.get('min_ms'):
+        try:
+            profiles = profiles.filter(duration_ms__gte=float(request.GET['min_ms']))
+        except ValueError:
+            return Response({"error": "min_ms must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+    limit = int_param(request, 'limit', 50, 500)
+    return Response([_profile_dict(profile) for profile in profiles[:limit]])
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_detail(request, pk):
+    """
+    GET: One profile with its most expensive functions by cumulative time
+    
+    Query params:
+    - limit: number of functions (default 30, max 200)
+    """
+    try:
+        profile = RequestProfile.objects.get(id=pk)
+    except RequestProfile.DoesNotExist:
+        return Response({"error": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        **_profile_dict(profile),
+        'top_functions': top_functions(profile, int_param(request, 'limit', 30, 200)),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_download(request, pk):
+    """GET: The raw cProfile stats, for pstats, snakeviz or similar tools"""
+    try:
+        profile = RequestProfile.objects.get(id=pk)
+    except RequestProfile.DoesNotExist:
+        return Response({"error": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)
+    response = HttpResponse(bytes(profile.stats), content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="profile-{profile.id}.prof"'
+    return response
@@ -0,0 +1,118 @@
+"""
+Read-only token usage and cost endpoints.
+"""
+from datetime import timedelta
+
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import AIUsage, Conversation
+from .usage import token_budget
+from .views_analytics import int_param
+
+TOTALS = {
+    'calls': Count('id'),
+    'prompt_tokens': Sum('prompt_tokens'),
+    'completion_tokens': Sum('completion_tokens'),
+    'cached_tokens': Sum('cached_tokens'),
+    'cost': Sum('cost'),
+}
+
+
+def _window(request):
+    days = int_param(request, 'days', 30, 366)
+    return AIUsage.objects.filter(created_at__gte=timezone.now() - timedelta(days=days))
+
+
+def _clean(row):
+    """Replace NULL sums with zeros."""
+    return {key: (0 if value is None else value) for key, value in row.items()}
+
+
+@api_view(['GET'])
+def usage_by_day(request):
+    """
+    GET: Token usage and cost per day
+    
+    Query params:
+    - days: window size (default 30)
+    """
+    rows = (_window(request).annotate(date=TruncDate('created_at'))
+            .values('date').annotate(**TOTALS).order_by('-date'))
+    return Response({
+        "days": [{**_clean(row), 'date': row['date'].isoformat()} for row in rows]
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def usage_by_provider(request):
+    """
+    GET: Token usage and cost per provider and model
+    
+    Query params:
+    - days: window size (default 30)
+    """
+    rows = _window(request).values('provider', 'model').annotate(**TOTALS).order_by('-cost', '-prompt_tokens')
+    return Response({"providers": [_clean(row) for row in rows]}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def usage_by_conversation(request):
+    """
+    GET: Most expensive conversations by total tokens
+    
+    Query params:
+    - days: window size (default 30)
+    - limit: number of conversations (default 20, max 200)
+    """
+    limit = int_param(request, 'limit', 20, 200)
+    rows = (_window(request).filter(conversation__isnull=False)
+            .values('conversation', 'conversation__title')
+            # Summed before TOTALS, whose aggregates shadow the prompt/completion fields
+            .annotate(total_tokens=Sum(F('prompt_tokens') + F('completion_tokens')))
+            .annotate(**TOTALS)
+            .order_by('-total_tokens')[:limit])
+    return Response({"conversations": [_clean(row) for row in rows]}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def conversation_usage(request, pk):
+    """
+    GET: Usage of one conversation: totals, budget and the per-call series.
+    
+    The per-call prompt_tokens series shows whether cost grows with every turn.
+    """
+    try:
+        conversation = Conversation.objects.get(id=pk)
+    except Conversation.DoesNotExist:
+        return Response(
+            {"error": "Conversation not found"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    calls = AIUsage.objects.filter(conversation=conversation).order_by('created_at')
+    totals = _clean(calls.aggregate(**TOTALS))
+    return Response({
+        "conversation_id": conversation.id,
+        "budget": token_budget(conversation),
+        "total_tokens": totals['prompt_tokens'] + totals['completion_tokens'],
+        **totals,
+        "calls": [
+            {
+                'created_at': call.created_at.isoformat(),
+                'purpose': call.purpose,
+                'provider': call.provider,
+                'model': call.model,
+                'prompt_tokens': call.prompt_tokens,
+                'completion_tokens': call.completion_tokens,
+                'cached_tokens': call.cached_tokens,
+                'cost': call.cost,
+                'latency_ms': call.latency_ms,
+            }
+            for call in calls
+        ]
+    }, status=status.HTTP_200_OK)
@@ -0,0 +1,409 @@
+"""
+WebSocket chat channel for persistent conversations.
+
+One socket can carry several conversations. For each opened conversation the
+Conversation row, its prompt history and an AIService client are loaded once
+and kept warm for the life of the connection, so a chat turn only costs the
+message writes and the upstream LLM call. Responses are streamed back token
+by token and can be cancelled mid-generation. Each generation has a
+STREAM_DEADLINE_SECONDS deadline; text of a cancelled or timed-out generation
+is kept only under PARTIAL_OUTPUT_POLICY = 'save' (sent with "partial": true).
+
+The AI reply is written to its Message row (status "streaming") at least
+every STREAM_PERSIST_INTERVAL seconds while it streams. A generation is not
+stopped when the socket drops: it runs to completion, and the client
+reconnects and sends "resume" with the message id and the number of
+characters it already has to receive the rest of the same reply, from any
+worker. Token frames carry the offset of their delta.
+
+Protocol (JSON text frames, every frame names its conversation_id):
+
+    -> {"type": "open", "conversation_id": 1, "provider": "openai"}
+    <- {"type": "opened", "conversation_id": 1, "message_count": 4}
+    -> {"type": "message", "conversation_id": 1, "content": "Hi"}
+    <- {"type": "user_message", "conversation_id": 1, "message": {...}}
+    <- {"type": "ai_message_started", "conversation_id": 1, "message": {"id": 7, ...}}
+    <- {"type": "token", "conversation_id": 1, "message_id": 7, "offset": 0, "delta": "Hel"}
+    <- {"type": "ai_message", "conversation_id": 1, "message": {...}}
+    -> {"type": "resume", "conversation_id": 1, "message_id": 7, "offset": 3}
+    -> {"type": "cancel", "conversation_id": 1}
+    <- {"type": "cancelled", "conversation_id": 1}
+    -> {"type": "close", "conversation_id": 1}
+    <- {"type": "closed", "conversation_id": 1}
+    <- {"type": "error", "conversation_id": 1, "error": "..."}
+"""
+import asyncio
+import json
+import threading
+import time
+from typing import Dict, List
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import db_router, services, usage
+from .ai_service import AIService
+from .deadlines import Deadline, DeadlineExceeded, RequestCancelled, partial_output
+from .models import Conversation
+from .serializers import MessageSerializer
+
+WEBSOCKET_PATH = '/ws/chat/'
+
+_DONE = object()
+# Generations left running by a disconnected socket (kept referenced until done)
+_detached = set()
+
+
+class ConversationSession:
+    """Warm state of one conversation opened on a socket."""
+
+    def __init__(self, conversation: Conversation, history: List[Dict[str, str]], ai_service: AIService):
+        self.conversation = conversation
+        self.history = history
+        self.ai_service = ai_service
+        self.task = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def busy(self):
+        return self.task is not None and not self.task.done()
+
+
+@sync_to_async
+def _open_session(conversation_id, provider):
+    conversation = Conversation.objects.get(id=conversation_id)
+    if conversation.status != 'active':
+        raise ValueError("Cannot send messages to an ended conversation")
+    return ConversationSession(
+        conversation,
+        services.build_prompt_history(conversation),
+        AIService(provider=provider)
+    )
+
+
+@sync_to_async
+def _sync_session(session):
+    """
+    Re-read the conversation's status and version before a turn (one query).
+    If it was changed elsewhere, e.g. a message sent over HTTP, the history
+    is reloaded.
+    """
+    row = Conversation.objects.filter(id=session.conversation.id).values_list('status', 'version').first()
+    if row is None:
+        raise Conversation.DoesNotExist("Conversation not found")
+    status, version = row
+    if status != 'active':
+        raise ValueError("Cannot send messages to an ended conversation")
+    if version != session.conversation.version:
+        session.conversation.version = version
+        session.history = services.get_prompt_history(session.conversation)
+
+
+@sync_to_async
+def _save_message(conversation, sender, content):
+    message = services.create_message(conversation, sender, content)
+    return message, MessageSerializer(message).data
+
+
+@sync_to_async
+def _start_ai_message(conversation):
+    message = services.start_ai_message(conversation)
+    return message, MessageSerializer(message).data
+
+
+@sync_to_async
+def _finish_ai_message(conversation, message, content, ai_service, status='complete'):
+    services.finish_ai_message(conversation, message, content, status)
+    usage.record_usage(ai_service, conversation, message)
+    return MessageSerializer(message).data
+
+
+@sync_to_async
+def _discard_ai_message(conversation, message, ai_service):
+    services.discard_ai_message(conversation, message)
+    usage.record_usage(ai_service, conversation)
+
+
+@sync_to_async
+def _stream_progress(message_id, offset):
+    message, delta, status = services.stream_progress(message_id, offset)
+    if message is None:
+        return delta, status, None
+    return delta, status, MessageSerializer(message).data
+
+
+@sync_to_async
+def _prepare_prompt(conversation, ai_service, messages):
+    ai_service.route(messages)
+    return usage.apply_budget(conversation, ai_service, messages)
+
+
+class ChatConsumer:
+    """Handles the frames of a single WebSocket connection."""
+
+    def __init__(self, send):
+        self._send = send
+        self.sessions: Dict[int, ConversationSession] = {}
+        self.resumes = set()
+        self.closed = False
+
+    async def send_json(self, data):
+        if self.closed:
+            return  # A detached generation keeps running without a socket
+        await self._send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def send_error(self, conversation_id, error):
+        await self.send_json({'type': 'error', 'conversation_id': conversation_id, 'error': error})
+
+    async def receive(self, text):
+        try:
+            data = json.loads(text)
+            frame_type = data['type']
+            conversation_id = int(data['conversation_id'])
+        except (ValueError, TypeError, KeyError):
+            await self.send_error(None, "Frames must be JSON objects with 'type' and 'conversation_id'")
+            return
+
+        handler = getattr(self, f'on_{frame_type}', None)
+        if handler is None:
+            await self.send_error(conversation_id, f"Unknown frame type: {frame_type}")
+            return
+        await handler(conversation_id, data)
+
+    async def on_open(self, conversation_id, data):
+        if conversation_id not in self.sessions:
+            try:
+                self.sessions[conversation_id] = await _open_session(conversation_id, data.get('provider'))
+            except Conversation.DoesNotExist:
+                await self.send_error(conversation_id, "Conversation not found")
+                return
+            except ValueError as e:
+                await self.send_error(conversation_id, str(e))
+                return
+        session = self.sessions[conversation_id]
+        await self.send_json({
+            'type': 'opened',
+            'conversation_id': conversation_id,
+            'message_count': len(session.history) - 1
+        })
+
+    async def on_message(self, conversation_id, data):
+        session = self.sessions.get(conversation_id)
+        content = data.get('content')
+        if session is None:
+            await self.send_error(conversation_id, "Conversation is not open on this socket")
+        elif not content or not str(content).strip():
+            await self.send_error(conversation_id, "content is required")
+        elif session.busy:
+            await self.send_error(conversation_id, "A response is already being generated")
+        else:
+            session.cancel_event = threading.Event()
+            session.task = asyncio.create_task(self._generate(conversation_id, session, content))
+
+    async def on_cancel(self, conversation_id, data):
+        session = self.sessions.get(conversation_id)
+        if session is not None and session.busy:
+            session.cancel_event.set()
+            session.task.cancel()
+        await self.send_json({'type': 'cancelled', 'conversation_id': conversation_id})
+
+    async def on_close(self, conversation_id, data):
+        session = self.sessions.pop(conversation_id, None)
+        if session is not None and session.busy:
+            session.cancel_event.set()
+            session.task.cancel()
+        await self.send_json({'type': 'closed', 'conversation_id': conversation_id})
+
+    async def on_resume(self, conversation_id, data):
+        try:
+            message_id = int(data['message_id'])
+            offset = max(int(data.get('offset', 0)), 0)
+        except (KeyError, TypeError, ValueError):
+            await self.send_error(conversation_id, "resume needs a message_id and an offset")
+            return
+        task = asyncio.create_task(self._resume(conversation_id, message_id, offset))
+        self.resumes.add(task)
+        task.add_done_callback(self.resumes.discard)
+
+    async def disconnect(self):
+        """
+        Detach in-flight generations when the socket goes away: they run to
+        completion and are persisted, so the client can resume them.
+        """
+        self.closed = True
+        for session in self.sessions.values():
+            if session.busy:
+                _detached.add(session.task)
+                session.task.add_done_callback(_detached.discard)
+        self.sessions.clear()
+        for task in list(self.resumes):
+            task.cancel()
+
+    async def _generate(self, conversation_id, session, content):
+        try:
+            await _sync_session(session)
+        except (Conversation.DoesNotExist, ValueError) as e:
+            # Ended or deleted since it was opened (e.g. over HTTP)
+            if self.sessions.get(conversation_id) is session:
+                del self.sessions[conversation_id]
+            await self.send_error(conversation_id, str(e))
+            return
+        user_message, user_data = await _save_message(session.conversation, 'user', content)
+        session.history.append(services.prompt_message(user_message))
+        await self.send_json({'type': 'user_message', 'conversation_id': conversation_id, 'message': user_data})
+
+        # Cancel frames set the session's cancel event, which cancels the deadline too
+        session.ai_service.deadline = Deadline(settings.STREAM_DEADLINE_SECONDS, session.cancel_event)
+        starting = None
+        try:
+            messages = await _prepare_prompt(session.conversation, session.ai_service, list(session.history))
+            # Shielded: a cancel arriving meanwhile must not leave the new row streaming
+            starting = asyncio.ensure_future(_start_ai_message(session.conversation))
+            ai_message, ai_data = await asyncio.shield(starting)
+        except asyncio.CancelledError:
+            if starting is not None:
+                try:
+                    ai_message, ai_data = await starting
+                except Exception:
+                    return
+                await _discard_ai_message(session.conversation, ai_message, session.ai_service)
+            return
+        except Exception as e:
+            await self.send_error(conversation_id, f"Error generating response: {e}")
+            return
+        await self.send_json({'type': 'ai_message_started', 'conversation_id': conversation_id, 'message': ai_data})
+        chunks = []
+        offset = 0
+        persisted_at = time.monotonic()
+        try:
+            async for delta in self._stream(session, messages):
+                await self.send_json({
+                    'type': 'token', 'conversation_id': conversation_id, 'message_id': ai_message.id,
+                    'offset': offset, 'delta': delta
+                })
+                chunks.append(delta)
+                offset += len(delta)
+                if time.monotonic() - persisted_at >= settings.STREAM_PERSIST_INTERVAL:
+                    await sync_to_async(services.save_stream_progress)(ai_message, ''.join(chunks))
+                    persisted_at = time.monotonic()
+        except (asyncio.CancelledError, RequestCancelled):
+            await self._save_partial(conversation_id, session, ai_message, chunks)
+            return
+        except DeadlineExceeded:
+            await self.send_error(conversation_id, "The AI response did not complete within the deadline")
+            await self._save_partial(conversation_id, session, ai_message, chunks)
+            return
+        except Exception as e:
+            await _discard_ai_message(session.conversation, ai_message, session.ai_service)
+            await self.send_error(conversation_id, f"Error generating response: {e}")
+            return
+
+        ai_data = await _finish_ai_message(session.conversation, ai_message, ''.join(chunks), session.ai_service)
+        session.history.append(services.prompt_message(ai_message))
+        await self.send_json({'type': 'ai_message', 'conversation_id': conversation_id, 'message': ai_data})
+
+    async def _save_partial(self, conversation_id, session, ai_message, chunks):
+        """Keep the text of a cut-short generation if PARTIAL_OUTPUT_POLICY says so, else drop its row."""
+        content = partial_output(''.join(chunks))
+        if content is None:
+            await _discard_ai_message(session.conversation, ai_message, session.ai_service)
+            return
+        ai_data = await _finish_ai_message(
+            session.conversation, ai_message, content, session.ai_service, status='interrupted'
+        )
+        session.history.append(services.prompt_message(ai_message))
+        await self.send_json({
+            'type': 'ai_message', 'conversation_id': conversation_id, 'message': ai_data, 'partial': True
+        })
+
+    async def _resume(self, conversation_id, message_id, offset):
+        """
+        Send a streamed reply from `offset` on, following it until it is
+        finished (it may be generated by another worker or connection).
+        """
+        while True:
+            delta, status, message = await _stream_progress(message_id, offset)
+            if delta:
+                await self.send_json({
+                    'type': 'token', 'conversation_id': conversation_id, 'message_id': message_id,
+                    'offset': offset, 'delta': delta
+                })
+                offset += len(delta)
+            if status == 'discarded':
+                await self.send_error(conversation_id, "The response was not kept")
+                return
+            if status != 'streaming':
+                await self.send_json({
+                    'type': 'ai_message', 'conversation_id': conversation_id, 'message': message,
+                    **({'partial': True} if status == 'interrupted' else {})
+                })
+                return
+            await asyncio.sleep(settings.STREAM_RESUME_POLL_SECONDS)
+
+    async def _stream(self, session, messages):
+        """
+        Run the blocking provider stream in a worker thread and yield its
+        chunks on the event loop. Setting the session's cancel event stops
+        the worker and closes the upstream stream.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        cancel_event = session.cancel_event
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # Event loop already closed
+
+        def produce():
+            stream = None
+            try:
+                stream = session.ai_service.stream_response(messages)
+                for chunk in stream:
+                    if cancel_event.is_set():
+                        break
+                    put(chunk)
+            except Exception as e:
+                put(e)
+            finally:
+                close = getattr(stream, 'close', None)
+                if close is not None:
+                    close()
+                put(_DONE)
+
+        loop.run_in_executor(None, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Stops the worker if the consumer gave up early (cancel, disconnect)
+            cancel_event.set()
+
+
+async def chat_websocket(scope, receive, send):
+    """ASGI application serving the chat WebSocket protocol."""
+    # A chat session reads back what it has just written, so it never reads from replicas
+    with db_router.use_primary():
+        await _serve(scope, receive, send)
+
+
+async def _serve(scope, receive, send):
+    consumer = ChatConsumer(send)
+    while True:
+        event = await receive()
+        if event['type'] == 'websocket.connect':
+            await send({'type': 'websocket.accept'})
+        elif event['type'] == 'websocket.receive':
+            text = event.get('text')
+            if text is None and event.get('bytes') is not None:
+                text = event['bytes'].decode('utf-8')
+            await consumer.receive(text)
+        elif event['type'] == 'websocket.disconnect':
+            await consumer.disconnect()
+            return
@@ -1,5 +1,8 @@
 """
 ASGI config for AI Chat Portal project.
+
+HTTP requests go to Django; WebSocket connections on /ws/chat/ are served
+by the chat WebSocket channel.
 """
 
 import os
@@ -8,4 +11,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, as it loads models
+from chat.websocket import WEBSOCKET_PATH, chat_websocket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == WEBSOCKET_PATH:
+            await chat_websocket(scope, receive, send)
+        else:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await django_application(scope, receive, send)
@@ -2,8 +2,10 @@
 Django settings for AI Chat Portal project.
 """
 
+import json
 import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -34,14 +36,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.deadlines.DeadlineMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'chat.db_router.ReplicaPinningMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'chat.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -84,6 +89,40 @@ else:
         }
     }
 
+# Read replicas: DATABASE_REPLICAS lists replica hosts (host or host:port) for PostgreSQL,
+# or database file names for SQLite (kept in sync locally with `manage.py sync_sqlite_replicas`)
+REPLICA_DATABASES = []
+for index, replica in enumerate(filter(None, os.getenv('DATABASE_REPLICAS', '').split(',')), start=1):
+    replica = replica.strip()
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        location = {'NAME': BASE_DIR / replica}
+    else:
+        host, _, port = replica.partition(':')
+        location = {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    alias = f'replica_{index}'
+    DATABASES[alias] = {**DATABASES['default'], **location, 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['chat.db_router.ReplicaRouter']
+# Seconds a client keeps reading from the primary after its own write
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+
+# Cache (shared Redis cache if REDIS_URL is set, otherwise per-process memory)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'chat-portal',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -135,6 +174,8 @@ CORS_ALLOWED_ORIGINS = os.getenv(
     'http://localhost:3000,http://127.0.0.1:3000'
 ).split(',')
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ['ETag', 'Last-Modified', 'Idempotent-Replayed', 'Retry-After']
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'x-request-timeout', 'x-profile')
 
 # AI Configuration
 AI_PROVIDER = os.getenv('AI_PROVIDER', 'lmstudio')
@@ -144,3 +185,87 @@ ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
 LM_STUDIO_BASE_URL = os.getenv('LM_STUDIO_BASE_URL', 'http://localhost:1234/v1')
 LM_STUDIO_API_KEY = os.getenv('LM_STUDIO_API_KEY', 'lm-studio')
+
+# Conversation archival (cold storage)
+ARCHIVE_CODEC = os.getenv('ARCHIVE_CODEC', '')  # zlib, lzma or zstd; empty picks the best available
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', '0'))  # 0 keeps archives forever
+
+# Prompt history cache for active conversations
+HISTORY_CACHE_MAX_CONVERSATIONS = int(os.getenv('HISTORY_CACHE_MAX_CONVERSATIONS', '1000'))
+HISTORY_CACHE_SHARED = os.getenv('HISTORY_CACHE_SHARED', 'False') == 'True'
+
+# Cold start: first request should be served within this many ms of process start
+STARTUP_TARGET_MS = int(os.getenv('STARTUP_TARGET_MS', '3000'))
+
+# Seconds between checks of the shared AI settings version
+AI_SETTINGS_CHECK_INTERVAL = float(os.getenv('AI_SETTINGS_CHECK_INTERVAL', '2'))
+
+# Token accounting and per-conversation budgets
+# Prices per 1k tokens, e.g. {"gpt-4": {"prompt": 0.03, "completion": 0.06, "cached": 0.015}}
+AI_MODEL_PRICES = json.loads(os.getenv('AI_MODEL_PRICES', '{}'))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', '0'))  # 0 disables budgets
+BUDGET_FALLBACK_MODEL = os.getenv('BUDGET_FALLBACK_MODEL', '')
+BUDGET_CONTEXT_MESSAGES = int(os.getenv('BUDGET_CONTEXT_MESSAGES', '20'))
+
+# Latency-aware routing of chat turns between the main and a fast model
+AI_ROUTING_ENABLED = os.getenv('AI_ROUTING_ENABLED', 'False') == 'True'
+AI_FAST_MODEL = os.getenv('AI_FAST_MODEL', '')  # empty keeps the main model and only adjusts max_tokens
+AI_FAST_PROVIDER = os.getenv('AI_FAST_PROVIDER', '')  # empty uses the main provider
+AI_ROUTING_SIMPLE_THRESHOLD = float(os.getenv('AI_ROUTING_SIMPLE_THRESHOLD', '0.3'))
+AI_ROUTING_COMPLEX_THRESHOLD = float(os.getenv('AI_ROUTING_COMPLEX_THRESHOLD', '0.7'))
+AI_ROUTING_MAX_TOKENS = json.loads(os.getenv(
+    'AI_ROUTING_MAX_TOKENS', '{"simple": 300, "standard": 1000, "complex": 2000}'
+))
+
+# Topic extraction: local TF-IDF/RAKE, optionally refined by the LLM
+TOPIC_LLM_REFINEMENT = os.getenv('TOPIC_LLM_REFINEMENT', 'False') == 'True'
+TOPIC_CANDIDATES = int(os.getenv('TOPIC_CANDIDATES', '10'))  # local candidates passed to the LLM
+
+# Summary backfill (manage.py backfill_summaries)
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', '4'))
+BACKFILL_RATE_LIMIT = float(os.getenv('BACKFILL_RATE_LIMIT', '2'))  # provider calls per second, 0 = unlimited
+BACKFILL_CHECKPOINT_PATH = os.getenv('BACKFILL_CHECKPOINT_PATH', str(BASE_DIR / '.backfill_checkpoint.json'))
+
+# Idempotency-Key support for send_message and end_conversation
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))  # seconds a stored response is replayed
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', '300'))  # in-flight claim lifetime
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))  # duplicates wait this long
+
+# Admin change lists: exact COUNT(*) up to this many rows, estimates beyond
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', '100000'))
+
+# Request deadlines passed to AI provider calls as timeouts (0 disables them)
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '60'))
+STREAM_DEADLINE_SECONDS = float(os.getenv('STREAM_DEADLINE_SECONDS', '120'))  # per WebSocket generation
+STREAM_PERSIST_INTERVAL = float(os.getenv('STREAM_PERSIST_INTERVAL', '0.5'))  # seconds between writes of a streaming reply
+STREAM_RESUME_POLL_SECONDS = float(os.getenv('STREAM_RESUME_POLL_SECONDS', '0.25'))
+# Text of a response cut short by cancel, disconnect or deadline: 'discard' or 'save' (with the marker)
+PARTIAL_OUTPUT_POLICY = os.getenv('PARTIAL_OUTPUT_POLICY', 'discard')
+PARTIAL_OUTPUT_MARKER = os.getenv('PARTIAL_OUTPUT_MARKER', '\n\n[Response interrupted]')
+
+# Map-reduce summaries of long conversations (chunk size in estimated tokens)
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '3000'))
+SUMMARY_MAP_WORKERS = int(os.getenv('SUMMARY_MAP_WORKERS', '4'))  # parallel chunk summaries per conversation
+# Regenerate stale summary index nodes on a background thread when conversations end
+SUMMARY_INDEX_BACKGROUND_REFRESH = os.getenv('SUMMARY_INDEX_BACKGROUND_REFRESH', 'True') == 'True'
+SUMMARY_INDEX_REFRESH_INTERVAL = float(os.getenv('SUMMARY_INDEX_REFRESH_INTERVAL', '600'))  # min seconds between refresh passes
+SUMMARY_INDEX_REFRESH_RATE = float(os.getenv('SUMMARY_INDEX_REFRESH_RATE', '0.5'))  # provider calls per second, 0 = unlimited
+
+# Request profiling (stored profiles are listed at /api/profiles/ for admin users)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))  # fraction of requests, 0-1
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')  # X-Profile value that profiles any request
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '200'))
+
+# Typeahead index over titles and topics (process-local, shared invalidation via the cache)
+TYPEAHEAD_CHECK_INTERVAL = float(os.getenv('TYPEAHEAD_CHECK_INTERVAL', '5'))  # seconds between generation checks
+TYPEAHEAD_RECENCY_DAYS = float(os.getenv('TYPEAHEAD_RECENCY_DAYS', '14'))  # recency boost decay
+
+# Near-duplicate detection (MinHash signatures with LSH bands, see chat/dedup.py)
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.8'))  # estimated Jaccard similarity of user messages
+DEDUP_NUM_PERM = int(os.getenv('DEDUP_NUM_PERM', '128'))
+DEDUP_BANDS = int(os.getenv('DEDUP_BANDS', '16'))  # must divide DEDUP_NUM_PERM; re-index after changing
+
+# Search result cache, keyed by a global write generation (seconds to keep a result)
+SEARCH_CACHE_TIMEOUT = int(os.getenv('SEARCH_CACHE_TIMEOUT', '300'))
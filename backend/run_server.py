@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 """
-Simple script to run Django development server.
+Script to run the Django backend.
 This ensures cross-platform compatibility when called from npm scripts.
+
+By default it runs Django's development server. With --prod (or
+SERVER_MODE=production) it runs a pre-forking multi-worker gunicorn server
+instead; see --help for worker, thread and recycling options.
 """
+import argparse
 import os
 import sys
 import platform
@@ -54,16 +59,149 @@ except ImportError as exc:
     print("=" * 70)
     sys.exit(1)
 
-if __name__ == '__main__':
-    # Run migrations first
-    print("🔄 Running database migrations...")
+def pending_migrations():
+    """Whether any migration is unapplied, checked with a single cheap query."""
+    import django
+    django.setup()
+    from chat.startup import migrations_pending
+
+    return migrations_pending()
+
+
+def run_migrations():
+    """Apply migrations, skipping the migrate command when nothing is pending."""
+    print("🔄 Checking database migrations...")
     try:
-        execute_from_command_line(['manage.py', 'migrate', '--noinput'])
-        print("✅ Migrations complete")
+        if pending_migrations():
+            execute_from_command_line(['manage.py', 'migrate', '--noinput'])
+            print("✅ Migrations complete")
+        else:
+            print("✅ Migrations already applied, skipping")
     except Exception as e:
         print(f"⚠️  Warning: Migrations failed - {e}")
         print("   Continuing with server startup...\n")
-    
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the AI Chat Portal backend.')
+    parser.add_argument(
+        '--prod', action='store_true',
+        default=os.getenv('SERVER_MODE', 'development') == 'production',
+        help='Run the pre-forking multi-worker production server (or set SERVER_MODE=production)'
+    )
+    parser.add_argument(
+        '--interface', choices=['asgi', 'wsgi'], default=os.getenv('SERVER_INTERFACE', 'asgi'),
+        help='Serve the ASGI app (HTTP + WebSocket, uvicorn workers) or the WSGI app (threaded workers)'
+    )
+    parser.add_argument(
+        '--bind', default=os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '8000')}"),
+        help='Address to listen on'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1)),
+        help='Number of worker processes (defaults to one per core; more than one requires REDIS_URL)'
+    )
+    parser.add_argument(
+        '--threads', type=int, default=int(os.getenv('WEB_THREADS', '4')),
+        help='Threads per worker (WSGI interface only)'
+    )
+    parser.add_argument(
+        '--max-requests', type=int, default=int(os.getenv('MAX_REQUESTS', '1000')),
+        help='Recycle a worker after this many requests (0 disables)'
+    )
+    parser.add_argument(
+        '--max-requests-jitter', type=int, default=int(os.getenv('MAX_REQUESTS_JITTER', '100')),
+        help='Random jitter added to --max-requests so workers do not restart together'
+    )
+    parser.add_argument(
+        '--graceful-timeout', type=int, default=int(os.getenv('GRACEFUL_TIMEOUT', '30')),
+        help='Seconds a worker gets to drain in-flight requests on reload or shutdown'
+    )
+    parser.add_argument(
+        '--timeout', type=int, default=int(os.getenv('WORKER_TIMEOUT', '120')),
+        help='Seconds before a silent worker is killed and replaced'
+    )
+    parser.add_argument('--skip-migrations', action='store_true', help='Do not check or apply migrations')
+    return parser.parse_args()
+
+
+def run_production(options):
+    """
+    Run a pre-forking gunicorn server. The application is loaded once in the
+    master before forking. SIGHUP reloads workers gracefully, SIGTERM drains
+    in-flight requests before exiting.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("=" * 70)
+        print("ERROR: Production mode requires gunicorn (and uvicorn for ASGI).")
+        print("Install them with: pip install -r requirements.txt")
+        print("=" * 70)
+        sys.exit(1)
+
+    if options.interface == 'asgi':
+        from config.asgi import application
+        worker_class = 'uvicorn.workers.UvicornWorker'
+    else:
+        from config.wsgi import application
+        worker_class = 'gthread'
+
+    # Typeahead invalidation and the AI settings snapshot are coordinated
+    # through the cache, so workers must share one
+    from django.conf import settings
+    backend = settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1]
+    if options.workers > 1 and backend in ('LocMemCache', 'DummyCache'):
+        print("=" * 70)
+        print(f"⚠️  WARNING: the {backend} cache is not shared between worker processes.")
+        print("   Workers would keep stale autocomplete indexes and AI settings.")
+        print("   Set REDIS_URL to run more than one worker. Starting 1 worker.")
+        print("=" * 70)
+        options.workers = 1
+
+    # Do not share the master's database connections with forked workers
+    from django.db import connections
+    connections.close_all()
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            config = {
+                'bind': options.bind,
+                'workers': options.workers,
+                'threads': options.threads,
+                'worker_class': worker_class,
+                'preload_app': True,
+                'max_requests': options.max_requests,
+                'max_requests_jitter': options.max_requests_jitter,
+                'graceful_timeout': options.graceful_timeout,
+                'timeout': options.timeout,
+                'accesslog': '-',
+            }
+            for key, value in config.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    print(f"\n🚀 Starting production server ({options.interface.upper()}) on {options.bind}")
+    print(f"   {options.workers} worker(s), max {options.max_requests} requests per worker")
+    print("   Send SIGHUP to reload gracefully, SIGTERM to drain and stop\n")
+    ProductionServer().run()
+
+
+if __name__ == '__main__':
+    options = parse_args()
+
+    if not options.skip_migrations:
+        run_migrations()
+
+    if options.prod:
+        if platform.system() == 'Windows':
+            print("⚠️  Production mode is not supported on Windows, falling back to the development server")
+        else:
+            run_production(options)
+            sys.exit(0)
+
     # Start the server
     print("\n🚀 Starting Django development server on http://localhost:8000")
     print("   Press Ctrl+C to stop the server\n")
@@ -9,6 +9,7 @@ export interface Message {
   conversation: number;
   content: string;
   sender: 'user' | 'ai';
+  status: 'complete' | 'streaming' | 'interrupted';
   timestamp: string;
 }
 